@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+from time import perf_counter
+
+from rs310p_dc_psu.controller import ETMXXXXP, ETMXXXXPError
+from rs310p_dc_psu.transport import TcpOptions
+from rs310p_dc_psu.simulator import PSUSimulator, SimulatorTcpServer, SimulatorSerialPort
+
+# The TCP options used before the TCP transport was tuned (Nagle's algorithm enabled and no keepalive).
+UNTUNED_TCP_OPTIONS = TcpOptions(noDelay=False, keepAlive=False)
+
+
+def _getPercentile(sortedList, percent):
+    """@param sortedList A sorted list of values.
+       @param percent The percentile (0 - 100).
+       @return The value at the percentile (nearest rank) or None if the list is empty."""
+    if not sortedList:
+        return None
+    index = max(0, min(len(sortedList) - 1, int(round(percent / 100.0 * len(sortedList))) - 1))
+    return sortedList[index]
+
+
+def benchmarkLink(name, port, count, tcpOptions=None):
+    """@brief Measure the round trip time of reading the PSU output (volts, amps and watts).
+       @param name The name of the link shown in the results.
+       @param port The serial port or (address, port) tuple of the PSU.
+       @param count The number of reads.
+       @param tcpOptions The TcpOptions used if the port is a TCP port.
+       @return A dict containing
+               name: The name of the link.
+               count: The number of successful reads.
+               errors: The number of failed reads.
+               meanMS, p50MS, p95MS, maxMS: The round trip time statistics in milliseconds (None if no reads succeeded).
+               link: The link statistics held by the operating system (see ETMXXXXP.getLinkStats()) or None."""
+    psuIF = ETMXXXXP(port, tcpOptions=tcpOptions)
+    if not psuIF.connect():
+        raise ETMXXXXPError(f"Failed to connect to {port}")
+    rttList = []
+    errors = 0
+    try:
+        # The first read includes the time to open the connection.
+        psuIF.getOutputStats()
+        for _ in range(count):
+            startTime = perf_counter()
+            try:
+                psuIF.getOutputStats()
+            except Exception:
+                errors += 1
+                continue
+            rttList.append((perf_counter() - startTime) * 1000.0)
+        linkStats = psuIF.getLinkStats()
+
+    finally:
+        psuIF.disconnect()
+
+    rttList.sort()
+    meanMS = sum(rttList) / len(rttList) if rttList else None
+    return {"name": name,
+            "count": len(rttList),
+            "errors": errors,
+            "meanMS": meanMS,
+            "p50MS": _getPercentile(rttList, 50),
+            "p95MS": _getPercentile(rttList, 95),
+            "maxMS": rttList[-1] if rttList else None,
+            "link": linkStats}
+
+
+def benchmarkTcp(port, count, tcpOptions=None):
+    """@brief Compare the round trip times of a TCP link before and after it is tuned.
+       @param port The (address, port) tuple of the PSU.
+       @param count The number of reads on each link.
+       @param tcpOptions The tuned TcpOptions. If None the default TcpOptions are used.
+       @return A list of the results (see benchmarkLink())."""
+    if tcpOptions is None:
+        tcpOptions = TcpOptions()
+    return [benchmarkLink("TCP (untuned)", port, count, tcpOptions=UNTUNED_TCP_OPTIONS),
+            benchmarkLink("TCP (tuned)", port, count, tcpOptions=tcpOptions)]
+
+
+def benchmarkSimulator(count, baudRate=9600, tcpOptions=None):
+    """@brief Compare the round trip times of a simulated PSU connected over a serial port and over TCP
+              (as through an Esp-Link WiFi serial bridge) with and without the TCP link tuned.
+              The serial link is only measured on platforms with pseudo terminals.
+       @param count The number of reads on each link.
+       @param baudRate The baud rate of the simulated PSU serial interface or 0 to measure only the transport overhead.
+       @param tcpOptions The tuned TcpOptions. If None the default TcpOptions are used.
+       @return A list of the results (see benchmarkLink())."""
+    simulator = PSUSimulator(baudRate=baudRate)
+    resultList = []
+    if SimulatorSerialPort.isSupported():
+        serialPort = SimulatorSerialPort(simulator)
+        serialPort.start()
+        try:
+            resultList.append(benchmarkLink("Serial", serialPort.getPort(), count))
+        finally:
+            serialPort.stop()
+
+    tcpServer = SimulatorTcpServer(simulator)
+    tcpServer.start()
+    try:
+        resultList += benchmarkTcp(tcpServer.getPort(), count, tcpOptions=tcpOptions)
+    finally:
+        tcpServer.stop()
+    return resultList
+
+
+def _formatMS(value):
+    """@param value A time in milliseconds or None.
+       @return The time as shown in the results."""
+    if value is None:
+        return "-"
+    return f"{value:.2f}"
+
+
+def getBenchmarkLines(resultList):
+    """@param resultList A list of the results (see benchmarkLink()).
+       @return A list of lines of text showing a table of the results."""
+    nameWidth = max([len("Link")] + [len(result['name']) for result in resultList])
+    lines = ["{:<{}} {:>6} {:>6} {:>9} {:>9} {:>9} {:>9} {:>12} {:>11}".format(
+        "Link", nameWidth, "Reads", "Errors", "Mean ms", "P50 ms", "P95 ms", "Max ms", "Kernel RTT", "Retransmits")]
+    for result in resultList:
+        link = result['link']
+        lines.append("{:<{}} {:>6} {:>6} {:>9} {:>9} {:>9} {:>9} {:>12} {:>11}".format(
+            result['name'], nameWidth, result['count'], result['errors'], _formatMS(result['meanMS']), _formatMS(result['p50MS']),
+            _formatMS(result['p95MS']), _formatMS(result['maxMS']), _formatMS(link['rttMS']) if link else "-",
+            link['retransmits'] if link else "-"))
+    return lines
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+
+import sys
+import logging
+from time import monotonic, sleep
+
+from rs310p_dc_psu.controller import ETMXXXXPError, ETMXXXXP
+from rs310p_dc_psu.logfile import Reading
+
+
+class ChargeProfile(object):
+    """@brief Holds the settings used to charge a battery."""
+
+    def __init__(self, cvVolts, ccAmps, terminationAmps, preChargeVolts=None, preChargeAmps=None, timeoutSeconds=None):
+        """@brief Constructor
+           @param cvVolts The constant voltage (charge) voltage.
+           @param ccAmps The constant current (charge) current.
+           @param terminationAmps Charging stops when the current falls to this value in the constant voltage stage.
+           @param preChargeVolts If set the battery is charged at preChargeAmps until it reaches this voltage.
+           @param preChargeAmps The pre charge current.
+           @param timeoutSeconds If set charging stops after this many seconds."""
+        if cvVolts <= ETMXXXXP.MIN_VOLTAGE or cvVolts > ETMXXXXP.MAX_VOLTAGE:
+            raise ETMXXXXPError(f"{cvVolts} is an invalid charge voltage (valid range {ETMXXXXP.MIN_VOLTAGE}V - {ETMXXXXP.MAX_VOLTAGE}V).")
+        if ccAmps <= 0 or ccAmps > ETMXXXXP.MAX_CURRENT:
+            raise ETMXXXXPError(f"{ccAmps} is an invalid charge current (valid range 0A - {ETMXXXXP.MAX_CURRENT}A).")
+        if terminationAmps < 0 or terminationAmps >= ccAmps:
+            raise ETMXXXXPError("The termination current must be less than the charge current.")
+        if (preChargeVolts is None) != (preChargeAmps is None):
+            raise ETMXXXXPError("Both the pre charge voltage and current must be set.")
+        if preChargeVolts is not None:
+            if preChargeVolts >= cvVolts:
+                raise ETMXXXXPError("The pre charge voltage must be less than the charge voltage.")
+            if preChargeAmps <= 0 or preChargeAmps > ccAmps:
+                raise ETMXXXXPError("The pre charge current must be greater than 0 and not more than the charge current.")
+        self.cvVolts = cvVolts
+        self.ccAmps = ccAmps
+        self.terminationAmps = terminationAmps
+        self.preChargeVolts = preChargeVolts
+        self.preChargeAmps = preChargeAmps
+        self.timeoutSeconds = timeoutSeconds
+
+
+class ChargeIteration(object):
+    """@brief Holds the state of the charger after a control loop iteration."""
+
+    def __init__(self, stage, reading, ampHours, wattHours, latencySeconds, elapsedSeconds):
+        """@brief Constructor
+           @param stage The charge stage.
+           @param reading The Reading read from the PSU.
+           @param ampHours The charge delivered so far.
+           @param wattHours The energy delivered so far.
+           @param latencySeconds The time taken by the iteration (read, decide and write).
+           @param elapsedSeconds The time since charging started."""
+        self.stage = stage
+        self.reading = reading
+        self.ampHours = ampHours
+        self.wattHours = wattHours
+        self.latencySeconds = latencySeconds
+        self.elapsedSeconds = elapsedSeconds
+
+
+class Charger(object):
+    """@brief Responsible for charging a battery using a fixed rate control loop.
+              Each iteration reads only the output voltage and current, decides the charge stage and
+              writes the voltage and current limit only when they change. The PSU regulates the
+              constant current and constant voltage while the loop handles pre charge, termination,
+              charge/energy accounting and the timeout."""
+
+    PRE_CHARGE = "PRE_CHARGE"
+    CONSTANT_CURRENT = "CC"
+    CONSTANT_VOLTAGE = "CV"
+    COMPLETE = "COMPLETE"
+    # The PSU is in constant voltage mode when the current is below this fraction of the current limit.
+    CV_CURRENT_FRACTION = 0.95
+    # The current must be at or below the termination current for this many iterations to stop charging.
+    TERMINATION_COUNT = 3
+
+    def __init__(self, psuIF, profile, period=1.0):
+        """@brief Constructor
+           @param psuIF The ETMXXXXP instance connected to the PSU.
+           @param profile A ChargeProfile instance.
+           @param period The control loop period in seconds."""
+        if period <= 0:
+            raise ETMXXXXPError("The charge control loop period must be greater than 0.")
+        self._psuIF = psuIF
+        self._profile = profile
+        self._period = period
+        self._stage = None
+        self._stopReason = None
+        self._terminationCount = 0
+        self._ampHours = 0.0
+        self._wattHours = 0.0
+        # The last voltage and current limit written to the PSU.
+        self._volts = None
+        self._amps = None
+        self._writeCount = 0
+        self._iterationCount = 0
+        self._totalLatency = 0.0
+        self._minLatency = None
+        self._maxLatency = None
+        self._overrunCount = 0
+
+    def _getSetpoint(self):
+        """@return A tuple (volts, amps) of the voltage and current limit required for the current stage."""
+        if self._stage == Charger.PRE_CHARGE:
+            return (self._profile.cvVolts, self._profile.preChargeAmps)
+        return (self._profile.cvVolts, self._profile.ccAmps)
+
+    def _applySetpoint(self):
+        """@brief Write the voltage and current limit to the PSU if they have changed."""
+        volts, amps = self._getSetpoint()
+        if volts != self._volts and amps != self._amps:
+            self._psuIF.setVoltageAndCurrentLimit(volts, amps)
+            self._writeCount += 1
+        elif volts != self._volts:
+            self._psuIF.setVoltage(volts)
+            self._writeCount += 1
+        elif amps != self._amps:
+            self._psuIF.setCurrentLimit(amps)
+            self._writeCount += 1
+        self._volts = volts
+        self._amps = amps
+
+    def _updateStage(self, volts, amps, elapsedSeconds):
+        """@brief Decide the charge stage from the latest reading.
+           @param volts The output voltage.
+           @param amps The output current.
+           @param elapsedSeconds The time since charging started."""
+        if self._profile.timeoutSeconds is not None and elapsedSeconds >= self._profile.timeoutSeconds:
+            self._stage = Charger.COMPLETE
+            self._stopReason = "Timeout"
+
+        elif self._stage == Charger.PRE_CHARGE:
+            if volts >= self._profile.preChargeVolts:
+                self._stage = Charger.CONSTANT_CURRENT
+
+        elif self._stage == Charger.CONSTANT_CURRENT:
+            if amps < self._profile.ccAmps * Charger.CV_CURRENT_FRACTION:
+                self._stage = Charger.CONSTANT_VOLTAGE
+
+        elif self._stage == Charger.CONSTANT_VOLTAGE:
+            if amps <= self._profile.terminationAmps:
+                self._terminationCount += 1
+                if self._terminationCount >= Charger.TERMINATION_COUNT:
+                    self._stage = Charger.COMPLETE
+                    self._stopReason = "Termination current reached"
+            else:
+                self._terminationCount = 0
+
+    def _updateLatencyStats(self, latencySeconds):
+        """@brief Update the control loop latency statistics.
+           @param latencySeconds The time taken by an iteration."""
+        self._iterationCount += 1
+        self._totalLatency += latencySeconds
+        if self._minLatency is None or latencySeconds < self._minLatency:
+            self._minLatency = latencySeconds
+        if self._maxLatency is None or latencySeconds > self._maxLatency:
+            self._maxLatency = latencySeconds
+
+    def run(self, iterationCallback=None):
+        """@brief Charge the battery. This blocks until charging is complete. The PSU output is
+                  turned off when charging stops (including on an error or CTRL C).
+           @param iterationCallback If set this is called with a ChargeIteration instance after each iteration."""
+        self._stage = Charger.CONSTANT_CURRENT
+        if self._profile.preChargeVolts is not None:
+            self._stage = Charger.PRE_CHARGE
+        try:
+            self._applySetpoint()
+            self._psuIF.setOutput(True)
+            startTime = monotonic()
+            previousTime = startTime
+            previousVolts = None
+            previousAmps = None
+            nextTime = startTime
+            while self._stage != Charger.COMPLETE:
+                iterationStart = monotonic()
+                volts, amps = self._psuIF.getOutputVoltsAmps()
+                sampleTime = monotonic()
+
+                # Trapezoidal integration of the charge and energy
+                if previousVolts is not None:
+                    hours = (sampleTime - previousTime) / 3600.0
+                    self._ampHours += (amps + previousAmps) / 2.0 * hours
+                    self._wattHours += (volts * amps + previousVolts * previousAmps) / 2.0 * hours
+                previousTime = sampleTime
+                previousVolts = volts
+                previousAmps = amps
+
+                elapsedSeconds = sampleTime - startTime
+                self._updateStage(volts, amps, elapsedSeconds)
+                if self._stage != Charger.COMPLETE:
+                    self._applySetpoint()
+                latencySeconds = monotonic() - iterationStart
+                self._updateLatencyStats(latencySeconds)
+
+                if iterationCallback:
+                    reading = Reading(None, volts, amps, volts * amps)
+                    iterationCallback(ChargeIteration(self._stage, reading, self._ampHours, self._wattHours, latencySeconds, elapsedSeconds))
+
+                if self._stage == Charger.COMPLETE:
+                    break
+
+                nextTime += self._period
+                sleepSeconds = nextTime - monotonic()
+                if sleepSeconds > 0:
+                    sleep(sleepSeconds)
+                else:
+                    # Don't try to catch up if an iteration overruns
+                    self._overrunCount += 1
+                    nextTime = monotonic()
+
+        finally:
+            self._setOutputOff(sys.exc_info()[1])
+
+    def _setOutputOff(self, activeException):
+        """@brief Turn the PSU output off when charging stops. A failed command is logged and
+                  sent again ahead of any other PSU access, as the watchdog does when it trips.
+           @param activeException The exception that stopped charging or None. If set it is not
+                                  hidden by a failure to turn the output off."""
+        try:
+            self._psuIF.setOutput(False)
+        except ETMXXXXPError as ex:
+            logging.getLogger(__name__).warning(f"Failed to turn the PSU output off: {ex}. Retrying.")
+            try:
+                self._psuIF.setOutput(False, urgent=True)
+            except ETMXXXXPError as retryEx:
+                logging.getLogger(__name__).warning(f"Failed to turn the PSU output off: {retryEx}")
+                if activeException is None:
+                    raise
+
+    def getStopReason(self):
+        """@return The reason charging stopped or None if charging did not complete."""
+        return self._stopReason
+
+    def getAmpHours(self):
+        """@return The charge delivered in amp hours."""
+        return self._ampHours
+
+    def getWattHours(self):
+        """@return The energy delivered in watt hours."""
+        return self._wattHours
+
+    def getWriteCount(self):
+        """@return The number of voltage/current limit write commands sent to the PSU."""
+        return self._writeCount
+
+    def getOverrunCount(self):
+        """@return The number of iterations that took longer than the control loop period."""
+        return self._overrunCount
+
+    def getLatencyStats(self):
+        """@return A tuple (min, mean, max) of the control loop iteration latency in seconds or None if no iterations have completed."""
+        if self._iterationCount == 0:
+            return None
+        return (self._minLatency, self._totalLatency / self._iterationCount, self._maxLatency)
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+
+from rs310p_dc_psu.controller import ETMXXXXPError
+from rs310p_dc_psu.logfile import getSegmentList, readMetadata
+from rs310p_dc_psu.samples import SampleStore, loadSamples
+from rs310p_dc_psu.deadband import DEADBAND_KEY
+
+# How the logs are aligned in time.
+# absolute  Each log is plotted at the time it was recorded.
+# start     Each log is plotted from its first reading.
+# trigger   Each log is plotted from the first reading that meets a trigger condition (E.G the output turning on).
+ABSOLUTE = "absolute"
+START = "start"
+TRIGGER = "trigger"
+ALIGN_MODES = (ABSOLUTE, START, TRIGGER)
+
+# The default trigger when logs are aligned to a trigger. This is met by the first reading with the output on.
+DEFAULT_ALIGN_TRIGGER = "volts:above:0.1"
+
+
+class ComparedLog(object):
+    """@brief Holds the readings from a log being compared with other logs along with the summary values
+              (energy, peak current etc) and the time from which the log is plotted."""
+
+    def __init__(self, filename, samples, stepHeld=False):
+        """@brief Constructor
+           @param filename The log file name.
+           @param samples A SampleStore instance holding the readings in the log.
+           @param stepHeld If True each value is held until the next reading (E.G a deadband log)."""
+        self.filename = filename
+        self.samples = samples
+        self.stepHeld = stepHeld
+        # The time (seconds from EPOCH) subtracted from the reading times when plotted.
+        self.alignTime = 0.0
+        # False if the log is aligned to a trigger and the trigger was not found.
+        self.aligned = True
+        self._energyWh = 0.0
+        self._peakAmps = None
+        self._peakWatts = None
+        self._summarise()
+
+    def _summarise(self):
+        """@brief Calculate the summary values."""
+        if len(self.samples) == 0:
+            return
+        times = self.samples.getColumn(SampleStore.TIME)
+        watts = self.samples.getColumn(SampleStore.WATTS)
+        if self.stepHeld:
+            joules = sum(w0 * (t1 - t0) for w0, t0, t1 in zip(watts, times, times[1:]))
+        else:
+            joules = sum((w0 + w1) * (t1 - t0) for w0, w1, t0, t1 in zip(watts, watts[1:], times, times[1:])) / 2.0
+        self._energyWh = joules / 3600.0
+        self._peakAmps = max(self.samples.getColumn(SampleStore.AMPS))
+        self._peakWatts = max(watts)
+
+    def getName(self):
+        """@return The name of the log shown in the plot legend."""
+        return os.path.basename(self.filename)
+
+    def getDuration(self):
+        """@return The time in seconds between the first and last readings."""
+        if len(self.samples) == 0:
+            return 0.0
+        return self.samples.getTime(-1) - self.samples.getTime(0)
+
+    def getEnergyWh(self):
+        """@return The energy delivered in Watt hours."""
+        return self._energyWh
+
+    def getPeakAmps(self):
+        """@return The highest current or None if the log is empty."""
+        return self._peakAmps
+
+    def getPeakWatts(self):
+        """@return The highest power or None if the log is empty."""
+        return self._peakWatts
+
+    def getMeanWatts(self):
+        """@return The mean power over the duration of the log."""
+        duration = self.getDuration()
+        if duration <= 0:
+            return 0.0
+        return self._energyWh * 3600.0 / duration
+
+    def align(self, alignMode, triggerCondition=None):
+        """@brief Set the time from which the log is plotted.
+           @param alignMode absolute, start or trigger.
+           @param triggerCondition A TriggerCondition instance if alignMode is trigger."""
+        self.alignTime = 0.0
+        self.aligned = True
+        if alignMode == ABSOLUTE or len(self.samples) == 0:
+            return
+        self.alignTime = self.samples.getTime(0)
+        if alignMode == TRIGGER:
+            triggerTime = self.findTrigger(triggerCondition)
+            if triggerTime is None:
+                self.aligned = False
+            else:
+                self.alignTime = triggerTime
+
+    def findTrigger(self, triggerCondition):
+        """@param triggerCondition A TriggerCondition instance.
+           @return The time (seconds from EPOCH) of the first reading that meets the condition or None if not found."""
+        previous = None
+        for index, reading in enumerate(self.samples):
+            if triggerCondition.isTriggered(previous, reading):
+                return self.samples.getTime(index)
+            previous = reading
+        return None
+
+    def getTrace(self, column, pointCount):
+        """@brief Get the values of a column to be plotted. When the log holds more readings than the
+                  plot has points the readings are split into buckets and the minimum and maximum
+                  reading in each bucket is plotted so that peaks are not lost.
+           @param column The column name (SampleStore.VOLTS, AMPS or WATTS).
+           @param pointCount The maximum number of points.
+           @return A tuple containing
+                   0: A list of times in seconds from the align time.
+                   1: A list of the values."""
+        times = self.samples.getColumn(SampleStore.TIME)
+        values = self.samples.getColumn(column)
+        alignTime = self.alignTime
+        length = len(times)
+        bucketCount = max(1, pointCount // 2)
+        if length <= bucketCount * 2:
+            traceTimes = [t - alignTime for t in times]
+            traceValues = values.tolist()
+
+        else:
+            traceTimes = []
+            traceValues = []
+            for bucket in range(bucketCount):
+                start = bucket * length // bucketCount
+                bucketValues = values[start:(bucket + 1) * length // bucketCount].tolist()
+                minIndex = bucketValues.index(min(bucketValues))
+                maxIndex = bucketValues.index(max(bucketValues))
+                for index in sorted({minIndex, maxIndex}):
+                    traceTimes.append(times[start + index] - alignTime)
+                    traceValues.append(bucketValues[index])
+
+        return (traceTimes, traceValues)
+
+
+def loadComparedLog(filename, alignMode=START, triggerCondition=None):
+    """@brief Load a log to be compared.
+       @param filename The log file name.
+       @param alignMode absolute, start or trigger.
+       @param triggerCondition A TriggerCondition instance if alignMode is trigger.
+       @return A ComparedLog instance."""
+    if len(getSegmentList(filename)) == 0:
+        raise ETMXXXXPError(f"{filename} not found.")
+    stepHeld = DEADBAND_KEY in readMetadata(filename)
+    comparedLog = ComparedLog(filename, loadSamples(filename), stepHeld=stepHeld)
+    comparedLog.align(alignMode, triggerCondition)
+    return comparedLog
+
+
+def loadComparedLogs(filenameList, alignMode=START, triggerCondition=None, maxWorkers=None):
+    """@brief Load logs to be compared. The logs are loaded in parallel by separate processes.
+       @param filenameList The log file names.
+       @param alignMode absolute, start or trigger.
+       @param triggerCondition A TriggerCondition instance if alignMode is trigger.
+       @param maxWorkers The maximum number of processes or None for the number of CPUs.
+       @return A list of ComparedLog instances in the order of filenameList."""
+    if alignMode not in ALIGN_MODES:
+        raise ETMXXXXPError(f"{alignMode} is an invalid align mode (valid modes {', '.join(ALIGN_MODES)}).")
+    if alignMode == TRIGGER and triggerCondition is None:
+        raise ETMXXXXPError("A trigger condition is required to align logs to a trigger.")
+    if maxWorkers is None:
+        maxWorkers = os.cpu_count() or 1
+    maxWorkers = max(1, min(maxWorkers, len(filenameList)))
+    if maxWorkers == 1:
+        return [loadComparedLog(filename, alignMode, triggerCondition) for filename in filenameList]
+
+    with ProcessPoolExecutor(max_workers=maxWorkers) as executor:
+        futureList = [executor.submit(loadComparedLog, filename, alignMode, triggerCondition) for filename in filenameList]
+        return [future.result() for future in futureList]
+
+
+def getSummaryLines(comparedLogList):
+    """@param comparedLogList A list of ComparedLog instances.
+       @return A list of lines of text showing a table of the summary values of each log."""
+    nameWidth = max([len("Log")] + [len(comparedLog.getName()) for comparedLog in comparedLogList])
+    lines = ["{:<{}} {:>9} {:>10} {:>11} {:>10} {:>10} {:>10}".format(
+        "Log", nameWidth, "Readings", "Duration s", "Energy Wh", "Mean W", "Peak A", "Peak W")]
+    for comparedLog in comparedLogList:
+        line = "{:<{}} {:>9} {:>10.1f} {:>11.4f} {:>10.3f} {:>10.3f} {:>10.3f}".format(
+            comparedLog.getName(), nameWidth, len(comparedLog.samples), comparedLog.getDuration(), comparedLog.getEnergyWh(),
+            comparedLog.getMeanWatts(), comparedLog.getPeakAmps() or 0.0, comparedLog.getPeakWatts() or 0.0)
+        if not comparedLog.aligned:
+            line = line + " (trigger not found)"
+        lines.append(line)
+    return lines
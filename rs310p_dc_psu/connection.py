@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+import threading
+
+from time import perf_counter, sleep
+
+from pymodbus.exceptions import ModbusIOException
+from pymodbus.framer import FramerRTU
+
+from rs310p_dc_psu.controller import ETMXXXXPError, ETMXXXXP
+
+
+class ConnectionStats(object):
+    """@brief Holds the counters and round trip time statistics of a managed PSU connection."""
+
+    def __init__(self):
+        """@brief Constructor"""
+        self.requests = 0
+        self.timeouts = 0
+        self.crcErrors = 0
+        self.connectionErrors = 0
+        self.retries = 0
+        self.reconnects = 0
+        self.failures = 0
+        self.smoothedRTT = None
+        self.rttVariation = None
+        self.responseTimeout = None
+
+    def snapshot(self):
+        """@return A dict of the current values."""
+        return dict(self.__dict__)
+
+
+class ManagedETMXXXXP(ETMXXXXP):
+    """@brief Responsible for managing the connection to the PSU so that a flaky link (E.G USB
+              re enumeration or an Esp-Link WiFi drop) does not end a long unattended run.
+
+              - Reads are retried within a bounded budget. Writes are not retried.
+              - The link is reconnected with an exponential backoff when it fails.
+              - The response timeout is tuned from the measured round trip times
+                (smoothed RTT + 4 x RTT variation, the TCP retransmission timeout method).
+              - Timeouts, CRC failures, connection errors, retries and reconnects are counted."""
+
+    # The modbus client does not retry, this class does.
+    CLIENT_RETRIES = 0
+    # Reconnect when this many consecutive requests fail.
+    RECONNECT_FAILURE_COUNT = 2
+    INITIAL_BACKOFF_SECONDS = 0.5
+    MAX_BACKOFF_SECONDS = 30.0
+
+    def __init__(self, port, slave=1, debug=False, readRetries=2, minTimeout=0.2, maxTimeout=2.0, reconnectSeconds=300.0, tcpOptions=None):
+        """@brief Constructor
+           @param port The port on which to communicate with the PSU. This may be
+                       The local port. E.G /dev/ttyUSB0
+                       The address/port if the PSU is remote.
+           @param slave The unit number on the modbus interface.
+           @param debug If True enable debug logging.
+           @param readRetries The number of times a failed read is retried.
+           @param minTimeout The minimum response timeout in seconds.
+           @param maxTimeout The maximum response timeout in seconds. This is used until round trip times have been measured.
+           @param reconnectSeconds The maximum time to spend trying to reconnect before an error is raised.
+           @param tcpOptions The TcpOptions used if the PSU is remote. If None the default TcpOptions are used."""
+        super().__init__(port, slave=slave, debug=debug, tcpOptions=tcpOptions)
+        self._readRetries = readRetries
+        self._minTimeout = minTimeout
+        self._maxTimeout = maxTimeout
+        self._reconnectSeconds = reconnectSeconds
+        self._stats = ConnectionStats()
+        self._stats.responseTimeout = maxTimeout
+        self._statsLock = threading.Lock()
+        self._reconnectLock = threading.Lock()
+        self._consecutiveFailures = 0
+        self._reconnectRequired = False
+        # The data received during the current request. Requests are executed in the calling thread.
+        self._threadLocal = threading.local()
+
+    def connect(self, timeout=None, retries=CLIENT_RETRIES):
+        """@brief connect to the PSU.
+           @param timeout The initial response timeout in seconds. If None the current response timeout is used.
+           @param retries The number of times the modbus client retries a command.
+           @return True if connected."""
+        if timeout is None:
+            timeout = self._stats.responseTimeout
+        connected = super().connect(timeout=timeout, retries=retries)
+        self._setResponseTimeout(self._stats.responseTimeout)
+        return connected
+
+    def getConnectionStats(self):
+        """@return A dict of the connection counters and round trip time statistics."""
+        with self._statsLock:
+            return self._stats.snapshot()
+
+    def _tracePacket(self, sending, data):
+        """@brief Record the data received in response to each request.
+           @param sending True if the data is being sent to the PSU, False if it was received from the PSU.
+           @param data The bytes sent or received.
+           @return The data to be sent/processed."""
+        if sending:
+            self._threadLocal.received = b''
+        else:
+            self._threadLocal.received = getattr(self._threadLocal, "received", b'') + data
+        return super()._tracePacket(sending, data)
+
+    def _isCRCError(self):
+        """@return True if a response frame was received in the last request but it had a bad CRC."""
+        received = getattr(self._threadLocal, "received", b'')
+        if len(received) < FramerRTU.MIN_SIZE:
+            return False
+        crc = int.from_bytes(received[-2:], byteorder='big')
+        return not FramerRTU.check_CRC(received[:-2], crc)
+
+    def _updateRTT(self, rtt):
+        """@brief Update the round trip time statistics and the response timeout.
+           @param rtt The round trip time of a successful request in seconds."""
+        with self._statsLock:
+            stats = self._stats
+            if stats.smoothedRTT is None:
+                stats.smoothedRTT = rtt
+                stats.rttVariation = rtt / 2.0
+            else:
+                stats.rttVariation = 0.75 * stats.rttVariation + 0.25 * abs(stats.smoothedRTT - rtt)
+                stats.smoothedRTT = 0.875 * stats.smoothedRTT + 0.125 * rtt
+            timeout = stats.smoothedRTT + 4.0 * stats.rttVariation
+            stats.responseTimeout = min(max(timeout, self._minTimeout), self._maxTimeout)
+            self._consecutiveFailures = 0
+        self._setResponseTimeout(stats.responseTimeout)
+
+    def _recordFailure(self, ex):
+        """@brief Record a failed request.
+           @param ex The exception raised by the request."""
+        with self._statsLock:
+            stats = self._stats
+            if isinstance(ex, ModbusIOException):
+                if self._isCRCError():
+                    stats.crcErrors += 1
+                else:
+                    stats.timeouts += 1
+                    # Back off the timeout in case the link has slowed down
+                    stats.responseTimeout = min(stats.responseTimeout * 2.0, self._maxTimeout)
+            else:
+                stats.connectionErrors += 1
+                self._reconnectRequired = True
+            self._consecutiveFailures += 1
+            if self._consecutiveFailures >= ManagedETMXXXXP.RECONNECT_FAILURE_COUNT:
+                self._reconnectRequired = True
+        self._setResponseTimeout(self._stats.responseTimeout)
+
+    def _reconnect(self):
+        """@brief Reconnect to the PSU, backing off between attempts.
+                  An ETMXXXXPError is raised if the PSU cannot be reconnected."""
+        with self._reconnectLock:
+            if not self._reconnectRequired:
+                # Another thread has reconnected
+                return
+            backoffSeconds = ManagedETMXXXXP.INITIAL_BACKOFF_SECONDS
+            startTime = perf_counter()
+            while True:
+                super().disconnect()
+                try:
+                    connected = self.connect()
+                except Exception:
+                    connected = False
+                if connected:
+                    break
+                if perf_counter() - startTime + backoffSeconds > self._reconnectSeconds:
+                    raise ETMXXXXPError(f"Failed to reconnect to {self._port}.")
+                sleep(backoffSeconds)
+                backoffSeconds = min(backoffSeconds * 2.0, ManagedETMXXXXP.MAX_BACKOFF_SECONDS)
+
+            with self._statsLock:
+                self._stats.reconnects += 1
+                self._consecutiveFailures = 0
+                self._reconnectRequired = False
+
+    def _request(self, method, args, retries):
+        """@brief Execute a request, reconnecting and retrying as required.
+           @param method The method that executes the request.
+           @param args The method arguments.
+           @param retries The number of times the request is retried if it fails.
+           @return The value returned by the method."""
+        if self._client is None:
+            raise ETMXXXXPError("Not connected to the PSU.")
+        attempt = 0
+        while True:
+            if self._reconnectRequired:
+                self._reconnect()
+            with self._statsLock:
+                self._stats.requests += 1
+            startTime = perf_counter()
+            try:
+                result = method(*args)
+
+            # The PSU responded with an error so the link is working
+            except ETMXXXXPError:
+                raise
+
+            except Exception as ex:
+                self._recordFailure(ex)
+                if attempt >= retries:
+                    with self._statsLock:
+                        self._stats.failures += 1
+                    raise ETMXXXXPError(f"PSU request failed: {ex}")
+                attempt += 1
+                with self._statsLock:
+                    self._stats.retries += 1
+                continue
+
+            self._updateRTT(perf_counter() - startTime)
+            return result
+
+    def _readRegisters(self, address, count):
+        """@brief Read holding registers from the PSU. Reads are retried if they fail.
+           @param address The address of the first register.
+           @param count The number of registers to read.
+           @return A list of register values."""
+        return self._request(super()._readRegisters, (address, count), self._readRetries)
+
+    def _writeRegister(self, address, value, urgent=False):
+        """@brief Write a holding register in the PSU. Writes are not retried.
+           @param address The address of the register.
+           @param value The value to write.
+           @param urgent If True this write is sent ahead of any other PSU access that is waiting."""
+        self._request(super()._writeRegister, (address, value, urgent), 0)
+
+    def _writeRegisters(self, address, values):
+        """@brief Write several consecutive holding registers in the PSU. Writes are not retried.
+           @param address The address of the first register.
+           @param values A list of the values to write."""
+        self._request(super()._writeRegisters, (address, values), 0)
@@ -1,18 +1,57 @@
 #!/usr/bin/env python3
 
 import logging
+import threading
+from time import perf_counter
 from typing import Tuple, Union
 
 from pymodbus.client.serial import ModbusSerialClient
 from pymodbus.client.tcp import ModbusTcpClient
 from pymodbus.framer import FramerType
 
+from rs310p_dc_psu.instrumentation import Instrumentation
+from rs310p_dc_psu.transport import TcpOptions, getTcpInfo
+
 
 class ETMXXXXPError(Exception):
     """@brief An exception produced by ETMXXXXP class instances."""
     pass
 
 
+class PriorityLock(object):
+    """@brief Responsible for serialising access to the PSU bus. Urgent requests (E.G turning the
+              output off when a safety rule is broken) are granted the lock before any requests
+              that are already waiting for it."""
+
+    def __init__(self):
+        """@brief Constructor"""
+        self._condition = threading.Condition()
+        self._locked = False
+        self._urgentWaiting = 0
+
+    def acquire(self, urgent=False):
+        """@brief Acquire the lock, blocking until it is available.
+           @param urgent If True the lock is granted ahead of any non urgent requests waiting for it."""
+        with self._condition:
+            if urgent:
+                self._urgentWaiting += 1
+                try:
+                    while self._locked:
+                        self._condition.wait()
+                finally:
+                    self._urgentWaiting -= 1
+            else:
+                while self._locked or self._urgentWaiting > 0:
+                    self._condition.wait()
+            self._locked = True
+
+    def release(self):
+        """@brief Release the lock."""
+        with self._condition:
+            self._locked = False
+            self._condition.notify_all()
+
+
 class ETMXXXXP(object):
     """Repsonsible for providing an interface to the ETommens eTM-xxxxP Series PSU.
        Several Mfg's use this supply, Hanmatek HM305P, Rockseed RS305P,
@@ -70,55 +109,220 @@ class ETMXXXXP(object):
     OVER_PWR_PROT_LOW_REG_ADDR = 0x0023     # Bottom 16 bits of over power protection
     BUZZER_REG_ADDR = 0x8804                # 1 = enable (beep on key press), 0 = disable
 
-    def __init__(self, port: Union[str, Tuple[str, int]], slave=1, debug=False):
+    def __init__(self, port: Union[str, Tuple[str, int]], slave=1, debug=False, tcpOptions=None):
         """@brief Constructor
            @param port The port on which to communicate with the PSU. This may be
                        The local port. E.G /dev/ttyUSB0
                        The address/port if the PSU is remote.
-           @param unit The unit number on the modbus interface."""
+           @param unit The unit number on the modbus interface.
+           @param tcpOptions The TcpOptions used if the PSU is remote. If None the default TcpOptions are used."""
         self._port = port
         self._slave = slave
+        if tcpOptions is None:
+            tcpOptions = TcpOptions()
+        self._tcpOptions = tcpOptions
         self._client = None  # Modbus client connection
+        self._busLock = PriorityLock()
+        self._instrumentation = None
+        # The bytes sent and received in the current register operation (when instrumentation is enabled).
+        self._bytesSent = 0
+        self._bytesReceived = 0
 
         if debug:
             logging.basicConfig()
             log = logging.getLogger()
             log.setLevel(logging.DEBUG)
 
-    def connect(self, timeout=2):
+    def connect(self, timeout=2, retries=3):
         """@brief connect to the PSU over the serial port.
            @param timeout The command response timeout in seconds (default=2).
+           @param retries The number of times the modbus client retries a command that gets no response (default=3).
            @return True if connected."""
-        if len(self._port) == 2:
-            self._client = ModbusTcpClient(host=self._port[0], port=self._port[1], framer=FramerType.RTU)
+        if self.isTcp():
+            self._client = ModbusTcpClient(host=self._port[0], port=self._port[1], framer=FramerType.RTU, timeout=timeout, retries=retries,
+                                           trace_packet=self._tracePacket)
+            self._hookConnect(self._client)
         else:
-            self._client = ModbusSerialClient(framer=FramerType.RTU, port=self._port, baudrate=9600, stopbits=1, bytesize=8, parity='N', timeout=timeout)
+            self._client = ModbusSerialClient(framer=FramerType.RTU, port=self._port, baudrate=9600, stopbits=1, bytesize=8, parity='N', timeout=timeout,
+                                              retries=retries, trace_packet=self._tracePacket)
+        self._hookReceive(self._client)
         return self._client.connect()
 
+    def isTcp(self):
+        """@return True if the PSU is connected over TCP (E.G through an Esp-Link WiFi serial bridge)."""
+        return len(self._port) == 2
+
+    def _hookConnect(self, client):
+        """@brief Set the TCP options each time the modbus client opens a socket (it may reconnect itself).
+           @param client The modbus TCP client instance."""
+        connect = client.connect
+
+        def tunedConnect():
+            newSocket = client.socket is None
+            connected = connect()
+            if connected and newSocket:
+                self._tcpOptions.apply(client.socket)
+            return connected
+
+        client.connect = tunedConnect
+
+    def getLinkStats(self):
+        """@return A dict of the link statistics held by the operating system (see transport.getTcpInfo()) or
+                   None if not connected over TCP or the platform does not provide them."""
+        client = self._client
+        if client is None or not self.isTcp():
+            return None
+        sock = client.socket
+        if sock is None:
+            return None
+        return getTcpInfo(sock)
+
+    def _hookReceive(self, client):
+        """@brief Pass all data received by the modbus client to _tracePacket().
+                  The modbus client only traces the data it sends.
+           @param client The modbus client instance."""
+        recv = client.recv
+
+        def tracedRecv(size):
+            data = recv(size)
+            self._tracePacket(False, data)
+            return data
+
+        client.recv = tracedRecv
+
+    def _tracePacket(self, sending, data):
+        """@brief Called with all data sent to and received from the PSU. Subclasses may override this to monitor the link.
+           @param sending True if the data is being sent to the PSU, False if it was received from the PSU.
+           @param data The bytes sent or received.
+           @return The data to be sent/processed."""
+        if self._instrumentation is not None:
+            if sending:
+                self._bytesSent += len(data)
+            else:
+                self._bytesReceived += len(data)
+        return data
+
+    def _setResponseTimeout(self, timeout):
+        """@brief Set the time to wait for a response from the PSU.
+           @param timeout The timeout in seconds."""
+        if self._client:
+            self._client.comm_params.timeout_connect = timeout
+            socket = getattr(self._client, "socket", None)
+            # A serial port read blocks for its timeout
+            if socket is not None and hasattr(socket, "inter_byte_timeout"):
+                socket.timeout = timeout
+
     def disconnect(self):
         """@brief Disconnect from the PSU if connected."""
         if self._client:
             self._client.close()
             self._client = None
 
+    def enableInstrumentation(self, instrumentation=None):
+        """@brief Record the call count, error count, latency histogram and bytes on the wire of every register operation.
+           @param instrumentation The Instrumentation instance to record to. If None a new instance is created.
+           @return The Instrumentation instance."""
+        if instrumentation is None:
+            instrumentation = Instrumentation()
+        self._instrumentation = instrumentation
+        return instrumentation
+
+    def disableInstrumentation(self):
+        """@brief Stop recording register operation statistics."""
+        self._instrumentation = None
+
+    def getInstrumentation(self):
+        """@return The Instrumentation instance or None if instrumentation is not enabled."""
+        return self._instrumentation
+
+    def getInstrumentationSnapshot(self):
+        """@return A dict of the register operation statistics (see Instrumentation.snapshot()) or None if instrumentation is not enabled."""
+        instrumentation = self._instrumentation
+        if instrumentation is None:
+            return None
+        return instrumentation.snapshot()
+
+    def _transact(self, operation, address, count, request, urgent=False):
+        """@brief Execute a modbus client request with exclusive access to the PSU bus.
+           @param operation Instrumentation.READ or Instrumentation.WRITE.
+           @param address The address of the first register.
+           @param count The number of registers.
+           @param request A function that executes the request and returns the response.
+           @param urgent If True the bus is granted ahead of any other PSU access that is waiting.
+           @return The response from the PSU."""
+        instrumentation = self._instrumentation
+        self._busLock.acquire(urgent=urgent)
+        try:
+            if instrumentation is None:
+                return request()
+
+            self._bytesSent = 0
+            self._bytesReceived = 0
+            error = True
+            startTime = perf_counter()
+            try:
+                rr = request()
+                error = rr.isError()
+                return rr
+            finally:
+                instrumentation.recordOperation(operation, address, count, perf_counter() - startTime, error, self._bytesSent, self._bytesReceived)
+
+        finally:
+            self._busLock.release()
+
+    def _readRegisters(self, address, count):
+        """@brief Read holding registers from the PSU.
+           @param address The address of the first register.
+           @param count The number of registers to read.
+           @return A list of register values."""
+        rr = self._transact(Instrumentation.READ, address, count, lambda: self._client.read_holding_registers(address, count=count, slave=self._slave))
+        if rr.isError():
+            raise ETMXXXXPError(f"Failed to read {count} register/s from 0x{address:04x}: {rr}")
+        return rr.registers
+
+    def _writeRegister(self, address, value, urgent=False):
+        """@brief Write a holding register in the PSU.
+           @param address The address of the register.
+           @param value The value to write.
+           @param urgent If True this write is sent ahead of any other PSU access that is waiting."""
+        rr = self._transact(Instrumentation.WRITE, address, 1, lambda: self._client.write_register(address, value, slave=self._slave), urgent=urgent)
+        if rr.isError():
+            raise ETMXXXXPError(f"Failed to write register 0x{address:04x}: {rr}")
+
+    def _writeRegisters(self, address, values):
+        """@brief Write several consecutive holding registers in the PSU in a single command.
+           @param address The address of the first register.
+           @param values A list of the values to write."""
+        rr = self._transact(Instrumentation.WRITE, address, len(values), lambda: self._client.write_registers(address, values, slave=self._slave))
+        if rr.isError():
+            raise ETMXXXXPError(f"Failed to write {len(values)} register/s from 0x{address:04x}: {rr}")
+
     # READ REGS
     def getOutput(self):
         """@brief Get the state of the PSU output.
            @return 1 if the output is on, else 0."""
-        rr = self._client.read_holding_registers(ETMXXXXP.OUTPUT_STATE_REG_ADDR, count=1, slave=self._slave)
-        return rr.registers[0]
+        registers = self._readRegisters(ETMXXXXP.OUTPUT_STATE_REG_ADDR, 1)
+        return registers[0]
 
     def getProtectionState(self):
         """@brief Get the state of the protections switch.
            @return 1 if protection mode is enabled, else 0."""
-        rr = self._client.read_holding_registers(ETMXXXXP.PROTECTION_STATE_REG_ADDR, count=1, slave=self._slave)
-        return rr.registers[0]
+        registers = self._readRegisters(ETMXXXXP.PROTECTION_STATE_REG_ADDR, 1)
+        return registers[0]
+
+    def getOutputAndProtectionState(self):
+        """@brief Read the output and protection state in a single command.
+           @return A tuple containing
+                   0: 1 if the output is on, else 0.
+                   1: The protection state."""
+        registers = self._readRegisters(ETMXXXXP.OUTPUT_STATE_REG_ADDR, 2)
+        return (registers[0], registers[1])
 
     def getModel(self):
         """@brief Get the model ID
            @return The model ID value"""
-        rr = self._client.read_holding_registers(ETMXXXXP.MODEL_ID_REG_ADDR, count=1, slave=self._slave)
-        return rr.registers[0]
+        registers = self._readRegisters(ETMXXXXP.MODEL_ID_REG_ADDR, 1)
+        return registers[0]
 
     def getOutputStats(self):
         """@brief Read the output voltage, current and power of the PSU.
@@ -126,25 +330,39 @@ class ETMXXXXP(object):
                    0: voltage
                    1: amps
                    2: watts"""
-        rr = self._client.read_holding_registers(ETMXXXXP.OUTPUT_VOLTAGE_REG_ADDR, count=4, slave=self._slave)
-        voltage = float(rr.registers[0])
+        registers = self._readRegisters(ETMXXXXP.OUTPUT_VOLTAGE_REG_ADDR, 4)
+        voltage = float(registers[0])
         if voltage > 0:
             voltage = voltage / 100.0
-        amps = float(rr.registers[1])
+        amps = float(registers[1])
         if amps > 0:
             amps = amps / 1000.0
-        wattsH = rr.registers[2]
-        wattsL = rr.registers[3]
+        wattsH = registers[2]
+        wattsL = registers[3]
         watts = wattsH << 16 | wattsL
         if watts > 0:
             watts = watts / 1000.0
         return (voltage, amps, watts)
 
+    def getOutputVoltsAmps(self):
+        """@brief Read the output voltage and current of the PSU. This reads fewer registers than getOutputStats().
+           @return A tuple containing
+                   0: voltage
+                   1: amps"""
+        registers = self._readRegisters(ETMXXXXP.OUTPUT_VOLTAGE_REG_ADDR, 2)
+        voltage = float(registers[0])
+        if voltage > 0:
+            voltage = voltage / 100.0
+        amps = float(registers[1])
+        if amps > 0:
+            amps = amps / 1000.0
+        return (voltage, amps)
+
     def getTargetVolts(self):
         """@brief Read the target output voltage
            @return The output voltage set in volts."""
-        rr = self._client.read_holding_registers(ETMXXXXP.VOLTAGE_TARGET_REG_ADDR, count=1, slave=self._slave)
-        voltage = float(rr.registers[0])
+        registers = self._readRegisters(ETMXXXXP.VOLTAGE_TARGET_REG_ADDR, 1)
+        voltage = float(registers[0])
         if voltage > 0:
             voltage = voltage / 100.0
         return voltage
@@ -152,8 +370,8 @@ class ETMXXXXP(object):
     def getCurrentLimit(self):
         """@brief Read the current limit in amps
            @return The current limit."""
-        rr = self._client.read_holding_registers(ETMXXXXP.CURRENT_LIMIT_REG_ADDR, count=1, slave=self._slave)
-        amps = float(rr.registers[0])
+        registers = self._readRegisters(ETMXXXXP.CURRENT_LIMIT_REG_ADDR, 1)
+        amps = float(registers[0])
         if amps > 0:
             amps = amps / 1000.0
         return amps
@@ -164,15 +382,15 @@ class ETMXXXXP(object):
                    0: over voltage protection value
                    1: over current protection value
                    2: over power protection value"""
-        rr = self._client.read_holding_registers(ETMXXXXP.OVER_VOLTAGE_PROT_REG_ADDR, count=4, slave=self._slave)
-        voltage = float(rr.registers[0])
+        registers = self._readRegisters(ETMXXXXP.OVER_VOLTAGE_PROT_REG_ADDR, 4)
+        voltage = float(registers[0])
         if voltage > 0:
             voltage = voltage / 100.0
-        amps = float(rr.registers[1])
+        amps = float(registers[1])
         if amps > 0:
             amps = amps / 1000.0
-        wattsH = rr.registers[2]
-        wattsL = rr.registers[3]
+        wattsH = registers[2]
+        wattsL = registers[3]
         watts = float(wattsH << 16 | wattsL)
         if watts > 0:
             watts = watts / 1000.0
@@ -181,42 +399,54 @@ class ETMXXXXP(object):
     def getBuzzer(self):
         """@brief Get the state of the buzzer
            @return 1 if enabled, 0 if disabled."""
-        rr = self._client.read_holding_registers(ETMXXXXP.BUZZER_REG_ADDR, count=1, slave=self._slave)
-        return rr.registers[0]
+        registers = self._readRegisters(ETMXXXXP.BUZZER_REG_ADDR, 1)
+        return registers[0]
 
     # WRITE REGS
-    def setOutput(self, on):
+    def setOutput(self, on, urgent=False):
         """@brief Set The PSU output on/off.
-           @param on If True the PSU output is on."""
-        self._client.write_register(ETMXXXXP.OUTPUT_STATE_REG_ADDR, on, slave=self._slave)
+           @param on If True the PSU output is on.
+           @param urgent If True the command is sent ahead of any other PSU access that is waiting."""
+        self._writeRegister(ETMXXXXP.OUTPUT_STATE_REG_ADDR, on, urgent=urgent)
 
     def setVoltage(self, voltage):
         """@brief Set the output voltage.
            @param voltage The voltage in volts (a float value)."""
         if voltage < ETMXXXXP.MIN_VOLTAGE or voltage > ETMXXXXP.MAX_VOLTAGE:
             raise ETMXXXXPError("{} is an invalid voltage (valid range {}V - {}V)".format(voltage, ETMXXXXP.MIN_VOLTAGE, ETMXXXXP.MAX_VOLTAGE))
-        self._client.write_register(ETMXXXXP.VOLTAGE_TARGET_REG_ADDR, int(voltage*100.0), slave=self._slave)
+        self._writeRegister(ETMXXXXP.VOLTAGE_TARGET_REG_ADDR, int(voltage*100.0))
 
     def setCurrentLimit(self, amps):
         """@brief Set the current limit value.
            @param amps The current in amps (a float value)."""
         if amps < 0.0 or amps > ETMXXXXP.MAX_CURRENT:
             raise ETMXXXXPError("{} is an invalid current value (valid range 0A - {}A)".format(amps, ETMXXXXP.MAX_CURRENT))
-        self._client.write_register(ETMXXXXP.CURRENT_LIMIT_REG_ADDR, int(amps*1000.0), slave=self._slave)
+        self._writeRegister(ETMXXXXP.CURRENT_LIMIT_REG_ADDR, int(amps*1000.0))
+
+    def setVoltageAndCurrentLimit(self, voltage, amps):
+        """@brief Set the output voltage and current limit in a single command.
+           @param voltage The voltage in volts (a float value).
+           @param amps The current in amps (a float value)."""
+        if voltage < ETMXXXXP.MIN_VOLTAGE or voltage > ETMXXXXP.MAX_VOLTAGE:
+            raise ETMXXXXPError("{} is an invalid voltage (valid range {}V - {}V)".format(voltage, ETMXXXXP.MIN_VOLTAGE, ETMXXXXP.MAX_VOLTAGE))
+        if amps < 0.0 or amps > ETMXXXXP.MAX_CURRENT:
+            raise ETMXXXXPError("{} is an invalid current value (valid range 0A - {}A)".format(amps, ETMXXXXP.MAX_CURRENT))
+        # The voltage and current limit registers are consecutive.
+        self._writeRegisters(ETMXXXXP.VOLTAGE_TARGET_REG_ADDR, [int(voltage*100.0), int(amps*1000.0)])
 
     def setOverVoltageP(self, voltage):
         """@brief Set the over voltage protection value.
            @param voltage The voltage in volts (a float value)."""
         if voltage < ETMXXXXP.MIN_VOLTAGE or voltage > ETMXXXXP.MAX_OVER_VOLTAGE:
             raise ETMXXXXPError("{} is an invalid voltage (valid range {}V - {}V)".format(voltage, ETMXXXXP.MIN_VOLTAGE, ETMXXXXP.MAX_VMAX_OVER_VOLTAGEOLTAGE))
-        self._client.write_register(ETMXXXXP.OVER_VOLTAGE_PROT_REG_ADDR, int(voltage*100.0), slave=self._slave)
+        self._writeRegister(ETMXXXXP.OVER_VOLTAGE_PROT_REG_ADDR, int(voltage*100.0))
 
     def setOverCurrentP(self, amps):
         """@brief Set the over current protection value.
            @param amps The current in amps (a float value)."""
         if amps < 0.0 or amps > ETMXXXXP.MAX_OVER_CURRENT:
             raise ETMXXXXPError("{} is an invalid voltage (valid range 0V - {}V)".format(amps, ETMXXXXP.MAX_OVER_CURRENT))
-        self._client.write_register(ETMXXXXP.OVER_CURRENT_PROT_REG_ADDR, int(amps*1000.0), slave=self._slave)
+        self._writeRegister(ETMXXXXP.OVER_CURRENT_PROT_REG_ADDR, int(amps*1000.0))
 
     def setOverPowerP(self, watts):
         """@brief Set the over power protection value.
@@ -226,10 +456,10 @@ class ETMXXXXP(object):
         wattValue = int((watts*1000))
         wattsL = wattValue & 0x0000ffff
         wattsH = (wattValue & 0xffff0000) >> 16
-        self._client.write_register(ETMXXXXP.OVER_PWR_PROT_HI_REG_ADDR, wattsH, slave=self._slave)
-        self._client.write_register(ETMXXXXP.OVER_PWR_PROT_LOW_REG_ADDR, wattsL, slave=self._slave)
+        self._writeRegister(ETMXXXXP.OVER_PWR_PROT_HI_REG_ADDR, wattsH)
+        self._writeRegister(ETMXXXXP.OVER_PWR_PROT_LOW_REG_ADDR, wattsL)
 
     def setBuzzer(self, on):
         """@brief Set the buzzer on/off.
            @param on If True the buzzer is set on, 0 = off."""
-        self._client.write_register(ETMXXXXP.BUZZER_REG_ADDR, on, slave=self._slave)
+        self._writeRegister(ETMXXXXP.BUZZER_REG_ADDR, on)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+from time import monotonic
+
+from rs310p_dc_psu.controller import ETMXXXXPError
+
+# The log metadata keys written when a log is recorded with deadbands.
+DEADBAND_KEY = "DEADBAND"
+HEARTBEAT_KEY = "HEARTBEAT"
+
+
+class Deadband(object):
+    """@brief Holds the band within which a channel may change without a reading being recorded.
+              A deadband is defined by a string of the form <channel>:<band>[%]
+              E.G volts:0.02 (an absolute band) or amps:1% (a band relative to the last recorded value)."""
+
+    CHANNELS = ("volts", "amps", "watts")
+
+    @staticmethod
+    def parse(spec):
+        """@brief Create a Deadband from a string.
+           @param spec The <channel>:<band>[%] deadband string.
+           @return A Deadband instance."""
+        elems = spec.split(':')
+        if len(elems) != 2:
+            raise ETMXXXXPError(f"{spec} is an invalid deadband (format <channel>:<band>[%]).")
+        channel = elems[0].strip().lower()
+        bandStr = elems[1].strip()
+        relative = bandStr.endswith('%')
+        if relative:
+            bandStr = bandStr[:-1]
+        try:
+            band = float(bandStr)
+        except ValueError:
+            raise ETMXXXXPError(f"{elems[1]} is an invalid deadband.")
+        return Deadband(channel, band, relative=relative)
+
+    def __init__(self, channel, band, relative=False):
+        """@brief Constructor
+           @param channel The channel (volts, amps or watts).
+           @param band The band. Changes up to this value are not recorded.
+           @param relative If True the band is a percentage of the last recorded value."""
+        if channel not in Deadband.CHANNELS:
+            raise ETMXXXXPError(f"{channel} is an invalid deadband channel (valid channels {', '.join(Deadband.CHANNELS)}).")
+        if band < 0:
+            raise ETMXXXXPError(f"{band} is an invalid deadband (must be 0 or greater).")
+        self.channel = channel
+        self.band = band
+        self.relative = relative
+
+    def isOutside(self, recorded, reading):
+        """@brief Determine if a reading has moved outside the band around the last recorded reading.
+           @param recorded The last recorded Reading instance.
+           @param reading The Reading instance to check.
+           @return True if the reading is outside the band."""
+        recordedValue = getattr(recorded, self.channel)
+        change = abs(getattr(reading, self.channel) - recordedValue)
+        if self.relative:
+            return change > abs(recordedValue) * self.band / 100.0
+        return change > self.band
+
+    def __str__(self):
+        if self.relative:
+            return f"{self.channel}:{self.band}%"
+        return f"{self.channel}:{self.band}"
+
+
+class DeadbandFilter(object):
+    """@brief Responsible for deciding which readings are recorded when only changes are recorded.
+              A reading is recorded when any channel moves outside its deadband (compared with the
+              last recorded reading) or when no reading has been recorded for the heartbeat period.
+              Channels without a deadband are recorded on any change. The signal between recorded
+              readings is held at the last recorded value. When a change is recorded after readings
+              were skipped the last skipped reading is recorded first so the hold ends at the right time."""
+
+    def __init__(self, deadbandList, heartbeatSeconds=60.0):
+        """@brief Constructor
+           @param deadbandList A list of Deadband instances.
+           @param heartbeatSeconds If greater than 0 a reading is recorded at least this often."""
+        self._deadbandList = list(deadbandList)
+        channelList = [deadband.channel for deadband in self._deadbandList]
+        for channel in Deadband.CHANNELS:
+            if channel not in channelList:
+                self._deadbandList.append(Deadband(channel, 0.0))
+        self._heartbeatSeconds = heartbeatSeconds
+        self._recorded = None
+        self._recordedTime = None
+        self._skipped = None
+
+    def getMetadata(self):
+        """@return A list of KEY=VALUE strings describing the filter to be saved in the log."""
+        bandStr = ",".join(str(deadband) for deadband in self._deadbandList)
+        return [f"{DEADBAND_KEY}={bandStr}", f"{HEARTBEAT_KEY}={self._heartbeatSeconds}"]
+
+    def filter(self, reading):
+        """@brief Get the readings to be recorded.
+           @param reading The latest Reading instance.
+           @return A list of the Reading instances to be recorded (empty if the reading is within the deadbands)."""
+        now = monotonic()
+        if self._recorded is None:
+            return self._record(reading, now)
+
+        if self._heartbeatSeconds > 0 and now - self._recordedTime >= self._heartbeatSeconds:
+            return self._record(reading, now)
+
+        for deadband in self._deadbandList:
+            if deadband.isOutside(self._recorded, reading):
+                return self._record(reading, now)
+
+        self._skipped = reading
+        return []
+
+    def _record(self, reading, now):
+        """@brief Record a reading.
+           @param reading The Reading instance.
+           @param now The monotonic() time of the reading.
+           @return A list of the Reading instances to be recorded."""
+        readingList = []
+        if self._skipped is not None:
+            readingList.append(self._skipped)
+            self._skipped = None
+        readingList.append(reading)
+        self._recorded = reading
+        self._recordedTime = now
+        return readingList
+
+    def flush(self):
+        """@brief Get the last skipped reading (if any) so that the log ends at the time of the last reading.
+           @return A list of the Reading instances to be recorded."""
+        readingList = []
+        if self._skipped is not None:
+            readingList.append(self._skipped)
+            self._skipped = None
+        return readingList
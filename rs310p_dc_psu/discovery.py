@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+import os
+import json
+
+from time import time
+from concurrent.futures import ThreadPoolExecutor
+
+import serial.tools.list_ports
+
+from rs310p_dc_psu.controller import ETMXXXXP
+
+# Holds the model ID of the PSU (or None if not a PSU) connected to each USB serial adapter keyed by USB serial number.
+DEFAULT_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".config", "rs310p_dc_psu", "ports.json")
+# The time in seconds for which a port on which no PSU was found is not probed again. A PSU may have been
+# turned off or connected to the adapter since the port was probed.
+NOT_FOUND_CACHE_SECONDS = 60.0
+
+
+class DiscoveredPSU(object):
+    """@brief Holds the details of a PSU found on a serial port."""
+
+    def __init__(self, port, modelID, serialNumber=None, cached=False):
+        """@brief Constructor
+           @param port The serial port device name.
+           @param modelID The model ID read from the PSU.
+           @param serialNumber The USB serial number of the serial port adapter or None if it has no serial number.
+           @param cached True if the PSU was found in the cache rather than by reading the PSU."""
+        self.port = port
+        self.modelID = modelID
+        self.serialNumber = serialNumber
+        self.cached = cached
+
+    def __str__(self):
+        return f"{self.port} model {self.modelID} serial number {self.serialNumber}"
+
+
+def getCandidatePorts():
+    """@return A list of the serial ports (serial.tools.list_ports ListPortInfo instances) that may be connected to a PSU."""
+    return [portInfo for portInfo in serial.tools.list_ports.comports(include_links=False) if portInfo.hwid != 'n/a']
+
+
+def probePort(port, timeout=0.3):
+    """@brief Determine if a PSU is connected to a serial port by reading its model ID.
+       @param port The serial port device name.
+       @param timeout The response timeout in seconds.
+       @return The model ID or None if no PSU responded."""
+    psuIF = ETMXXXXP(port)
+    try:
+        if not psuIF.connect(timeout=timeout, retries=0):
+            return None
+        return psuIF.getModel()
+    except Exception:
+        return None
+    finally:
+        psuIF.disconnect()
+
+
+def _loadCache(cacheFile):
+    """@param cacheFile The cache file.
+       @return The dict held in the cache file (empty if it does not exist or cannot be read)."""
+    try:
+        with open(cacheFile, 'r') as fd:
+            cacheDict = json.load(fd)
+        if isinstance(cacheDict, dict):
+            return cacheDict
+    except (OSError, ValueError):
+        pass
+    return {}
+
+
+def _getCachedModelID(cacheEntry, now):
+    """@param cacheEntry The value held in the cache for a USB serial number.
+       @param now The time now (seconds since the epoch).
+       @return A tuple containing
+               0: True if the cache entry is valid.
+               1: The model ID or None if no PSU was found on the port."""
+    if isinstance(cacheEntry, int):
+        return (True, cacheEntry)
+    # A port on which no PSU was found holds the time it was probed.
+    if isinstance(cacheEntry, dict) and isinstance(cacheEntry.get("notFoundTime"), (int, float)):
+        return (0 <= now - cacheEntry["notFoundTime"] < NOT_FOUND_CACHE_SECONDS, None)
+    return (False, None)
+
+
+def _saveCache(cacheFile, cacheDict):
+    """@brief Save the cache. Errors are ignored as the cache only speeds up discovery.
+       @param cacheFile The cache file.
+       @param cacheDict The dict to save."""
+    try:
+        os.makedirs(os.path.dirname(cacheFile), exist_ok=True)
+        tmpFile = cacheFile + ".tmp"
+        with open(tmpFile, 'w') as fd:
+            json.dump(cacheDict, fd, indent=2)
+        os.replace(tmpFile, cacheFile)
+    except OSError:
+        pass
+
+
+def _probePorts(portInfoList, timeout, maxWorkers, cacheDict, now):
+    """@brief Probe serial ports in parallel and update the cache with the results.
+       @param portInfoList The ports (serial.tools.list_ports ListPortInfo instances) to probe.
+       @param timeout The response timeout in seconds when probing a port.
+       @param maxWorkers The maximum number of ports probed at the same time.
+       @param cacheDict The cache dict to update.
+       @param now The time now (seconds since the epoch).
+       @return A list of (ListPortInfo instance, model ID or None) tuples."""
+    if not portInfoList:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, maxWorkers)) as executor:
+        modelIDList = list(executor.map(lambda portInfo: probePort(portInfo.device, timeout=timeout), portInfoList))
+    for portInfo, modelID in zip(portInfoList, modelIDList):
+        if portInfo.serial_number:
+            cacheDict[portInfo.serial_number] = {"notFoundTime": now} if modelID is None else modelID
+    return list(zip(portInfoList, modelIDList))
+
+
+def discoverPSUs(timeout=0.3, maxWorkers=4, cacheFile=DEFAULT_CACHE_FILE, refresh=False, verify=False):
+    """@brief Find the PSUs connected to the serial ports of this machine. The serial ports are
+              probed in parallel. The result of probing a port with a USB serial number is cached
+              so that later calls return it without accessing the port. A port on which no PSU was
+              found is probed again after NOT_FOUND_CACHE_SECONDS.
+       @param timeout The response timeout in seconds when probing a port.
+       @param maxWorkers The maximum number of ports probed at the same time.
+       @param cacheFile The file used to cache the PSU connected to each USB serial number or None to disable the cache.
+       @param refresh If True probe every port and update the cache. The cache entries of adapters that are
+                      not connected are kept.
+       @param verify If True the ports cached as connected to a PSU are probed to check the PSU is still
+                     connected (E.G before connecting to it). If a PSU is no longer found its cache entry is
+                     replaced and the ports cached as not connected to a PSU are probed again.
+       @return A list of DiscoveredPSU instances sorted by port."""
+    cacheDict = {}
+    if cacheFile:
+        cacheDict = _loadCache(cacheFile)
+
+    psuList = []
+    probeList = []
+    # The ports cached as not connected to a PSU
+    notFoundList = []
+    # The ports cached as connected to a PSU that are probed to verify the PSU is still connected
+    verifyList = []
+    now = time()
+    for portInfo in getCandidatePorts():
+        serialNumber = portInfo.serial_number
+        valid, modelID = _getCachedModelID(cacheDict.get(serialNumber), now) if serialNumber and not refresh else (False, None)
+        if not valid:
+            probeList.append(portInfo)
+        elif verify and modelID is not None:
+            probeList.append(portInfo)
+            verifyList.append(portInfo)
+        elif modelID is not None:
+            psuList.append(DiscoveredPSU(portInfo.device, modelID, serialNumber, cached=True))
+        else:
+            notFoundList.append(portInfo)
+
+    resultList = _probePorts(probeList, timeout, maxWorkers, cacheDict, now)
+    # If a cached PSU has gone it may have been moved to another adapter.
+    if any(modelID is None and portInfo in verifyList for portInfo, modelID in resultList):
+        resultList += _probePorts(notFoundList, timeout, maxWorkers, cacheDict, now)
+        probeList += notFoundList
+    for portInfo, modelID in resultList:
+        if modelID is not None:
+            psuList.append(DiscoveredPSU(portInfo.device, modelID, portInfo.serial_number))
+
+    if probeList and cacheFile:
+        _saveCache(cacheFile, cacheDict)
+
+    psuList.sort(key=lambda psu: psu.port)
+    return psuList
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+import os
+import re
+
+from concurrent.futures import ProcessPoolExecutor
+
+from rs310p_dc_psu.controller import ETMXXXXPError
+from rs310p_dc_psu.logfile import HEADER, getSegmentList, readLines, readMetadata, parseValues
+from rs310p_dc_psu.rollup import TIER_LIST
+
+EXPORT_EXTENSION = ".parquet"
+COMPRESSIONS = ("zstd", "snappy", "gzip", "none")
+# The package extra that installs pyarrow.
+PARQUET_EXTRA = "parquet"
+DEFAULT_COMPRESSION = "zstd"
+# The number of readings held in memory and written to the export file at a time.
+DEFAULT_CHUNK_ROWS = 65536
+
+# The export file metadata key holding the size and modification time of each log segment exported.
+SOURCE_SIGNATURE_KEY = "source_signature"
+SOURCE_KEY = "source"
+
+# The files in a folder that are not logs (closed log segments and rollup tiers).
+_NOT_LOG_PATTERN = re.compile(r"(\.\d+(\.gz)?|\.(" + "|".join(tierName for tierName, _ in TIER_LIST) + r")\.csv)$")
+
+
+def _importPyarrow():
+    """@return The pyarrow and pyarrow.parquet modules."""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ETMXXXXPError(f"The pyarrow module must be installed to export logs (pip install \"rs310p-dc-psu[{PARQUET_EXTRA}]\").")
+    return pyarrow, pyarrow.parquet
+
+
+def getSourceSignature(filename):
+    """@param filename The log file name.
+       @return A string that changes when any segment of the log is added, removed or changed."""
+    elemList = []
+    for segment in getSegmentList(filename):
+        stat = os.stat(segment)
+        elemList.append(f"{os.path.basename(segment)}:{stat.st_size}:{stat.st_mtime_ns}")
+    return ";".join(elemList)
+
+
+def getExportFilename(filename, outputFolder=None):
+    """@param filename The log file name.
+       @param outputFolder The folder to which the export file is written. If None it is written to the folder holding the log.
+       @return The name of the export file."""
+    if outputFolder is None:
+        outputFolder = os.path.dirname(os.path.abspath(filename))
+    name = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(outputFolder, name + EXPORT_EXTENSION)
+
+
+def _isLogFile(filename):
+    """@param filename A file name.
+       @return True if the file starts with the log header."""
+    try:
+        with open(filename, 'r') as fd:
+            return fd.readline() == HEADER
+    except (OSError, UnicodeDecodeError):
+        return False
+
+
+def findLogs(pathList):
+    """@brief Get the logs to be exported.
+       @param pathList A list of log file names and/or folders. All the logs in a folder are exported
+                       (closed log segments are exported as part of their log).
+       @return A list of log file names."""
+    filenameList = []
+    for path in pathList:
+        if os.path.isdir(path):
+            for entry in sorted(os.listdir(path)):
+                filename = os.path.join(path, entry)
+                if os.path.isfile(filename) and not _NOT_LOG_PATTERN.search(entry) and _isLogFile(filename):
+                    filenameList.append(filename)
+
+        elif len(getSegmentList(path)) > 0:
+            filenameList.append(path)
+
+        else:
+            raise ETMXXXXPError(f"{path} not found.")
+    return filenameList
+
+
+def isExported(filename, exportFilename):
+    """@param filename The log file name.
+       @param exportFilename The export file name.
+       @return True if the export file was written from the log as it is now."""
+    if not os.path.isfile(exportFilename):
+        return False
+    _, parquet = _importPyarrow()
+    try:
+        metadata = parquet.read_schema(exportFilename).metadata or {}
+    except Exception:
+        return False
+    signature = metadata.get(SOURCE_SIGNATURE_KEY.encode())
+    return signature is not None and signature.decode() == getSourceSignature(filename)
+
+
+def exportLog(filename, outputFolder=None, compression=DEFAULT_COMPRESSION, chunkRows=DEFAULT_CHUNK_ROWS, force=False):
+    """@brief Export a log (including any rotated and compressed segments) to a Parquet file with a
+              TIME column (local time, microsecond resolution) and VOLTS, AMPS and WATTS float columns.
+              The log metadata (E.G the PSU port, model ID and poll period) is saved as file metadata.
+              The log is read and written chunkRows readings at a time so that a large log is not held
+              in memory. The file is written under a temporary name and renamed when complete.
+       @param filename The log file name.
+       @param outputFolder The folder to which the export file is written. If None it is written to the folder holding the log.
+       @param compression zstd, snappy, gzip or none.
+       @param chunkRows The number of readings written at a time.
+       @param force If True the log is exported even if it has not changed since it was last exported.
+       @return A dict containing
+               filename: The log file name.
+               exportFilename: The export file name.
+               rows: The number of readings exported (0 if skipped).
+               skipped: True if the log has not changed since it was last exported."""
+    if compression not in COMPRESSIONS:
+        raise ETMXXXXPError(f"{compression} is an invalid compression (valid compressions {', '.join(COMPRESSIONS)}).")
+    if len(getSegmentList(filename)) == 0:
+        raise ETMXXXXPError(f"{filename} not found.")
+    pyarrow, parquet = _importPyarrow()
+    exportFilename = getExportFilename(filename, outputFolder)
+    os.makedirs(os.path.dirname(exportFilename), exist_ok=True)
+    if not force and isExported(filename, exportFilename):
+        return {"filename": filename, "exportFilename": exportFilename, "rows": 0, "skipped": True}
+
+    # Read before the log so that a log written while it is exported is exported again next time.
+    signature = getSourceSignature(filename)
+    metadata = {key.lower(): value for key, value in readMetadata(filename).items()}
+    metadata[SOURCE_KEY] = os.path.basename(filename)
+    metadata[SOURCE_SIGNATURE_KEY] = signature
+    schema = pyarrow.schema([("TIME", pyarrow.timestamp("us")),
+                             ("VOLTS", pyarrow.float64()),
+                             ("AMPS", pyarrow.float64()),
+                             ("WATTS", pyarrow.float64())], metadata=metadata)
+
+    tmpFilename = exportFilename + ".tmp"
+    rowCount = 0
+    columnList = ([], [], [], [])
+    try:
+        with parquet.ParquetWriter(tmpFilename, schema, compression=compression) as writer:
+            for line in readLines(filename):
+                values = parseValues(line)
+                if values is None:
+                    continue
+                for column, value in zip(columnList, values):
+                    column.append(value)
+                if len(columnList[0]) >= chunkRows:
+                    writer.write_table(pyarrow.Table.from_arrays(list(columnList), schema=schema))
+                    rowCount += len(columnList[0])
+                    columnList = ([], [], [], [])
+            if columnList[0]:
+                writer.write_table(pyarrow.Table.from_arrays(list(columnList), schema=schema))
+                rowCount += len(columnList[0])
+        os.replace(tmpFilename, exportFilename)
+
+    finally:
+        if os.path.isfile(tmpFilename):
+            os.remove(tmpFilename)
+
+    return {"filename": filename, "exportFilename": exportFilename, "rows": rowCount, "skipped": False}
+
+
+def exportLogs(filenameList, outputFolder=None, compression=DEFAULT_COMPRESSION, chunkRows=DEFAULT_CHUNK_ROWS, force=False, maxWorkers=None):
+    """@brief Export logs (see exportLog()). The logs are exported in parallel by separate processes.
+       @param filenameList The log file names.
+       @param outputFolder The folder to which the export files are written. If None each is written to the folder holding the log.
+       @param compression zstd, snappy, gzip or none.
+       @param chunkRows The number of readings written at a time.
+       @param force If True the logs are exported even if they have not changed since they were last exported.
+       @param maxWorkers The maximum number of processes or None for the number of CPUs.
+       @return A list of the results (see exportLog()) in the order of filenameList."""
+    # Check before any processes are started
+    _importPyarrow()
+    exportFilenameList = [getExportFilename(filename, outputFolder) for filename in filenameList]
+    if len(set(exportFilenameList)) < len(exportFilenameList):
+        raise ETMXXXXPError("More than one log would be exported to the same file. Export them to different folders.")
+    if maxWorkers is None:
+        maxWorkers = os.cpu_count() or 1
+    maxWorkers = max(1, min(maxWorkers, len(filenameList)))
+    if maxWorkers == 1:
+        return [exportLog(filename, outputFolder, compression, chunkRows, force) for filename in filenameList]
+
+    with ProcessPoolExecutor(max_workers=maxWorkers) as executor:
+        futureList = [executor.submit(exportLog, filename, outputFolder, compression, chunkRows, force) for filename in filenameList]
+        return [future.result() for future in futureList]
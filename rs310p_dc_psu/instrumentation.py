@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+import threading
+
+from bisect import bisect_left
+from time import perf_counter
+
+
+class LatencyHistogram(object):
+    """@brief Responsible for holding a histogram of latency values."""
+
+    # The upper limit of each bucket in milliseconds. The last bucket holds all larger values.
+    BUCKET_LIMITS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+    def __init__(self):
+        """@brief Constructor"""
+        self._bucketCounts = [0] * (len(LatencyHistogram.BUCKET_LIMITS_MS) + 1)
+        self._count = 0
+        self._totalMS = 0.0
+        self._minMS = None
+        self._maxMS = None
+
+    def add(self, seconds):
+        """@brief Add a latency value.
+           @param seconds The latency in seconds."""
+        ms = seconds * 1000.0
+        self._bucketCounts[bisect_left(LatencyHistogram.BUCKET_LIMITS_MS, ms)] += 1
+        self._count += 1
+        self._totalMS += ms
+        if self._minMS is None or ms < self._minMS:
+            self._minMS = ms
+        if self._maxMS is None or ms > self._maxMS:
+            self._maxMS = ms
+
+    def getPercentileMS(self, percentile):
+        """@brief Get the upper limit of the bucket holding a percentile.
+           @param percentile The percentile (0 - 100).
+           @return The bucket limit in milliseconds (the max value if in the last bucket) or None if empty."""
+        if self._count == 0:
+            return None
+        threshold = self._count * percentile / 100.0
+        total = 0
+        for index, count in enumerate(self._bucketCounts):
+            total += count
+            if total >= threshold and count > 0:
+                if index < len(LatencyHistogram.BUCKET_LIMITS_MS):
+                    return min(LatencyHistogram.BUCKET_LIMITS_MS[index], self._maxMS)
+                break
+        return self._maxMS
+
+    def snapshot(self):
+        """@return A dict of the histogram values."""
+        bucketDict = {}
+        for index, count in enumerate(self._bucketCounts):
+            if index < len(LatencyHistogram.BUCKET_LIMITS_MS):
+                bucketDict[f"<={LatencyHistogram.BUCKET_LIMITS_MS[index]}ms"] = count
+            else:
+                bucketDict[f">{LatencyHistogram.BUCKET_LIMITS_MS[-1]}ms"] = count
+        meanMS = None
+        if self._count > 0:
+            meanMS = self._totalMS / self._count
+        return {"count": self._count,
+                "meanMS": meanMS,
+                "minMS": self._minMS,
+                "maxMS": self._maxMS,
+                "p50MS": self.getPercentileMS(50),
+                "p95MS": self.getPercentileMS(95),
+                "p99MS": self.getPercentileMS(99),
+                "buckets": bucketDict}
+
+
+class OperationStats(object):
+    """@brief Holds the statistics of a single PSU register operation (E.G read 4 registers from 0x0010)."""
+
+    def __init__(self):
+        """@brief Constructor"""
+        self.calls = 0
+        self.errors = 0
+        self.bytesSent = 0
+        self.bytesReceived = 0
+        self.histogram = LatencyHistogram()
+
+    def snapshot(self):
+        """@return A dict of the statistics."""
+        return {"calls": self.calls,
+                "errors": self.errors,
+                "bytesSent": self.bytesSent,
+                "bytesReceived": self.bytesReceived,
+                "latency": self.histogram.snapshot()}
+
+
+class Instrumentation(object):
+    """@brief Responsible for recording the call count, error count, latency histogram and bytes on the
+              wire of each PSU register operation and the time taken by named sections of code
+              (E.G plotting in the GUI)."""
+
+    READ = "read"
+    WRITE = "write"
+
+    def __init__(self):
+        """@brief Constructor"""
+        self._lock = threading.Lock()
+        self._operationDict = {}
+        self._sectionDict = {}
+
+    def reset(self):
+        """@brief Clear all the statistics."""
+        with self._lock:
+            self._operationDict = {}
+            self._sectionDict = {}
+
+    def recordOperation(self, operation, address, count, seconds, error, bytesSent, bytesReceived):
+        """@brief Record a PSU register operation.
+           @param operation Instrumentation.READ or Instrumentation.WRITE.
+           @param address The address of the first register.
+           @param count The number of registers.
+           @param seconds The time taken by the operation.
+           @param error True if the operation failed.
+           @param bytesSent The number of bytes sent to the PSU.
+           @param bytesReceived The number of bytes received from the PSU."""
+        key = (operation, address, count)
+        with self._lock:
+            operationStats = self._operationDict.get(key)
+            if operationStats is None:
+                operationStats = self._operationDict[key] = OperationStats()
+            operationStats.calls += 1
+            if error:
+                operationStats.errors += 1
+            operationStats.bytesSent += bytesSent
+            operationStats.bytesReceived += bytesReceived
+            operationStats.histogram.add(seconds)
+
+    def recordSection(self, name, seconds):
+        """@brief Record the time taken by a named section of code.
+           @param name The name of the section.
+           @param seconds The time taken."""
+        with self._lock:
+            histogram = self._sectionDict.get(name)
+            if histogram is None:
+                histogram = self._sectionDict[name] = LatencyHistogram()
+            histogram.add(seconds)
+
+    def snapshot(self):
+        """@return A dict containing
+                   operations: A dict keyed by '<operation> 0x<address> x<count>' of operation statistics dicts.
+                   sections: A dict keyed by section name of latency histogram dicts."""
+        with self._lock:
+            operationDict = {}
+            for (operation, address, count), operationStats in sorted(self._operationDict.items()):
+                operationDict[f"{operation} 0x{address:04x} x{count}"] = operationStats.snapshot()
+            sectionDict = {name: histogram.snapshot() for name, histogram in sorted(self._sectionDict.items())}
+        return {"operations": operationDict, "sections": sectionDict}
+
+    def getLines(self):
+        """@return A list of lines of text showing the statistics."""
+        snapshot = self.snapshot()
+        lines = []
+        for name, operationStats in snapshot["operations"].items():
+            latency = operationStats["latency"]
+            lines.append("{:<18} calls {:<6} errors {:<4} mean {:7.1f} ms p95 {:7.1f} ms max {:7.1f} ms tx {} B rx {} B".format(
+                name, operationStats["calls"], operationStats["errors"], latency["meanMS"], latency["p95MS"], latency["maxMS"],
+                operationStats["bytesSent"], operationStats["bytesReceived"]))
+        for name, latency in snapshot["sections"].items():
+            lines.append("{:<18} calls {:<6}             mean {:7.1f} ms p95 {:7.1f} ms max {:7.1f} ms".format(
+                name, latency["count"], latency["meanMS"], latency["p95MS"], latency["maxMS"]))
+        return lines
+
+
+def timed_section(name):
+    """@brief A decorator that records the time taken by a method in the instrumentation of the instance
+              (the _instrumentation attribute). Nothing is recorded if this is None.
+       @param name The name of the section."""
+    def decorator(func):
+        def wrapper(self, *args, **kwargs):
+            instrumentation = self._instrumentation
+            if instrumentation is None:
+                return func(self, *args, **kwargs)
+            startTime = perf_counter()
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                instrumentation.recordSection(name, perf_counter() - startTime)
+        return wrapper
+    return decorator
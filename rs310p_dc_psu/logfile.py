@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import gzip
+import shutil
+import logging
+import threading
+
+from time import time
+from queue import Queue
+from collections import deque
+from datetime import datetime
+
+# The format of the time stamp at the start of each line in a log file.
+TIME_FORMAT = "%d/%m/%Y-%H:%M:%S.%f"
+# The first line written to a log file.
+HEADER = "TIME,VOLTS,AMPS,WATTS\n"
+# Lines starting with this are comments (E.G metadata) and are ignored when a log is loaded.
+COMMENT_PREFIX = "#"
+# The extension added to a compressed log segment.
+COMPRESSED_EXTENSION = ".gz"
+# The metadata keys written to a log recorded from a PSU.
+PORT_KEY = "PORT"
+MODEL_ID_KEY = "MODEL_ID"
+POLL_PERIOD_KEY = "POLL_PERIOD"
+
+
+class Reading(object):
+    """@brief Resonsible for holding a reading value. Large numbers of readings should be held in a
+              SampleStore (see samples.py) which returns Reading instances as views of its samples."""
+
+    __slots__ = ("time", "volts", "amps", "watts")
+
+    def __init__(self, timeStamp, volts, amps, watts):
+        """@brief Constructor
+           @param timeStamp A datetime instance.
+           @param volts The Volts value to be plotted
+           @param amps The Amps value to be plotted
+           @param watts The Watts value to be plotted
+           @param timeStamp The x Value. If None then a timestamp is created."""
+        if timeStamp:
+            self.time = timeStamp
+        else:
+            self.time = datetime.now()
+        self.volts = volts
+        self.amps = amps
+        self.watts = watts
+
+
+def formatLine(reading):
+    """@brief Get the log file line for a reading.
+       @param reading A Reading instance.
+       @return The line (including the line terminator) to be written to the log file."""
+    timeStr = reading.time.strftime(TIME_FORMAT)
+    return "{},{},{},{}\n".format(timeStr, reading.volts, reading.amps, reading.watts)
+
+
+def parseTime(tStr):
+    """@brief Parse a log file time stamp.
+       @param tStr The time stamp string in TIME_FORMAT.
+       @return A datetime instance. ValueError is raised if the string is not a valid time stamp."""
+    # Slicing the fields is much faster than strptime(). strptime() handles any other layout.
+    if len(tStr) == 26 and tStr[2] == '/' and tStr[5] == '/' and tStr[10] == '-' and tStr[19] == '.':
+        return datetime(int(tStr[6:10]), int(tStr[3:5]), int(tStr[0:2]), int(tStr[11:13]), int(tStr[14:16]), int(tStr[17:19]), int(tStr[20:26]))
+    return datetime.strptime(tStr, TIME_FORMAT)
+
+
+def parseValues(line):
+    """@brief Parse a line read from a log file.
+       @param line The line of text.
+       @return A tuple (datetime, volts, amps, watts) or None if the line does not hold a reading (E.G a header line)."""
+    if line.startswith(COMMENT_PREFIX):
+        return None
+    elems = line.split(',')
+    if len(elems) == 4:
+        try:
+            tStr = elems[0]
+            # Ignore header lines
+            if tStr.lower() == 'time':
+                return None
+            if tStr.endswith(":"):
+                tStr = tStr[:-1]
+            return (parseTime(tStr), float(elems[1]), float(elems[2]), float(elems[3]))
+        except ValueError:
+            pass
+    return None
+
+
+def parseLine(line):
+    """@brief Parse a line read from a log file.
+       @param line The line of text.
+       @return A Reading instance or None if the line does not hold a reading (E.G a header line)."""
+    values = parseValues(line)
+    if values is None:
+        return None
+    return Reading(*values)
+
+
+def writeLog(filename, readingList, commentList=None):
+    """@brief Write a complete log file.
+       @param filename The file to create.
+       @param readingList The Reading instances to save.
+       @param commentList An optional list of comment lines to write after the header."""
+    with open(filename, 'w') as fd:
+        fd.write(HEADER)
+        if commentList:
+            for comment in commentList:
+                fd.write("{} {}\n".format(COMMENT_PREFIX, comment))
+        for reading in readingList:
+            fd.write(formatLine(reading))
+
+
+def _getSegmentFilename(filename, number):
+    """@param filename The log file name.
+       @param number The segment number.
+       @return The name of a closed (uncompressed) log segment."""
+    return "{}.{:04d}".format(filename, number)
+
+
+def _getSegmentDict(filename):
+    """@param filename The log file name.
+       @return A dict keyed by segment number of the closed segment file. If both the compressed and
+               uncompressed file exist (compression has not finished) the uncompressed file is used."""
+    logPath = os.path.abspath(filename)
+    folder = os.path.dirname(logPath)
+    pattern = re.compile(re.escape(os.path.basename(logPath)) + r"\.(\d+)(" + re.escape(COMPRESSED_EXTENSION) + ")?$")
+    segmentDict = {}
+    if os.path.isdir(folder):
+        for entry in os.listdir(folder):
+            match = pattern.match(entry)
+            if match:
+                number = int(match.group(1))
+                if number not in segmentDict or not match.group(2):
+                    segmentDict[number] = os.path.join(folder, entry)
+    return segmentDict
+
+
+def getSegmentList(filename):
+    """@brief Get the files that hold a log. Closed segments are named <filename>.0001, <filename>.0002 etc
+              (with a .gz extension once compressed) and the segment being written is <filename>.
+       @param filename The log file name.
+       @return A list of the log files, oldest first."""
+    segmentDict = _getSegmentDict(filename)
+    segmentList = [segmentDict[number] for number in sorted(segmentDict)]
+    if os.path.isfile(filename):
+        segmentList.append(filename)
+    return segmentList
+
+
+def removeSegments(filename):
+    """@brief Delete the closed segments of a log. The segment being written (filename) is not deleted.
+       @param filename The log file name."""
+    for segment in _getSegmentDict(filename).values():
+        os.remove(segment)
+
+
+def _openSegment(segment):
+    """@brief Open a log segment for reading.
+       @param segment The segment file name.
+       @return The open file or None if the segment no longer exists (E.G removed by the retention policy)."""
+    # The segment may be compressed after the segment list was read.
+    for path in (segment, segment + COMPRESSED_EXTENSION):
+        try:
+            if path.endswith(COMPRESSED_EXTENSION):
+                return gzip.open(path, 'rt')
+            return open(path, 'r')
+        except FileNotFoundError:
+            pass
+    return None
+
+
+def readLines(filename):
+    """@brief Read all the lines in a log including any rotated and compressed segments.
+       @param filename The log file name.
+       @return A generator of lines, oldest first."""
+    for segment in getSegmentList(filename):
+        fd = _openSegment(segment)
+        if fd is None:
+            continue
+        with fd:
+            yield from fd
+
+
+def readTailLines(filename, tailBytes=4096):
+    """@brief Read the lines at the end of a file without reading the whole file. A compressed file is read in full.
+       @param filename The file name.
+       @param tailBytes The number of bytes read from the end of an uncompressed file.
+       @return A list of the complete lines in the last tailBytes of the file."""
+    if filename.endswith(COMPRESSED_EXTENSION):
+        with gzip.open(filename, 'rt') as fd:
+            return list(deque(fd, maxlen=tailBytes // 16))
+    with open(filename, 'rb') as fd:
+        fd.seek(0, os.SEEK_END)
+        offset = max(0, fd.tell() - tailBytes)
+        fd.seek(offset)
+        lines = fd.read().decode(errors='replace').splitlines(keepends=True)
+    # The first line read is only a complete line if the file was read from the start.
+    if offset > 0 and lines:
+        lines = lines[1:]
+    return lines
+
+
+def getTimeRange(filename):
+    """@brief Get the time of the first and last readings in a log (including any rotated and compressed segments)
+              without reading the whole log.
+       @param filename The log file name.
+       @return A tuple (first datetime, last datetime) or None if the log holds no readings."""
+    first = None
+    for line in readLines(filename):
+        values = parseValues(line)
+        if values:
+            first = values[0]
+            break
+    if first is None:
+        return None
+    for segment in reversed(getSegmentList(filename)):
+        try:
+            lines = readTailLines(segment)
+        except FileNotFoundError:
+            # Removed by the retention policy
+            continue
+        for line in reversed(lines):
+            values = parseValues(line)
+            if values:
+                return (first, values[0])
+    return (first, first)
+
+
+def readReadings(filename):
+    """@brief Read all the readings in a log including any rotated and compressed segments as a single
+              time series. The segments are read a line at a time so a large log is not held in memory.
+       @param filename The log file name.
+       @return A generator of Reading instances, oldest first."""
+    for line in readLines(filename):
+        reading = parseLine(line)
+        if reading:
+            yield reading
+
+
+def readMetadata(filename):
+    """@brief Read the KEY=VALUE comment lines written after the header of each log segment.
+       @param filename The log file name.
+       @return A dict of the metadata values keyed by KEY. If a key appears in more than one segment the latest value is used."""
+    metadataDict = {}
+    for segment in getSegmentList(filename):
+        fd = _openSegment(segment)
+        if fd is None:
+            continue
+        with fd:
+            for line in fd:
+                if line.startswith(COMMENT_PREFIX):
+                    key, sep, value = line[len(COMMENT_PREFIX):].partition('=')
+                    if sep:
+                        metadataDict[key.strip()] = value.strip()
+                elif parseLine(line):
+                    # The metadata is before the first reading
+                    break
+    return metadataDict
+
+
+class RotatingLogWriter(object):
+    """@brief Responsible for writing readings to a log file that is rotated into numbered segments
+              when it reaches a size or age limit. Closed segments are compressed in a background
+              thread so that writing readings is not delayed and the oldest segments are removed
+              when there are more than the number to be retained."""
+
+    def __init__(self, filename, maxBytes=0, maxSeconds=0, retainCount=0, compress=True, commentList=None):
+        """@brief Constructor
+           @param filename The log file name.
+           @param maxBytes If greater than 0 the log is rotated when it reaches this size.
+           @param maxSeconds If greater than 0 the log is rotated when it has been written for this long.
+           @param retainCount If greater than 0 the number of closed segments that are kept.
+           @param compress If True closed segments are compressed.
+           @param commentList An optional list of comment lines (E.G KEY=VALUE metadata) written after the header of each segment."""
+        self._filename = filename
+        self._commentList = commentList or []
+        self._maxBytes = maxBytes
+        self._maxSeconds = maxSeconds
+        self._retainCount = retainCount
+        self._compress = compress
+        self._fd = None
+        self._openTime = None
+        self._queue = Queue()
+        self._thread = None
+        segmentDict = _getSegmentDict(filename)
+        self._nextNumber = max(segmentDict, default=0) + 1
+        if compress:
+            self._thread = threading.Thread(target=self._compressSegments, daemon=True)
+            self._thread.start()
+            # Compress any segments left uncompressed by a previous run
+            for number in sorted(segmentDict):
+                if not segmentDict[number].endswith(COMPRESSED_EXTENSION):
+                    self._queue.put(segmentDict[number])
+        self._open()
+
+    def _open(self):
+        """@brief Open the log file and write the header."""
+        self._fd = open(self._filename, 'a')
+        self._fd.write(HEADER)
+        for comment in self._commentList:
+            self._fd.write("{} {}\n".format(COMMENT_PREFIX, comment))
+        self._fd.flush()
+        self._openTime = time()
+
+    def _isRotationRequired(self):
+        """@return True if the log file should be rotated."""
+        if self._maxBytes > 0 and self._fd.tell() >= self._maxBytes:
+            return True
+        if self._maxSeconds > 0 and time() - self._openTime >= self._maxSeconds:
+            return True
+        return False
+
+    def _rotate(self):
+        """@brief Close the log file, rename it as the next segment and open a new log file."""
+        self._fd.close()
+        segment = _getSegmentFilename(self._filename, self._nextNumber)
+        os.replace(self._filename, segment)
+        self._nextNumber += 1
+        if self._compress:
+            self._queue.put(segment)
+        else:
+            self._removeOldSegments()
+        self._open()
+
+    def _removeOldSegments(self):
+        """@brief Remove the oldest closed segments if more than retainCount are held."""
+        if self._retainCount > 0:
+            segmentDict = _getSegmentDict(self._filename)
+            for number in sorted(segmentDict)[:-self._retainCount]:
+                try:
+                    os.remove(segmentDict[number])
+                except FileNotFoundError:
+                    pass
+                except OSError as ex:
+                    # Retried on the next rotation
+                    logging.getLogger(__name__).warning(f"Failed to remove {segmentDict[number]}: {ex}")
+
+    def _compressSegments(self):
+        """@brief Compress the segments in the queue. This runs in a background thread until None is received."""
+        while True:
+            segment = self._queue.get()
+            if segment is None:
+                break
+            compressedFile = segment + COMPRESSED_EXTENSION
+            tmpFile = compressedFile + ".tmp"
+            try:
+                with open(segment, 'rb') as src, gzip.open(tmpFile, 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+                # Readers use the uncompressed segment until it is removed.
+                os.replace(tmpFile, compressedFile)
+                os.remove(segment)
+            except FileNotFoundError:
+                # Removed by the retention policy
+                pass
+            except OSError as ex:
+                # E.G disk full. The segment is left uncompressed and later segments are still compressed.
+                logging.getLogger(__name__).warning(f"Failed to compress {segment}: {ex}")
+                try:
+                    os.remove(tmpFile)
+                except OSError:
+                    pass
+            self._removeOldSegments()
+
+    def write(self, reading):
+        """@brief Write a reading to the log, rotating the log first if required.
+           @param reading A Reading instance."""
+        if self._isRotationRequired():
+            self._rotate()
+        self._fd.write(formatLine(reading))
+        self._fd.flush()
+
+    def close(self):
+        """@brief Close the log file and wait for closed segments to be compressed."""
+        if self._fd:
+            self._fd.close()
+            self._fd = None
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+import os
+import math
+
+from rs310p_dc_psu.controller import ETMXXXXPError
+from rs310p_dc_psu.logfile import TIME_FORMAT, getSegmentList, parseValues, readLines, readMetadata
+from rs310p_dc_psu.deadband import DEADBAND_KEY
+from rs310p_dc_psu.samples import toSeconds, toDatetime
+
+# How the readings of each log are resampled onto the merged time grid.
+# nearest  The reading nearest to the grid time.
+# linear   The value interpolated between the readings either side of the grid time.
+# hold     The last reading at or before the grid time.
+NEAREST = "nearest"
+LINEAR = "linear"
+HOLD = "hold"
+MODES = (NEAREST, LINEAR, HOLD)
+
+TOTAL_WATTS_COLUMN = "TOTAL_WATTS"
+
+
+def _readValues(filename):
+    """@brief Read the readings in a log (including any rotated and compressed segments) one at a time.
+       @param filename The log file name.
+       @return A generator of (seconds from EPOCH, volts, amps, watts) tuples."""
+    for line in readLines(filename):
+        values = parseValues(line)
+        if values:
+            yield (toSeconds(values[0]), values[1], values[2], values[3])
+
+
+class _LogCursor(object):
+    """@brief Holds the readings of a log either side of the current grid time. Readings are read
+              from the log as the grid time moves forward so only two readings are held."""
+
+    def __init__(self, filename):
+        """@brief Constructor
+           @param filename The log file name."""
+        self._valuesIterator = _readValues(filename)
+        # A deadband log only holds changes so each value is held until the next reading
+        self.holdValues = DEADBAND_KEY in readMetadata(filename)
+        # The last reading at or before the grid time
+        self.previous = None
+        # The first reading after the grid time
+        self.next = next(self._valuesIterator, None)
+        self.readingCount = 0 if self.next is None else 1
+
+    def advance(self, gridTime):
+        """@brief Read the log until the next reading is after the grid time.
+           @param gridTime The grid time (seconds from EPOCH)."""
+        while self.next is not None and self.next[0] <= gridTime:
+            # A reading earlier than the previous reading (E.G the clock was changed) is ignored.
+            if self.previous is None or self.next[0] >= self.previous[0]:
+                self.previous = self.next
+            self.next = next(self._valuesIterator, None)
+            if self.next is not None:
+                self.readingCount += 1
+
+    def isFinished(self, gridTime):
+        """@param gridTime The grid time (seconds from EPOCH).
+           @return True if there are no readings at or after the grid time."""
+        return self.next is None and (self.previous is None or self.previous[0] < gridTime)
+
+    def getValues(self, gridTime, mode, maxGap=None):
+        """@brief Get the values at the grid time. Values are only available between the first and last
+                  readings of the log. The values of a deadband log are always held and the time between
+                  its readings is not a gap.
+           @param gridTime The grid time (seconds from EPOCH).
+           @param mode nearest, linear or hold.
+           @param maxGap If not None no values are available between readings more than this many seconds apart.
+           @return A (volts, amps, watts) tuple or None if no values are available."""
+        previous = self.previous
+        following = self.next
+        if previous is None:
+            return None
+        if previous[0] == gridTime:
+            return previous[1:]
+        if following is None:
+            return None
+        if self.holdValues:
+            return previous[1:]
+        interval = following[0] - previous[0]
+        if maxGap is not None and interval > maxGap:
+            return None
+        if mode == HOLD:
+            return previous[1:]
+        if mode == NEAREST:
+            if gridTime - previous[0] <= following[0] - gridTime:
+                return previous[1:]
+            return following[1:]
+        fraction = (gridTime - previous[0]) / interval
+        return tuple(previousValue + (followingValue - previousValue) * fraction
+                     for previousValue, followingValue in zip(previous[1:], following[1:]))
+
+
+def getDeviceNames(filenameList):
+    """@param filenameList The log file names.
+       @return A list of the name of each log used in the merged column names (the file name without the extension)."""
+    nameList = []
+    for filename in filenameList:
+        name = os.path.splitext(os.path.basename(filename))[0]
+        uniqueName = name
+        index = 2
+        while uniqueName in nameList:
+            uniqueName = f"{name}_{index}"
+            index += 1
+        nameList.append(uniqueName)
+    return nameList
+
+
+def _formatValue(value):
+    """@param value A float value or None.
+       @return The value as written to the merged file (empty if None)."""
+    if value is None:
+        return ""
+    return f"{value:.6g}"
+
+
+def mergeLogs(filenameList, fd, step=1.0, mode=LINEAR, maxGap=None, overlapOnly=False):
+    """@brief Merge logs recorded by several PSUs (each with its own timestamps and poll jitter) into one
+              CSV file with a row at each point on a common time grid. Each row holds the volts, amps and
+              watts of each log followed by the total power (empty unless every log has a value).
+              No row is written at a grid point where no log has a value (E.G between logs that do
+              not overlap). The logs are read in step (a k-way merge) so only a few readings of each
+              log are held in memory whatever the length of the logs.
+       @param filenameList The log file names.
+       @param fd The file to write the merged CSV data to.
+       @param step The time in seconds between grid points.
+       @param mode How the readings of each log are resampled onto the grid (nearest, linear or hold).
+       @param maxGap If not None no values are written between readings more than this many seconds apart.
+       @param overlapOnly If True the grid only covers the time from the last first reading to the first
+                          last reading of the logs (the time all the logs were recorded).
+       @return A dict containing
+               rows: The number of rows written.
+               readings: A list of the number of readings read from each log."""
+    if mode not in MODES:
+        raise ETMXXXXPError(f"{mode} is an invalid merge mode (valid modes {', '.join(MODES)}).")
+    if step <= 0:
+        raise ETMXXXXPError("The merge step must be greater than 0.")
+    for filename in filenameList:
+        if len(getSegmentList(filename)) == 0:
+            raise ETMXXXXPError(f"{filename} not found.")
+
+    cursorList = [_LogCursor(filename) for filename in filenameList]
+    columnList = ["TIME"]
+    for name in getDeviceNames(filenameList):
+        columnList += [f"{name}_VOLTS", f"{name}_AMPS", f"{name}_WATTS"]
+    columnList.append(TOTAL_WATTS_COLUMN)
+    fd.write(",".join(columnList) + "\n")
+
+    rowCount = 0
+    firstTimeList = [cursor.next[0] for cursor in cursorList if cursor.next is not None]
+    if overlapOnly and len(firstTimeList) < len(cursorList):
+        # An empty log does not overlap the others
+        firstTimeList = []
+    if firstTimeList:
+        # Start the grid on a whole multiple of the step
+        if overlapOnly:
+            startTime = math.ceil(max(firstTimeList) / step) * step
+        else:
+            startTime = math.ceil(min(firstTimeList) / step) * step
+        gridIndex = 0
+        while True:
+            # Multiplied rather than summed so the grid times do not drift
+            gridTime = startTime + gridIndex * step
+            for cursor in cursorList:
+                cursor.advance(gridTime)
+            if overlapOnly:
+                if any(cursor.isFinished(gridTime) for cursor in cursorList):
+                    break
+            elif all(cursor.isFinished(gridTime) for cursor in cursorList):
+                break
+            valuesList = [cursor.getValues(gridTime, mode, maxGap) for cursor in cursorList]
+            if all(values is None for values in valuesList):
+                # No log has a value until the next reading of one of the logs so skip the grid points before it
+                nextTime = min(cursor.next[0] for cursor in cursorList if cursor.next is not None)
+                gridIndex = max(gridIndex + 1, math.ceil((nextTime - startTime) / step))
+                continue
+            elemList = [toDatetime(gridTime).strftime(TIME_FORMAT)]
+            totalWatts = 0.0
+            for values in valuesList:
+                if values is None:
+                    elemList += ["", "", ""]
+                    totalWatts = None
+                else:
+                    elemList += [_formatValue(value) for value in values]
+                    if totalWatts is not None:
+                        totalWatts += values[2]
+            elemList.append(_formatValue(totalWatts))
+            fd.write(",".join(elemList) + "\n")
+            rowCount += 1
+            gridIndex += 1
+
+    return {"rows": rowCount,
+            "readings": [cursor.readingCount for cursor in cursorList]}
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+
+import threading
+
+from time import time, perf_counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class DeviceMetrics(object):
+    """@brief Holds the latest reading and the poller health of a PSU. This is updated by the
+              poller and read when the metrics are scraped so a scrape never accesses the PSU."""
+
+    # The weight given to each new poll interval in the poll rate and jitter averages.
+    SMOOTHING = 0.1
+    # The output and protection state rarely change so they are read from the PSU at most this often
+    # rather than with every reading.
+    STATE_READ_SECONDS = 5.0
+
+    def __init__(self, device, connectionStatsMethod=None):
+        """@brief Constructor
+           @param device The name of the device (E.G the serial port).
+           @param connectionStatsMethod If set a method that returns a dict of connection counters
+                                        (see ManagedETMXXXXP.getConnectionStats())."""
+        self._device = device
+        self._connectionStatsMethod = connectionStatsMethod
+        self._lock = threading.Lock()
+        self._volts = None
+        self._amps = None
+        self._watts = None
+        self._output = None
+        self._protection = None
+        self._sampleTime = None
+        self._pollCount = 0
+        self._errorCount = 0
+        self._lastPollTime = None
+        self._meanInterval = None
+        self._jitter = None
+        self._stateReadTime = None
+
+    def getDevice(self):
+        """@return The name of the device."""
+        return self._device
+
+    def update(self, volts, amps, watts, output=None, protection=None):
+        """@brief Update the metrics with a reading. This should be called by the poller for every reading.
+           @param volts The output voltage.
+           @param amps The output current.
+           @param watts The output power.
+           @param output The output state (1 = on, 0 = off) or None if not read.
+           @param protection The protection state or None if not read."""
+        now = perf_counter()
+        with self._lock:
+            self._volts = volts
+            self._amps = amps
+            self._watts = watts
+            if output is not None:
+                self._output = output
+            if protection is not None:
+                self._protection = protection
+            self._sampleTime = time()
+            self._pollCount += 1
+            if self._lastPollTime is not None:
+                interval = now - self._lastPollTime
+                if self._meanInterval is None:
+                    self._meanInterval = interval
+                    self._jitter = 0.0
+                else:
+                    self._jitter += DeviceMetrics.SMOOTHING * (abs(interval - self._meanInterval) - self._jitter)
+                    self._meanInterval += DeviceMetrics.SMOOTHING * (interval - self._meanInterval)
+            self._lastPollTime = now
+
+    def isStateReadDue(self):
+        """@brief Check if the poller should read the output and protection state. If True is returned the
+                  state is not due again for STATE_READ_SECONDS whether or not the read succeeds.
+           @return True if the state should be read."""
+        now = perf_counter()
+        with self._lock:
+            if self._stateReadTime is not None and now - self._stateReadTime < DeviceMetrics.STATE_READ_SECONDS:
+                return False
+            self._stateReadTime = now
+            return True
+
+    def recordError(self):
+        """@brief Record a failed poll."""
+        with self._lock:
+            self._errorCount += 1
+
+    def getValues(self):
+        """@return A dict of the metric values keyed by metric name. A value is None if not known."""
+        with self._lock:
+            valueDict = {"psu_volts": self._volts,
+                         "psu_amps": self._amps,
+                         "psu_watts": self._watts,
+                         "psu_output_on": self._output,
+                         "psu_protection_state": self._protection,
+                         "psu_last_sample_timestamp_seconds": self._sampleTime,
+                         "psu_polls_total": self._pollCount,
+                         "psu_poll_errors_total": self._errorCount,
+                         "psu_poll_rate_hz": 1.0 / self._meanInterval if self._meanInterval else None,
+                         "psu_poll_jitter_seconds": self._jitter}
+        if self._connectionStatsMethod:
+            stats = self._connectionStatsMethod()
+            valueDict["psu_link_requests_total"] = stats['requests']
+            valueDict["psu_link_timeouts_total"] = stats['timeouts']
+            valueDict["psu_link_crc_errors_total"] = stats['crcErrors']
+            valueDict["psu_link_connection_errors_total"] = stats['connectionErrors']
+            valueDict["psu_link_retries_total"] = stats['retries']
+            valueDict["psu_link_reconnects_total"] = stats['reconnects']
+            valueDict["psu_link_round_trip_seconds"] = stats['smoothedRTT']
+        return valueDict
+
+
+class MetricsRegistry(object):
+    """@brief Holds the DeviceMetrics of each PSU and renders them in the Prometheus text format."""
+
+    HELP_DICT = {"psu_volts": ("gauge", "The latest output voltage."),
+                 "psu_amps": ("gauge", "The latest output current."),
+                 "psu_watts": ("gauge", "The latest output power."),
+                 "psu_output_on": ("gauge", "1 if the PSU output is on, 0 if off."),
+                 "psu_protection_state": ("gauge", "The PSU protection state register."),
+                 "psu_last_sample_timestamp_seconds": ("gauge", "The time of the latest reading (seconds since the epoch)."),
+                 "psu_polls_total": ("counter", "The number of successful polls."),
+                 "psu_poll_errors_total": ("counter", "The number of failed polls."),
+                 "psu_poll_rate_hz": ("gauge", "The average poll rate."),
+                 "psu_poll_jitter_seconds": ("gauge", "The average deviation of the poll interval from the average poll interval."),
+                 "psu_link_requests_total": ("counter", "The number of requests sent to the PSU."),
+                 "psu_link_timeouts_total": ("counter", "The number of requests that timed out."),
+                 "psu_link_crc_errors_total": ("counter", "The number of responses with a bad CRC."),
+                 "psu_link_connection_errors_total": ("counter", "The number of connection errors."),
+                 "psu_link_retries_total": ("counter", "The number of retried requests."),
+                 "psu_link_reconnects_total": ("counter", "The number of times the PSU was reconnected."),
+                 "psu_link_round_trip_seconds": ("gauge", "The smoothed request round trip time.")}
+
+    def __init__(self):
+        """@brief Constructor"""
+        self._lock = threading.Lock()
+        self._deviceMetricsList = []
+
+    def add(self, deviceMetrics):
+        """@brief Add the metrics of a PSU. Any previous metrics for the same device are replaced.
+           @param deviceMetrics A DeviceMetrics instance."""
+        with self._lock:
+            self._deviceMetricsList = [dm for dm in self._deviceMetricsList if dm.getDevice() != deviceMetrics.getDevice()]
+            self._deviceMetricsList.append(deviceMetrics)
+
+    def remove(self, deviceMetrics):
+        """@brief Remove the metrics of a PSU.
+           @param deviceMetrics A DeviceMetrics instance."""
+        with self._lock:
+            self._deviceMetricsList = [dm for dm in self._deviceMetricsList if dm is not deviceMetrics]
+
+    @staticmethod
+    def _escape(value):
+        """@return The value escaped for use as a Prometheus label value."""
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def render(self):
+        """@return The metrics in the Prometheus text format."""
+        with self._lock:
+            deviceMetricsList = list(self._deviceMetricsList)
+        sampleDict = {}
+        for deviceMetrics in deviceMetricsList:
+            label = MetricsRegistry._escape(deviceMetrics.getDevice())
+            for name, value in deviceMetrics.getValues().items():
+                if value is not None:
+                    sampleDict.setdefault(name, []).append(f'{name}{{device="{label}"}} {value}')
+        lines = []
+        for name, (metricType, helpText) in MetricsRegistry.HELP_DICT.items():
+            if name in sampleDict:
+                lines.append(f"# HELP {name} {helpText}")
+                lines.append(f"# TYPE {name} {metricType}")
+                lines.extend(sampleDict[name])
+        return "\n".join(lines) + "\n"
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    """@brief Serves the metrics held by the server's MetricsRegistry."""
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Don't log every scrape
+        pass
+
+
+class MetricsServer(object):
+    """@brief Responsible for serving the metrics in a MetricsRegistry over HTTP (at /metrics) in the
+              Prometheus text format. The server runs in a background thread."""
+
+    def __init__(self, registry, address, port):
+        """@brief Constructor
+           @param registry The MetricsRegistry instance.
+           @param address The address to bind the server to.
+           @param port The TCP port to bind the server to."""
+        self._registry = registry
+        self._address = address
+        self._port = port
+        self._httpServer = None
+
+    def start(self):
+        """@brief Start serving the metrics."""
+        self._httpServer = ThreadingHTTPServer((self._address, self._port), _MetricsRequestHandler)
+        self._httpServer.daemon_threads = True
+        self._httpServer.registry = self._registry
+        threading.Thread(target=self._httpServer.serve_forever, daemon=True).start()
+
+    def stop(self):
+        """@brief Stop serving the metrics."""
+        if self._httpServer:
+            self._httpServer.shutdown()
+            self._httpServer.server_close()
+            self._httpServer = None
+
+    def getURL(self):
+        """@return The URL of the metrics."""
+        return f"http://{self._address}:{self._port}/metrics"
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import pstats
+import cProfile
+import threading
+
+from time import sleep, perf_counter
+
+
+class ThreadProfiler(object):
+    """@brief Responsible for profiling every function call (cProfile) in the thread that calls start()
+              and in all threads started while profiling (E.G the GUI worker threads). Threads that
+              were already running when start() was called are not profiled. The saved file can be
+              read with the pstats module or tools such as snakeviz."""
+
+    def __init__(self):
+        """@brief Constructor"""
+        self._lock = threading.Lock()
+        self._profile = cProfile.Profile()
+        self._threadProfileList = []
+        # Holds the profile of each thread started while profiling.
+        self._threadLocal = threading.local()
+        self._running = False
+
+    def _startThreadProfile(self, frame, event, arg):
+        """@brief Called (as the profile function set by threading.setprofile()) when a thread starts.
+                  The thread profile replaces this profile function. A profile can only be disabled
+                  in its own thread so a trace function checks if profiling has stopped each time
+                  the thread calls a function."""
+        profile = cProfile.Profile()
+        with self._lock:
+            if not self._running:
+                sys.setprofile(None)
+                return
+            self._threadProfileList.append(profile)
+        self._threadLocal.profile = profile
+        sys.settrace(self._checkThreadStopped)
+        profile.enable()
+
+    def _checkThreadStopped(self, frame, event, arg):
+        """@brief Called (as the trace function of a profiled thread) when the thread calls a function.
+                  Disables the thread profile once profiling has stopped.
+           @return None so that the lines in the function are not traced."""
+        if not self._running:
+            sys.settrace(None)
+            self._threadLocal.profile.disable()
+        return None
+
+    def start(self):
+        """@brief Start profiling."""
+        self._running = True
+        # From python 3.12 cProfile uses sys.monitoring which records the calls in all threads.
+        if sys.version_info < (3, 12):
+            threading.setprofile(self._startThreadProfile)
+        self._profile.enable()
+
+    def stop(self):
+        """@brief Stop profiling. This must be called from the thread that called start(). Each thread
+                  started while profiling disables its profile the next time it calls a function."""
+        self._profile.disable()
+        if sys.version_info < (3, 12):
+            threading.setprofile(None)
+        with self._lock:
+            self._running = False
+
+    def isRunning(self):
+        """@return True if profiling."""
+        return self._running
+
+    def getStats(self):
+        """@return A pstats.Stats instance holding the calls made in all the profiled threads."""
+        stats = pstats.Stats(self._profile)
+        with self._lock:
+            threadProfileList = list(self._threadProfileList)
+        for profile in threadProfileList:
+            stats.add(profile)
+        return stats
+
+    def save(self, filename):
+        """@brief Save the profile.
+           @param filename The file to save the profile to."""
+        self.getStats().dump_stats(filename)
+
+    def getLines(self, count=10):
+        """@param count The number of functions to show.
+           @return A list of lines of text showing the functions with the most cumulative time."""
+        stats = self.getStats()
+        totalTime = stats.total_tt
+        lines = []
+        for (filename, lineNumber, functionName), (_, callCount, _, cumulativeTime, _) in \
+                sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:count]:
+            percentage = 100.0 * cumulativeTime / totalTime if totalTime > 0 else 0.0
+            lines.append("{:6.1f}% {:9.3f} s calls {:<8} {}:{}({})".format(
+                percentage, cumulativeTime, callCount, os.path.basename(filename), lineNumber, functionName))
+        return lines
+
+
+class SamplingProfiler(object):
+    """@brief Responsible for profiling by periodically sampling the stack of every running thread
+              (including threads that were running before profiling started). The overhead is low
+              and independent of the number of function calls. The saved file holds one line per
+              unique stack (the thread name then the functions separated by ; and then the sample
+              count) which can be read by flame graph tools such as flamegraph.pl or speedscope."""
+
+    def __init__(self, interval=0.005, duration=None):
+        """@brief Constructor
+           @param interval The time in seconds between samples.
+           @param duration If not None profiling stops after this many seconds."""
+        self._interval = interval
+        self._duration = duration
+        self._lock = threading.Lock()
+        # The sample count of each stack keyed by stack string
+        self._stackDict = {}
+        self._sampleCount = 0
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        """@brief Start profiling."""
+        self._running = True
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """@brief Stop profiling."""
+        self._running = False
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def isRunning(self):
+        """@return True if profiling (False once the duration has elapsed)."""
+        return self._running
+
+    def _getFunctionName(self, frame):
+        """@param frame A stack frame.
+           @return The name of the function executing in the frame."""
+        code = frame.f_code
+        return f"{os.path.basename(code.co_filename)}:{code.co_name}".replace(';', ':')
+
+    def _sample(self):
+        """@brief Sample the thread stacks until stopped. This runs in a background thread."""
+        ownThreadID = threading.get_ident()
+        startTime = perf_counter()
+        while self._running:
+            threadNameDict = {thread.ident: thread.name for thread in threading.enumerate()}
+            sampleDict = {}
+            for threadID, frame in sys._current_frames().items():
+                if threadID == ownThreadID:
+                    continue
+                functionList = []
+                while frame is not None:
+                    functionList.append(self._getFunctionName(frame))
+                    frame = frame.f_back
+                functionList.append(threadNameDict.get(threadID, str(threadID)))
+                stack = ";".join(reversed(functionList))
+                sampleDict[stack] = sampleDict.get(stack, 0) + 1
+
+            with self._lock:
+                for stack, count in sampleDict.items():
+                    self._stackDict[stack] = self._stackDict.get(stack, 0) + count
+                self._sampleCount += 1
+
+            if self._duration is not None and perf_counter() - startTime >= self._duration:
+                self._running = False
+                break
+            sleep(self._interval)
+
+    def getSampleCount(self):
+        """@return The number of times the thread stacks have been sampled."""
+        return self._sampleCount
+
+    def save(self, filename):
+        """@brief Save the profile.
+           @param filename The file to save the profile to."""
+        with self._lock:
+            stackList = sorted(self._stackDict.items())
+        with open(filename, 'w') as fd:
+            for stack, count in stackList:
+                fd.write(f"{stack} {count}\n")
+
+    def getLines(self, count=10):
+        """@param count The number of functions to show.
+           @return A list of lines of text showing the functions found in the most samples. Self is the
+                   percentage of samples in which the function was executing (rather than calling another function)."""
+        totalDict = {}
+        selfDict = {}
+        with self._lock:
+            sampleCount = self._sampleCount
+            for stack, stackCount in self._stackDict.items():
+                # Ignore the thread name
+                functionList = stack.split(';')[1:]
+                for functionName in set(functionList):
+                    totalDict[functionName] = totalDict.get(functionName, 0) + stackCount
+                if functionList:
+                    selfDict[functionList[-1]] = selfDict.get(functionList[-1], 0) + stackCount
+        lines = []
+        if sampleCount > 0:
+            for functionName, totalCount in sorted(totalDict.items(), key=lambda item: item[1], reverse=True)[:count]:
+                lines.append("{:6.1f}% self {:6.1f}% {}".format(
+                    100.0 * totalCount / sampleCount, 100.0 * selfDict.get(functionName, 0) / sampleCount, functionName))
+        return lines
+
+
+def createProfiler(sampleMS=0, duration=None):
+    """@brief Create a profiler.
+       @param sampleMS If greater than 0 the thread stacks are sampled this often rather than profiling every call.
+       @param duration If not None a sampling profiler stops after this many seconds.
+       @return A ThreadProfiler or SamplingProfiler instance."""
+    if sampleMS > 0:
+        return SamplingProfiler(interval=sampleMS / 1000.0, duration=duration)
+    return ThreadProfiler()
@@ -1,37 +1,39 @@
 #!/usr/bin/env python3
 
 import os
+import sys
 import tempfile
 import argparse
 
+from contextlib import redirect_stdout
+
 from p3lib.uio import UIO
 from p3lib.helper import logTraceBack
 
 from rs310p_dc_psu.view import PSUGUI
-from rs310p_dc_psu.controller import ETMXXXXPError, ETMXXXXP
+from rs310p_dc_psu.controller import ETMXXXXPError
+from rs310p_dc_psu.logfile import Reading, HEADER, TIME_FORMAT, PORT_KEY, MODEL_ID_KEY, POLL_PERIOD_KEY, formatLine, getSegmentList, removeSegments, RotatingLogWriter
+from rs310p_dc_psu.trigger import TriggerCondition, TriggerCapture
+from rs310p_dc_psu.watchdog import WatchdogRule, Watchdog
+from rs310p_dc_psu.sequence import SequencePlayer, loadSequence, expandRamps, writeReport
+from rs310p_dc_psu.charger import ChargeProfile, Charger
+from rs310p_dc_psu.connection import ManagedETMXXXXP
+from rs310p_dc_psu.metrics import DeviceMetrics, MetricsRegistry, MetricsServer
+from rs310p_dc_psu.deadband import Deadband, DeadbandFilter
+from rs310p_dc_psu.samples import SampleStore, loadSamples
+from rs310p_dc_psu.stream import ReadingStream
+from rs310p_dc_psu.discovery import discoverPSUs
+from rs310p_dc_psu.profiler import createProfiler
+from rs310p_dc_psu.transport import TcpOptions
+from rs310p_dc_psu.benchmark import benchmarkLink, benchmarkTcp, benchmarkSimulator, getBenchmarkLines
+from rs310p_dc_psu.merge import LINEAR, MODES as MERGE_MODES, mergeLogs
+from rs310p_dc_psu.export import COMPRESSIONS, DEFAULT_COMPRESSION, DEFAULT_CHUNK_ROWS, findLogs, exportLogs
+from rs310p_dc_psu.compare import ABSOLUTE, START, TRIGGER, ALIGN_MODES, DEFAULT_ALIGN_TRIGGER, loadComparedLogs, getSummaryLines
+from rs310p_dc_psu.rollup import RollupWriter, backfillRollups, selectTier, readRollup, removeRollups, getRollupFilename
 
 import logging
 
-from time import sleep, time
-from datetime import datetime
-
-
-class Reading(object):
-    """@brief Resonsible for holding a reading value."""
-    def __init__(self, timeStamp, volts, amps, watts):
-        """@brief Constructor
-           @param timeStamp A datetime instance.
-           @param volts The Volts value to be plotted
-           @param amps The Amps value to be plotted
-           @param watts The Watts value to be plotted
-           @param timeStamp The x Value. If None then a timestamp is created."""
-        if timeStamp:
-            self.time = timeStamp
-        else:
-            self.time = datetime.now()
-        self.volts = volts
-        self.amps = amps
-        self.watts = watts
+from time import sleep, time, perf_counter
 
 
 class PSU(object):
@@ -52,8 +54,18 @@ class PSU(object):
         self._options = options
         # The modbus PSU interface
         self._psuIF = None
+        self._watchdogRuleList = []
+        self._watchdog = None
+        self._metricsServer = None
+        self._deviceMetrics = None
+        self._logWriter = None
+        self._rollupWriter = None
+        self._deadbandFilter = None
+        self._readingStream = None
 
-        if options.g:
+        # The GUI opens the serial port itself and plotting a log file does not need the PSU.
+        if options.g or options.plotl or options.replay or options.compare or options.merge or options.backfill or options.discover or \
+           options.benchmark > 0 or options.export:
             self._init(openSerialPort=False)
 
         else:
@@ -63,6 +75,8 @@ class PSU(object):
         """@brief Check the command line arguments."""
         if self._options.on and self._options.off:
             raise ETMXXXXPError("You cannot use --on and --off arguments together.")
+        if self._options.watchdog:
+            self._watchdogRuleList = [WatchdogRule.parse(spec) for spec in self._options.watchdog]
 
     def _init(self, openSerialPort=True):
         """@brief Init the connection to the PSU.
@@ -76,18 +90,97 @@ class PSU(object):
 
         if openSerialPort:
             if self._options.p is None:
-                raise Exception("Serial port not set. Use the -p command line option to set the serial port.")
+                # The cached PSU ports are checked so that a PSU moved to another adapter is found.
+                psuList = discoverPSUs(verify=True)
+                if not psuList:
+                    raise Exception("Serial port not set and no PSU found. Use the -p command line option to set the serial port.")
+                self._options.p = psuList[0].port
+                self._info(f"Using the PSU on {self._options.p}")
 
-            self._psuIF = ETMXXXXP(self._options.p)
+            self._psuIF = ManagedETMXXXXP(self._options.p, **self._getConnectionArgs())
             if not self._psuIF.connect():
                 raise Exception(f"Failed to connect to {self._options.p}")
 
+            if self._watchdogRuleList:
+                self._watchdog = Watchdog(self._psuIF, self._watchdogRuleList)
+
+    def _getTcpOptions(self):
+        """@return The TcpOptions instance used if the PSU is connected over TCP."""
+        return TcpOptions(noDelay=not self._options.tcp_nagle,
+                          keepAlive=self._options.tcp_keepalive > 0,
+                          keepAliveIdle=self._options.tcp_keepalive)
+
+    def _getConnectionArgs(self):
+        """@return A dict of the ManagedETMXXXXP constructor arguments set on the command line."""
+        return {"minTimeout": self._options.min_timeout,
+                "maxTimeout": self._options.timeout,
+                "tcpOptions": self._getTcpOptions()}
+
     def _info(self, msg):
         """@brief Display an info level message.
            @param msg The message to be displayed."""
         if self._uio:
             self._uio.info(msg)
 
+    def _checkWatchdog(self, reading, sampleTime):
+        """@brief Check a reading against the watchdog rules (if any). The PSU output is turned off if a rule is broken.
+           @param reading The Reading instance.
+           @param sampleTime The time the reading was received (perf_counter() seconds)."""
+        if self._watchdog:
+            trip = self._watchdog.check(reading, sampleTime)
+            if trip:
+                self._uio.warn(str(trip))
+
+    def _startMetrics(self):
+        """@brief Start serving the PSU readings in the Prometheus text format if the --metrics argument is set."""
+        if self._options.metrics > 0:
+            registry = MetricsRegistry()
+            self._deviceMetrics = DeviceMetrics(str(self._options.p), self._psuIF.getConnectionStats)
+            registry.add(self._deviceMetrics)
+            self._metricsServer = MetricsServer(registry, self._options.address, self._options.metrics)
+            self._metricsServer.start()
+            self._uio.info("Metrics: {}".format(self._metricsServer.getURL()))
+
+    def _stopMetrics(self):
+        """@brief Stop serving the PSU metrics."""
+        if self._metricsServer:
+            self._metricsServer.stop()
+            self._metricsServer = None
+            self._deviceMetrics = None
+
+    def _updateMetrics(self, reading):
+        """@brief Update the PSU metrics (if served) with a reading. The output and protection state are also read
+                  when due. A failure to read them does not stop the reading being used.
+           @param reading The Reading instance."""
+        if self._deviceMetrics:
+            output = None
+            protection = None
+            if self._deviceMetrics.isStateReadDue():
+                try:
+                    output, protection = self._psuIF.getOutputAndProtectionState()
+                except ETMXXXXPError as ex:
+                    self._deviceMetrics.recordError()
+                    self._uio.warn(f"Failed to read the PSU output state: {ex}")
+            self._deviceMetrics.update(reading.volts, reading.amps, reading.watts, output=output, protection=protection)
+
+    def _showConnectionStats(self):
+        """@brief Show the PSU connection counters."""
+        stats = self._psuIF.getConnectionStats()
+        self._info("Requests:               {}".format(stats['requests']))
+        self._info("Timeouts:               {}".format(stats['timeouts']))
+        self._info("CRC errors:             {}".format(stats['crcErrors']))
+        self._info("Connection errors:      {}".format(stats['connectionErrors']))
+        self._info("Retries:                {}".format(stats['retries']))
+        self._info("Reconnects:             {}".format(stats['reconnects']))
+        self._info("Failed requests:        {}".format(stats['failures']))
+        if stats['smoothedRTT'] is not None:
+            self._info("Round trip time (ms):   {:.1f}".format(stats['smoothedRTT']*1000.0))
+        self._info("Response timeout (ms):  {:.1f}".format(stats['responseTimeout']*1000.0))
+        linkStats = self._psuIF.getLinkStats()
+        if linkStats:
+            self._info("TCP round trip (ms):    {:.1f}".format(linkStats['rttMS']))
+            self._info("TCP retransmits:        {}".format(linkStats['retransmits']))
+
     def _getOnOff(self, value):
         """@brief Get the value as either on or off.
            @param value The value to check.
@@ -109,7 +202,8 @@ class PSU(object):
         self._info("Watts (watts):          {:.3f}".format(watts))
 
     def _showVerboseStatus(self):
-        """@brief Show the verbose PSU stats."""
+        """@brief Show the verbose PSU stats followed by the PSU bus statistics."""
+        self._psuIF.enableInstrumentation()
         outputOn = self._psuIF.getOutput()
         protection = self._psuIF.getProtectionState()
         model = self._psuIF.getModel()
@@ -130,59 +224,53 @@ class PSU(object):
         self._info("Buzzer:                 {}".format(self._getOnOff(buzzerOn)))
         self._info("Model:                  {}".format(model))
         self._info("Protection state:       {}".format(protection))
+        self._showConnectionStats()
+        for line in self._psuIF.getInstrumentation().getLines():
+            self._info(line)
 
     def _recordLog(self, reading):
         """@brief Record data to the log file.
            @param reading The reading from the PSU to be saved."""
-        timeStr = reading.time.strftime("%d/%m/%Y-%H:%M:%S.%f")
-        self._uio.info("{}: Volts={} Amps={} Watts={}".format(timeStr, reading.volts, reading.amps, reading.watts))
-        fd = open(self._options.log, 'a')
-        fd.write("{},{},{},{}\n".format(timeStr, reading.volts, reading.amps, reading.watts))
-        fd.close()
+        if self._readingStream:
+            self._readingStream.add(reading)
+        else:
+            timeStr = reading.time.strftime(TIME_FORMAT)
+            self._uio.info("{}: Volts={} Amps={} Watts={}".format(timeStr, reading.volts, reading.amps, reading.watts))
+        if self._deadbandFilter:
+            for recordedReading in self._deadbandFilter.filter(reading):
+                self._logWriter.write(recordedReading)
+        else:
+            self._logWriter.write(reading)
+        if self._rollupWriter:
+            self._rollupWriter.add(reading)
 
     def _addLogFileHeader(self):
         """@brief Add a header to the log file indication what each column is."""
         fd = open(self._options.log, 'a')
-        fd.write("TIME,VOLTS,AMPS,WATTS\n")
+        fd.write(HEADER)
         fd.close()
 
+    def _removeOldLogFiles(self):
+        """@brief Delete the segments and rollup tiers left by a previous log with the same name as the log just created."""
+        removeSegments(self._options.log)
+        removeRollups(self._options.log)
+
     def _loadLog(self):
-        """@brief Load from log file
-           @return A list of elements
-                   0: xValueList
-                   1: yValueList
-                   2: label"""
-        readingList = []
-        fd = open(self._options.log, 'r')
-        lines = fd.readlines()
-        fd.close()
-        for line in lines:
-            elems = line.split(',')
-            if len(elems) == 4:
-                try:
-                    tStr = elems[0]
-                    # Ignore header lines
-                    if tStr.lower() == 'time':
-                        continue
-                    if tStr.endswith(":"):
-                        tStr = tStr[:-1]
-                    plotTime = datetime.strptime(tStr, "%d/%m/%Y-%H:%M:%S.%f")
-                    volts = float(elems[1])
-                    amps = float(elems[2])
-                    watts = float(elems[3])
-                    reading = Reading(plotTime, volts, amps, watts)
-                    readingList.append(reading)
-                except ValueError:
-                    pass
-        reading_count = len(readingList)
-        self._uio.info(f"Loaded {reading_count} readings from the {self._options.log} file.")
-        return readingList
+        """@brief Load from log file. Rotated (and compressed) log segments are loaded as a single log.
+           @return A SampleStore instance."""
+        segment_count = len(getSegmentList(self._options.log))
+        if segment_count == 0:
+            raise ETMXXXXPError(f"{self._options.log} not found.")
+        samples = loadSamples(self._options.log)
+        self._uio.info(f"Loaded {len(samples)} readings from the {self._options.log} file ({segment_count} segments).")
+        return samples
 
     def _appendCreateFile(self, uio, aFile, quiet=False):
         """@brief USer interaction to append or create a file.
         @param uio A UIO instance.
         @param quiet If True do not show uio messages (apart from overwrite prompt.
         @param aFile The file to append or delete.
+        @return True if the file was created.
         """
         createFile = False
         if os.path.isfile(aFile):
@@ -204,18 +292,78 @@ class PSU(object):
             if not quiet:
                 uio.info("Created {}".format(aFile))
 
+        return createFile
+
     def _record_stats(self):
-        """@brief Record stats to a log file unitl CRTL C is pressed."""
-        self._appendCreateFile(self._uio, self._options.log)
+        """@brief Record stats to a log file unitl CRTL C is pressed. If the --stream argument is set the
+                  readings are also streamed to stdout and all other output is sent to stderr."""
+        if not self._options.stream:
+            self._recordStats()
+            return
+
+        self._readingStream = ReadingStream(sys.stdout,
+                                            streamFormat=self._options.stream,
+                                            policy=self._options.stream_full,
+                                            queueSize=self._options.stream_queue)
+        with redirect_stdout(sys.stderr):
+            try:
+                self._recordStats()
+
+            finally:
+                self._readingStream.close()
+                stats = self._readingStream.getStats()
+                self._uio.info("Streamed readings:      {}".format(stats['written']))
+                self._uio.info("Dropped readings:       {}".format(stats['dropped']))
+                self._uio.info("Blocked (count/secs):   {}/{:.3f}".format(stats['blocked'], stats['blockedSeconds']))
+                if self._readingStream.isBroken():
+                    self._uio.info("The stream consumer has exited.")
+                    # Stop python reporting an error when it flushes stdout on exit
+                    devnull = os.open(os.devnull, os.O_WRONLY)
+                    os.dup2(devnull, sys.stdout.fileno())
+                self._readingStream = None
+
+    def _recordStats(self):
+        """@brief Record stats to a log file until CRTL C is pressed (or the stream consumer exits). The log file is
+                  rotated into numbered, compressed segments if the --rotate-size or --rotate-time arguments are set."""
+        createdLog = self._appendCreateFile(self._uio, self._options.log)
+        if createdLog:
+            self._removeOldLogFiles()
         self._uio.info("Log file: {}".format(self._options.log))
-        self._addLogFileHeader()
+        port = self._options.p
+        if isinstance(port, tuple):
+            port = f"{port[0]}:{port[1]}"
+        commentList = [f"{PORT_KEY}={port}",
+                       f"{MODEL_ID_KEY}={self._psuIF.getModel()}",
+                       f"{POLL_PERIOD_KEY}={self._options.poll}"]
+        if self._options.deadband:
+            self._deadbandFilter = DeadbandFilter([Deadband.parse(spec) for spec in self._options.deadband], heartbeatSeconds=self._options.heartbeat)
+            commentList += self._deadbandFilter.getMetadata()
+        self._logWriter = RotatingLogWriter(self._options.log,
+                                            maxBytes=int(self._options.rotate_size * 1E6),
+                                            maxSeconds=self._options.rotate_time * 3600.0,
+                                            retainCount=self._options.retain,
+                                            commentList=commentList)
+        if self._options.rollup:
+            self._rollupWriter = RollupWriter(self._options.log, mode='w' if createdLog else 'a')
+        self._startMetrics()
         try:
             while True:
                 start_read_time = time()
-                # Read the data
-                volts, amps, watts = self._psuIF.getOutputStats()
-                reading = Reading(None, volts, amps, watts)
-                self._recordLog(reading)
+                # Read the data. The connection manager retries failed reads and reconnects to
+                # the PSU so keep recording if a read still fails.
+                try:
+                    volts, amps, watts = self._psuIF.getOutputStats()
+                    sampleTime = perf_counter()
+                    reading = Reading(None, volts, amps, watts)
+                    self._checkWatchdog(reading, sampleTime)
+                    self._recordLog(reading)
+                    self._updateMetrics(reading)
+                except ETMXXXXPError as ex:
+                    if self._deviceMetrics:
+                        self._deviceMetrics.recordError()
+                    self._uio.warn(str(ex))
+                if self._readingStream and self._readingStream.isBroken():
+                    break
                 now = time()
                 read_time_time = now-start_read_time
                 sleep_time = self._options.poll - read_time_time
@@ -223,23 +371,273 @@ class PSU(object):
                     sleep(sleep_time)
 
         finally:
+            self._stopMetrics()
+            if self._deadbandFilter:
+                for recordedReading in self._deadbandFilter.flush():
+                    self._logWriter.write(recordedReading)
+                self._deadbandFilter = None
+            self._logWriter.close()
+            self._logWriter = None
+            if self._rollupWriter:
+                self._rollupWriter.close()
+                self._rollupWriter = None
             self._uio.info("Log file: {}".format(self._options.log))
+            self._showConnectionStats()
+
+    def _captureTriggers(self):
+        """@brief Read the PSU as fast as possible (or at the poll period if set) until CTRL C is pressed.
+                  Readings are held in a pre trigger buffer and the readings around each trigger event
+                  are saved to a separate capture file."""
+        conditionList = [TriggerCondition.parse(spec) for spec in self._options.trigger]
+        filePrefix = os.path.splitext(self._options.log)[0]
+        triggerCapture = TriggerCapture(conditionList, self._options.pre, self._options.post, filePrefix)
+        for condition in conditionList:
+            self._uio.info("Trigger: {}".format(condition))
+        self._uio.info("Waiting for trigger ({} pre and {} post trigger readings).".format(self._options.pre, self._options.post))
+        self._startMetrics()
+        try:
+            while True:
+                start_read_time = time()
+                # The connection manager retries failed reads and reconnects to the PSU so keep
+                # sampling if a read still fails.
+                try:
+                    volts, amps, watts = self._psuIF.getOutputStats()
+                    sampleTime = perf_counter()
+                    reading = Reading(None, volts, amps, watts)
+                    self._checkWatchdog(reading, sampleTime)
+                    filename = triggerCapture.addReading(reading)
+                    if filename:
+                        self._uio.info("Saving {}".format(filename))
+                    self._updateMetrics(reading)
+                except ETMXXXXPError as ex:
+                    if self._deviceMetrics:
+                        self._deviceMetrics.recordError()
+                    self._uio.warn(str(ex))
+                if self._options.poll > 0:
+                    sleep_time = self._options.poll - (time() - start_read_time)
+                    if sleep_time > 0:
+                        sleep(sleep_time)
+
+        finally:
+            self._stopMetrics()
+            filename = triggerCapture.flush()
+            if filename:
+                self._uio.info("Saving {}".format(filename))
+            triggerCapture.close()
+
+    def _runSequence(self):
+        """@brief Execute the steps in a sequence file. The PSU output is recorded to the log file between steps."""
+        stepList = expandRamps(loadSequence(self._options.seq), self._options.ramp)
+        if self._appendCreateFile(self._uio, self._options.log):
+            self._removeOldLogFiles()
+        self._addLogFileHeader()
+        samples = SampleStore()
+
+        def measurementCallback(reading, sampleTime):
+            self._checkWatchdog(reading, sampleTime)
+            samples.appendReading(reading)
+
+        sequencePlayer = SequencePlayer(self._psuIF, stepList, measure=True, measurementCallback=measurementCallback, watchdog=self._watchdog)
+        self._uio.info("Running {} steps over {:.3f} seconds ({} times).".format(len(stepList), sequencePlayer.getPeriod(), self._options.repeat))
+        try:
+            resultList = sequencePlayer.run(repeatCount=self._options.repeat)
+
+        finally:
+            # The log file is written after the sequence so that file access does not delay the steps.
+            with open(self._options.log, 'a') as fd:
+                for reading in samples:
+                    fd.write(formatLine(reading))
+            self._uio.info("Saved {} readings to {}".format(len(samples), self._options.log))
+
+        errorList = [abs(result.getErrorMS()) for result in resultList]
+        for result in resultList:
+            self._uio.debug("Step {}: planned {:.3f}s actual {:.3f}s error {:.3f} ms write {:.3f} ms".format(
+                result.index, result.plannedTime, result.actualTime, result.getErrorMS(), result.writeSeconds*1000.0))
+        self._uio.info("Step timing error (ms): mean {:.3f} max {:.3f}".format(sum(errorList)/len(errorList), max(errorList)))
+        if self._options.seq_report:
+            writeReport(self._options.seq_report, resultList)
+            self._uio.info("Saved step timing to {}".format(self._options.seq_report))
+
+    def _parseFloatList(self, value, count, argName):
+        """@brief Parse a comma separated list of float values from a command line argument.
+           @param value The argument value.
+           @param count The number of values required.
+           @param argName The name of the argument (used in error messages).
+           @return A list of float values."""
+        elems = value.split(',')
+        if len(elems) != count:
+            raise ETMXXXXPError(f"{argName} requires {count} comma separated values.")
+        try:
+            return [float(elem) for elem in elems]
+        except ValueError:
+            raise ETMXXXXPError(f"{argName} {value} is invalid.")
+
+    def _charge(self):
+        """@brief Charge a battery using a constant current/constant voltage profile. The readings are saved to the log file."""
+        cvVolts, ccAmps, terminationAmps = self._parseFloatList(self._options.charge, 3, "--charge")
+        preChargeVolts = None
+        preChargeAmps = None
+        if self._options.precharge:
+            preChargeVolts, preChargeAmps = self._parseFloatList(self._options.precharge, 2, "--precharge")
+        timeoutSeconds = None
+        if self._options.charge_timeout > 0:
+            timeoutSeconds = self._options.charge_timeout * 60.0
+        profile = ChargeProfile(cvVolts,
+                                ccAmps,
+                                terminationAmps,
+                                preChargeVolts=preChargeVolts,
+                                preChargeAmps=preChargeAmps,
+                                timeoutSeconds=timeoutSeconds)
+        charger = Charger(self._psuIF, profile, period=self._options.charge_period)
+
+        if self._appendCreateFile(self._uio, self._options.log):
+            self._removeOldLogFiles()
+        self._uio.info("Log file: {}".format(self._options.log))
+        self._addLogFileHeader()
+        fd = open(self._options.log, 'a')
+
+        def iterationCallback(iteration):
+            reading = iteration.reading
+            fd.write(formatLine(reading))
+            self._uio.info("{:<10} Volts={:.2f} Amps={:.3f} Ah={:.4f} Wh={:.4f} Loop={:.1f} ms".format(
+                iteration.stage, reading.volts, reading.amps, iteration.ampHours, iteration.wattHours, iteration.latencySeconds*1000.0))
+
+        try:
+            charger.run(iterationCallback=iterationCallback)
+
+        finally:
+            fd.close()
+            self._uio.info("Charge stopped: {}".format(charger.getStopReason()))
+            self._uio.info("Charge (Ah):            {:.4f}".format(charger.getAmpHours()))
+            self._uio.info("Energy (Wh):            {:.4f}".format(charger.getWattHours()))
+            self._uio.info("Setpoint writes:        {}".format(charger.getWriteCount()))
+            latencyStats = charger.getLatencyStats()
+            if latencyStats:
+                self._uio.info("Loop latency (ms):      min {:.1f} mean {:.1f} max {:.1f}".format(*[value*1000.0 for value in latencyStats]))
+            self._uio.info("Loop overruns:          {}".format(charger.getOverrunCount()))
+
+    def _discover(self):
+        """@brief Show the PSUs connected to the serial ports of this machine."""
+        psuList = discoverPSUs(refresh=True)
+        for psu in psuList:
+            self._info(str(psu))
+        self._info(f"Found {len(psuList)} PSU/s.")
+
+    def _backfillRollups(self):
+        """@brief Create the rollup tiers of the log file."""
+        reading_count = backfillRollups(self._options.log)
+        self._uio.info(f"Created the rollup tiers of {self._options.log} from {reading_count} readings.")
 
     def _plotLog(self):
-        """@brief Plot the data in the log."""
-        reading_list = self._loadLog()
+        """@brief Plot the data in the log. If the log has rollup tiers the coarsest tier that fills the plot width is plotted."""
+        tier_name = selectTier(self._options.log, self._options.width)
+        envelope = None
+        if tier_name:
+            bucket_list = readRollup(self._options.log, tier_name)
+            samples = SampleStore.fromReadings(bucket.getReading() for bucket in bucket_list)
+            # The min and max of each bucket are shown so that short spikes are not hidden by the mean.
+            envelope = (SampleStore.fromReadings(bucket.getMinReading() for bucket in bucket_list),
+                        SampleStore.fromReadings(bucket.getMaxReading() for bucket in bucket_list))
+            self._uio.info(f"Loaded {len(samples)} {tier_name} mean, min and max values from {getRollupFilename(self._options.log, tier_name)}.")
+        else:
+            samples = self._loadLog()
         psgGui = PSUGUI(self._options.width,
                         address=self._options.address,
                         reload=self._options.reload,
                         debug=self._options.debug)
-        psgGui.plot_data(reading_list)
+        psgGui.plot_data(samples, envelope=envelope)
+
+    def _replayLog(self):
+        """@brief Replay the data in the log through the GUI."""
+        samples = self._loadLog()
+        psgGui = PSUGUI(self._options.width,
+                        address=self._options.address,
+                        reload=self._options.reload,
+                        debug=self._options.debug)
+        psgGui.replay(samples, speed=self._options.speed)
+
+    def _compareLogs(self):
+        """@brief Plot the data in several logs over each other and show the energy, peak current etc of each log."""
+        triggerCondition = None
+        if self._options.align == TRIGGER:
+            triggerCondition = TriggerCondition.parse(self._options.align_trigger)
+        startTime = perf_counter()
+        comparedLogList = loadComparedLogs(self._options.compare, alignMode=self._options.align, triggerCondition=triggerCondition)
+        readingCount = sum(len(comparedLog.samples) for comparedLog in comparedLogList)
+        self._uio.info(f"Loaded {readingCount} readings from {len(comparedLogList)} logs in {perf_counter() - startTime:.1f} seconds.")
+        for line in getSummaryLines(comparedLogList):
+            self._uio.info(line)
+        psgGui = PSUGUI(self._options.width,
+                        address=self._options.address,
+                        reload=self._options.reload,
+                        debug=self._options.debug)
+        psgGui.compare(comparedLogList, absolute_time=self._options.align == ABSOLUTE)
+
+    def _mergeLogs(self):
+        """@brief Merge the logs of several PSUs onto a common time grid and write them as a single CSV file."""
+        maxGap = None
+        if self._options.merge_gap > 0:
+            maxGap = self._options.merge_gap
+        if self._options.merge_output:
+            with open(self._options.merge_output, 'w') as fd:
+                stats = mergeLogs(self._options.merge, fd, step=self._options.merge_step, mode=self._options.merge_mode, maxGap=maxGap, overlapOnly=self._options.merge_overlap)
+            self._uio.info(f"Merged {sum(stats['readings'])} readings from {len(self._options.merge)} logs into {stats['rows']} rows in {self._options.merge_output}")
+
+        else:
+            # The merged data is the only output so that it can be piped to another program.
+            mergeLogs(self._options.merge, sys.stdout, step=self._options.merge_step, mode=self._options.merge_mode, maxGap=maxGap, overlapOnly=self._options.merge_overlap)
+
+    def _exportLogs(self):
+        """@brief Export logs to Parquet files. Logs that have not changed since they were last exported are skipped."""
+        filenameList = findLogs(self._options.export)
+        if not filenameList:
+            raise ETMXXXXPError("No logs found to export.")
+        startTime = perf_counter()
+        resultList = exportLogs(filenameList,
+                                outputFolder=self._options.export_dir,
+                                compression=self._options.export_compression,
+                                chunkRows=self._options.export_chunk,
+                                force=self._options.export_force)
+        exportedCount = 0
+        for result in resultList:
+            if result['skipped']:
+                self._uio.info(f"{result['filename']} is unchanged since it was exported to {result['exportFilename']}")
+            else:
+                self._uio.info(f"Exported {result['rows']} readings from {result['filename']} to {result['exportFilename']}")
+                exportedCount += 1
+        self._uio.info(f"Exported {exportedCount} of {len(resultList)} logs in {perf_counter() - startTime:.1f} seconds.")
+
+    def _benchmark(self):
+        """@brief Measure the round trip time of reading the PSU. If no PSU is set a simulated PSU is read over a
+                  serial port and over TCP so that the transports can be compared."""
+        count = self._options.benchmark
+        tcpOptions = self._getTcpOptions()
+        if self._options.p is None:
+            self._uio.info(f"Reading a simulated PSU {count} times on each link ({self._options.sim_baud} baud)...")
+            resultList = benchmarkSimulator(count, baudRate=self._options.sim_baud, tcpOptions=tcpOptions)
+
+        elif isinstance(self._options.p, tuple):
+            self._uio.info(f"Reading the PSU at {self._options.p[0]}:{self._options.p[1]} {count} times with and without the TCP options ({tcpOptions})...")
+            resultList = benchmarkTcp(self._options.p, count, tcpOptions=tcpOptions)
+
+        else:
+            self._uio.info(f"Reading the PSU on {self._options.p} {count} times...")
+            resultList = [benchmarkLink("Serial", self._options.p, count)]
+
+        for line in getBenchmarkLines(resultList):
+            self._uio.info(line)
 
     def _runGUI(self):
         """@brief Start the PSU control GUI."""
         psgGui = PSUGUI(self._options.width,
                         address=self._options.address,
                         reload=self._options.reload,
-                        debug=self._options.debug)
+                        debug=self._options.debug,
+                        watchdog_rules=self._watchdogRuleList,
+                        metrics_port=self._options.metrics,
+                        log_file=self._options.log,
+                        connection_args=self._getConnectionArgs(),
+                        probe_ports=self._options.gui_probe)
         psgGui.start(self._options.p)
 
     def process(self):
@@ -281,18 +679,48 @@ class PSU(object):
                 self._psuIF.setBuzzer(False)
                 self._info("Set buzzer OFF")
 
-            if self._options.s:
+            if self._options.backfill:
+                self._backfillRollups()
+
+            if self._options.discover:
+                self._discover()
+
+            elif self._options.s:
                 self._showStatus()
 
             elif self._options.vs:
                 self._showVerboseStatus()
 
+            elif self._options.seq:
+                self._runSequence()
+
+            elif self._options.charge:
+                self._charge()
+
+            elif self._options.trigger:
+                self._captureTriggers()
+
             elif self._options.poll > 0:
                 self._record_stats()
 
             elif self._options.plotl:
                 self._plotLog()
 
+            elif self._options.replay:
+                self._replayLog()
+
+            elif self._options.compare:
+                self._compareLogs()
+
+            elif self._options.merge:
+                self._mergeLogs()
+
+            elif self._options.export:
+                self._exportLogs()
+
+            elif self._options.benchmark > 0:
+                self._benchmark()
+
             elif self._options.g:
                 self._runGUI()
 
@@ -314,8 +742,46 @@ def main():
                             action='store_true',
                             help="Enable debugging.")
         parser.add_argument("-p",
-                            help="The local machine USB serial port connected to the PSU or the 'host:port' format for an Esp-Link bridge.",
+                            help="The local machine USB serial port connected to the PSU or the 'host:port' format for an Esp-Link bridge. "
+                                 "If not set the serial ports are searched for a PSU.",
                             default=None)
+        parser.add_argument("--timeout",
+                            help="The PSU response timeout in seconds used until the round trip time has been measured (default=2.0).",
+                            type=float,
+                            default=2.0)
+        parser.add_argument("--min-timeout",
+                            help="The minimum PSU response timeout in seconds. The timeout follows the measured round trip time "
+                                 "but is never lower than this (default=0.2).",
+                            type=float,
+                            default=0.2)
+        parser.add_argument("--tcp-keepalive",
+                            help="If the PSU is connected over TCP (E.G an Esp-Link bridge) the idle time in seconds before TCP keepalive "
+                                 "probes check the link. A dead link is detected after this time plus 6 seconds. 0 = disable (default=5).",
+                            type=float,
+                            default=5)
+        parser.add_argument("--tcp-nagle",
+                            help="If the PSU is connected over TCP leave Nagle's algorithm enabled. By default each request is sent immediately.",
+                            action="store_true",
+                            default=False)
+        parser.add_argument("--benchmark",
+                            help="Read the PSU output this many times and show the round trip times. If -p is not set a simulated PSU is read "
+                                 "over a serial port (Linux/macOS) and over TCP with and without the TCP options so that the transports can be compared.",
+                            type=int,
+                            default=0)
+        parser.add_argument("--sim-baud",
+                            help="The baud rate of the simulated PSU serial interface used by --benchmark. 0 = respond immediately to measure "
+                                 "only the transport overhead (default=9600).",
+                            type=int,
+                            default=9600)
+        parser.add_argument("--discover",
+                            help="Search all the serial ports for PSUs and show the PSUs found.",
+                            action="store_true",
+                            default=False)
+        parser.add_argument("--gui-probe",
+                            help="Probe the serial ports for PSUs when the GUI starts so that the ports connected to a PSU are listed "
+                                 "first. This sends Modbus requests to every serial port.",
+                            action="store_true",
+                            default=False)
         parser.add_argument("-v",
                             help="The required output voltage.",
                             type=float,
@@ -364,6 +830,117 @@ def main():
                             help="The poll period in seconds (default=1).",
                             type=float,
                             default=0.0)
+        parser.add_argument("--trigger",
+                            help="Sample the PSU as fast as possible and save the readings around each trigger event to a capture file "
+                                 "alongside the log file. The trigger is defined as <channel>:<type>:<level> where channel is volts, amps or watts "
+                                 "and type is above, below, rising, falling or slope (units/second). E.G amps:rising:1.5. "
+                                 "This may be used more than once, any condition triggers a capture.",
+                            action="append",
+                            default=None)
+        parser.add_argument("--pre",
+                            help="The number of readings saved before a trigger event (default=100).",
+                            type=int,
+                            default=100)
+        parser.add_argument("--post",
+                            help="The number of readings saved after a trigger event (default=100).",
+                            type=int,
+                            default=100)
+        parser.add_argument("--watchdog",
+                            help="A rule checked on every reading when polling (--poll, --trigger or the GUI). The PSU output is turned off "
+                                 "as soon as a rule is broken. Rules are <channel>:above:<level>[:<ms>], <channel>:below:<level>[:<ms>], "
+                                 "<channel>:rate:<units per second> or <channel>:band:<low>:<high>[:<ms>] where channel is volts, amps or watts. "
+                                 "E.G amps:above:2.5:50 turns the output off if the current is above 2.5 amps for more than 50 ms. "
+                                 "This may be used more than once.",
+                            action="append",
+                            default=None)
+        parser.add_argument("--seq",
+                            help="Execute the voltage, current limit and output steps in a CSV or YAML sequence file. A CSV file has "
+                                 "TIME,VOLTS,AMPS,OUTPUT and optionally RAMP columns. The time is in seconds from the start of the sequence and "
+                                 "empty values are left unchanged. The PSU output is recorded to the log file between steps. A YAML file requires the "
+                                 "pyyaml module (the yaml extra, pip install \"rs310p-dc-psu[yaml]\").",
+                            default=None)
+        parser.add_argument("--repeat",
+                            help="The number of times the --seq sequence is executed (default=1).",
+                            type=int,
+                            default=1)
+        parser.add_argument("--ramp",
+                            help="The time in seconds between the voltage/current limit steps of a ramp in a --seq sequence (default=0.1).",
+                            type=float,
+                            default=0.1)
+        parser.add_argument("--seq-report",
+                            help="A CSV file to save the planned and actual time of every --seq step.",
+                            default=None)
+        parser.add_argument("--charge",
+                            help="Charge a battery. The argument is CV_VOLTS,CC_AMPS,TERMINATION_AMPS. The battery is charged at CC_AMPS "
+                                 "until it reaches CV_VOLTS and charging stops when the current falls to TERMINATION_AMPS. E.G 4.2,1.0,0.05",
+                            default=None)
+        parser.add_argument("--precharge",
+                            help="If set with --charge the battery is charged at a lower current until it reaches a voltage. The argument "
+                                 "is VOLTS,AMPS. E.G 3.0,0.1",
+                            default=None)
+        parser.add_argument("--charge-period",
+                            help="The --charge control loop period in seconds (default=1).",
+                            type=float,
+                            default=1.0)
+        parser.add_argument("--charge-timeout",
+                            help="If greater than 0 then --charge stops after this many minutes (default=0).",
+                            type=float,
+                            default=0.0)
+        parser.add_argument("--rotate-size",
+                            help="If greater than 0 then when recording (--poll) the log file is closed and renamed as a numbered segment "
+                                 "(E.G psu.log.0001) when it reaches this size in MB. Closed segments are compressed (default=0).",
+                            type=float,
+                            default=0.0)
+        parser.add_argument("--rotate-time",
+                            help="If greater than 0 then when recording (--poll) the log file is closed and renamed as a numbered segment "
+                                 "after this many hours. Closed segments are compressed (default=0).",
+                            type=float,
+                            default=0.0)
+        parser.add_argument("--retain",
+                            help="If greater than 0 then the oldest log segments are deleted when there are more than this many (default=0).",
+                            type=int,
+                            default=0)
+        parser.add_argument("--stream",
+                            help="When recording (--poll) also stream each reading to stdout in jsonl (JSON lines) or csv format so that the "
+                                 "readings can be piped to another program. All other output is sent to stderr.",
+                            choices=ReadingStream.FORMATS,
+                            default=None)
+        parser.add_argument("--stream-full",
+                            help="What to do when the --stream consumer is too slow and the stream queue is full. drop = drop the oldest "
+                                 "queued reading, block = wait for the consumer (this delays reading the PSU) (default=drop).",
+                            choices=ReadingStream.POLICIES,
+                            default=ReadingStream.DROP)
+        parser.add_argument("--stream-queue",
+                            help="The maximum number of readings queued for the --stream consumer (default=1000).",
+                            type=int,
+                            default=1000)
+        parser.add_argument("--deadband",
+                            help="When recording (--poll) only record a reading when a channel changes by more than a band. The band is "
+                                 "defined as <channel>:<band> (E.G volts:0.02) or <channel>:<band>%% for a band relative to the last recorded "
+                                 "value (E.G amps:1%%) where channel is volts, amps or watts. Channels without a band are recorded on any change. "
+                                 "This may be used more than once.",
+                            action="append",
+                            default=None)
+        parser.add_argument("--heartbeat",
+                            help="When --deadband is used a reading is recorded at least this often in seconds (default=60).",
+                            type=float,
+                            default=60.0)
+        parser.add_argument("--rollup",
+                            help="When recording (--poll) also record the min, max, mean and last values over 1 second, 1 minute and 1 hour "
+                                 "periods to files alongside the log file (E.G psu.log.1m.csv). --plotl plots the coarsest of these that fills "
+                                 "the plot width so that long recordings are plotted quickly.",
+                            action="store_true",
+                            default=False)
+        parser.add_argument("--backfill",
+                            help="Create the --rollup files from an existing log file.",
+                            action="store_true",
+                            default=False)
+        parser.add_argument("--metrics",
+                            help="If greater than 0 then when polling (--poll, --trigger or the GUI) the latest PSU reading, output/protection "
+                                 "state, poll rate, jitter and error counters are served in the Prometheus text format at "
+                                 "http://<address>:<port>/metrics where port is this value and address is set by --address (default=0).",
+                            type=int,
+                            default=0)
         parser.add_argument("--log",
                             help="Log file. This is used when plotting (default={}).".format(PSU.DEFAULT_LOG_FILE),
                             default=PSU.DEFAULT_LOG_FILE)
@@ -387,12 +964,87 @@ def main():
                             action="store_true",
                             default=False)
 
+        parser.add_argument("--replay",
+                            help="Replay the data in the log file through the GUI as if it was being read from the PSU. "
+                                 "The replay can be paused and moved to any point in the log.",
+                            action="store_true",
+                            default=False)
+        parser.add_argument("--speed",
+                            help="The --replay speed. 1 = the speed it was recorded, 10 = ten times faster, 0 = as fast as possible (default=1).",
+                            type=float,
+                            default=1.0)
+
+        parser.add_argument("--compare",
+                            help="Plot the data in several log files over each other and show the energy, mean power, peak current "
+                                 "and peak power of each log. The log files are loaded in parallel.",
+                            nargs='+',
+                            default=None)
+        parser.add_argument("--align",
+                            help="How the --compare logs are aligned. absolute = plot at the time recorded, start = plot from the start "
+                                 "of each log, trigger = plot from the first reading of each log that meets --align-trigger (default=start).",
+                            choices=ALIGN_MODES,
+                            default=START)
+        parser.add_argument("--align-trigger",
+                            help="The trigger condition used by --align trigger in the <channel>:<type>:<level> format used by --trigger. "
+                                 "The default is met by the first reading with the output on (default={}).".format(DEFAULT_ALIGN_TRIGGER),
+                            default=DEFAULT_ALIGN_TRIGGER)
+
+        parser.add_argument("--merge",
+                            help="Merge the log files recorded by several PSUs (E.G powering different rails of the same device) into "
+                                 "one CSV file with a row every --merge-step seconds. Each row holds the volts, amps and watts from each "
+                                 "log and the total power. The logs are streamed so any length of log may be merged.",
+                            nargs='+',
+                            default=None)
+        parser.add_argument("--merge-step",
+                            help="The time in seconds between the --merge rows (default=1).",
+                            type=float,
+                            default=1.0)
+        parser.add_argument("--merge-mode",
+                            help="How the readings of each --merge log are resampled onto the rows. nearest = the nearest reading, "
+                                 "linear = interpolated between the readings either side, hold = the last reading (default=linear). "
+                                 "The readings of a --deadband log are always held.",
+                            choices=MERGE_MODES,
+                            default=LINEAR)
+        parser.add_argument("--merge-gap",
+                            help="If greater than 0 then --merge leaves the values of a log empty between readings more than this "
+                                 "many seconds apart (default=0). This is not applied to --deadband logs.",
+                            type=float,
+                            default=0.0)
+        parser.add_argument("--merge-overlap",
+                            help="Only write the --merge rows for the time that all the logs were recorded.",
+                            action='store_true')
+        parser.add_argument("--merge-output",
+                            help="The file to which the --merge CSV data is written. If not set it is written to stdout.",
+                            default=None)
+
+        parser.add_argument("--export",
+                            help="Export log files (including their rotated segments) or all the log files in folders to compressed Parquet "
+                                 "files for analysis tools (E.G pandas or DuckDB). Logs that have not changed since they were exported are skipped. "
+                                 "This requires the pyarrow module (the parquet extra, pip install \"rs310p-dc-psu[parquet]\").",
+                            nargs='+',
+                            default=None)
+        parser.add_argument("--export-dir",
+                            help="The folder to which the --export files are written. If not set each file is written to the folder holding the log.",
+                            default=None)
+        parser.add_argument("--export-compression",
+                            help=f"The --export file compression ({', '.join(COMPRESSIONS)}) (default={DEFAULT_COMPRESSION}).",
+                            choices=COMPRESSIONS,
+                            default=DEFAULT_COMPRESSION)
+        parser.add_argument("--export-chunk",
+                            help=f"The number of readings read from a log and written to the --export file at a time (default={DEFAULT_CHUNK_ROWS}).",
+                            type=int,
+                            default=DEFAULT_CHUNK_ROWS)
+        parser.add_argument("--export-force",
+                            help="Export logs with --export even if they have not changed since they were exported.",
+                            action="store_true",
+                            default=False)
+
         parser.add_argument(
             "--address",
             type=str,
             default='127.0.0.1',
             help="""
-            The address to which the GUI server is bound. By default
+            The address to which the GUI and --metrics servers are bound. By default
             127.0.0.1 (localhost) is used which means the GUI
             is only reachable from this machine. You may set this to an
             IP address of an interface on this machine if you wish to make the
@@ -405,6 +1057,18 @@ def main():
                             action='store_true',
                             help="Enable the nicegui reload functionality. Useful during development.")
 
+        parser.add_argument("--profile",
+                            help="Profile the program (including the GUI worker threads) and save the profile to this file on exit. "
+                                 "The file can be read with the python pstats module or snakeviz. The GUI Diagnostics panel can also "
+                                 "profile the GUI for a number of seconds without restarting it.",
+                            default=None)
+        parser.add_argument("--profile-sample",
+                            help="If greater than 0 then --profile samples the stack of every thread this often in milliseconds rather "
+                                 "than recording every call. This has a lower overhead. The file holds one line per stack for flame graph "
+                                 "tools (E.G flamegraph.pl or speedscope) (default=0).",
+                            type=float,
+                            default=0.0)
+
         options = parser.parse_args()
         uio.enableDebug(options.debug)
         uio.logAll(True)
@@ -413,8 +1077,22 @@ def main():
             host, port = options.p.split(':')
             options.p = (host, int(port))
 
-        psu = PSU(uio, options)
-        psu.process()
+        profiler = None
+        if options.profile:
+            profiler = createProfiler(sampleMS=options.profile_sample)
+            profiler.start()
+
+        try:
+            psu = PSU(uio, options)
+            psu.process()
+
+        finally:
+            if profiler:
+                profiler.stop()
+                profiler.save(options.profile)
+                # Don't add to the readings streamed to stdout
+                if not options.stream:
+                    uio.info(f"Saved the profile to {options.profile}")
 
     # If the program throws a system exit exception
     except SystemExit:
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+import threading
+
+from time import monotonic
+
+
+class LogReplayer(object):
+    """@brief Responsible for replaying recorded readings in a background thread at the speed they
+              were recorded, a multiple of that speed or as fast as possible. Replay may be paused,
+              resumed and moved to any point in the log."""
+
+    def __init__(self, samples, readingCallback, speed=1.0):
+        """@brief Constructor
+           @param samples A SampleStore instance holding the readings in time order.
+           @param readingCallback Called with each Reading instance as it is replayed and the seek count
+                                  (see getSeekCount()) when the reading was replayed. This is called
+                                  from the replay thread and may block to slow the replay.
+           @param speed The replay speed (E.G 1 = as recorded, 10 = ten times faster, 0 = as fast as possible)."""
+        self._samples = samples
+        self._readingCallback = readingCallback
+        self._speed = speed
+        self._condition = threading.Condition()
+        self._index = 0
+        self._paused = True
+        self._running = False
+        self._thread = None
+        # The monotonic() time at which the reading at _syncIndex is replayed.
+        self._syncTime = None
+        self._syncIndex = 0
+        # The number of times the replay position has been moved.
+        self._seekCount = 0
+
+    def getReadingCount(self):
+        """@return The number of readings in the log."""
+        return len(self._samples)
+
+    def _getOffset(self, index):
+        """@param index The index of a reading.
+           @return The time of the reading in seconds from the start of the log."""
+        return self._samples.getTime(index) - self._samples.getTime(0)
+
+    def getDuration(self):
+        """@return The duration of the log in seconds."""
+        if len(self._samples) == 0:
+            return 0.0
+        return self._getOffset(-1)
+
+    def getPosition(self):
+        """@return A tuple containing
+                   0: The index of the next reading to be replayed.
+                   1: The offset of the next reading in seconds from the start of the log."""
+        with self._condition:
+            index = self._index
+        if index < len(self._samples):
+            return (index, self._getOffset(index))
+        return (index, self.getDuration())
+
+    def getSeekCount(self):
+        """@return The number of times the replay position has been moved. A reading passed to the
+                   reading callback with a lower seek count was replayed before the last move."""
+        with self._condition:
+            return self._seekCount
+
+    def isPaused(self):
+        """@return True if the replay is paused (or has reached the end of the log)."""
+        return self._paused
+
+    def _sync(self):
+        """@brief Restart timing from the next reading. Called with the condition held."""
+        self._syncTime = monotonic()
+        self._syncIndex = self._index
+
+    def start(self):
+        """@brief Start the replay thread and start replaying."""
+        self._running = True
+        self._thread = threading.Thread(target=self._replay, daemon=True)
+        self._thread.start()
+        self.play()
+
+    def stop(self):
+        """@brief Stop replaying and stop the replay thread."""
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def play(self):
+        """@brief Resume replaying. If the end of the log has been reached replay restarts at the start of the log."""
+        with self._condition:
+            if self._index >= len(self._samples):
+                self._index = 0
+            self._paused = False
+            self._sync()
+            self._condition.notify_all()
+
+    def pause(self):
+        """@brief Pause replaying."""
+        with self._condition:
+            self._paused = True
+            self._condition.notify_all()
+
+    def setSpeed(self, speed):
+        """@brief Set the replay speed.
+           @param speed The replay speed (E.G 1 = as recorded, 10 = ten times faster, 0 = as fast as possible)."""
+        with self._condition:
+            self._speed = speed
+            self._sync()
+            self._condition.notify_all()
+
+    def seek(self, fraction):
+        """@brief Move the replay position.
+           @param fraction The position as a fraction (0 - 1) of the log duration."""
+        fraction = min(max(fraction, 0.0), 1.0)
+        with self._condition:
+            if len(self._samples) > 0:
+                self._index = self._samples.bisectTime(self._samples.getTime(0) + self.getDuration() * fraction)
+            self._seekCount += 1
+            self._sync()
+            self._condition.notify_all()
+
+    def _replay(self):
+        """@brief Replay readings until stopped. This runs in the replay thread."""
+        while True:
+            with self._condition:
+                if not self._running:
+                    break
+                if self._paused:
+                    self._condition.wait()
+                    continue
+                if self._index >= len(self._samples):
+                    self._paused = True
+                    continue
+                if self._speed > 0:
+                    elapsed = self._samples.getTime(self._index) - self._samples.getTime(self._syncIndex)
+                    delay = self._syncTime + elapsed / self._speed - monotonic()
+                    if delay > 0:
+                        # Wake early if paused, moved or the speed changes
+                        self._condition.wait(delay)
+                        continue
+                reading = self._samples[self._index]
+                self._index += 1
+                seekCount = self._seekCount
+            self._readingCallback(reading, seekCount)
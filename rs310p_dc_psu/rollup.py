@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+
+import os
+
+from datetime import datetime
+
+from rs310p_dc_psu.logfile import TIME_FORMAT, COMMENT_PREFIX, Reading, readReadings, readMetadata, readTailLines, getTimeRange
+from rs310p_dc_psu.deadband import DEADBAND_KEY
+
+# The name and period (seconds) of each rollup tier, finest first.
+TIER_LIST = (("1s", 1), ("1m", 60), ("1h", 3600))
+# The first line written to a rollup file.
+ROLLUP_HEADER = "TIME,COUNT,VOLTS_MIN,VOLTS_MAX,VOLTS_MEAN,VOLTS_LAST,AMPS_MIN,AMPS_MAX,AMPS_MEAN,AMPS_LAST,WATTS_MIN,WATTS_MAX,WATTS_MEAN,WATTS_LAST\n"
+CHANNEL_LIST = ("volts", "amps", "watts")
+
+
+def getRollupFilename(filename, tierName):
+    """@param filename The log file name.
+       @param tierName The tier name (E.G 1m).
+       @return The name of the file holding the rollup tier of the log."""
+    return f"{filename}.{tierName}.csv"
+
+
+def removeRollups(filename):
+    """@brief Delete the rollup tier files of a log (E.G when the log is created again).
+       @param filename The log file name."""
+    for name, _ in TIER_LIST:
+        rollupFile = getRollupFilename(filename, name)
+        if os.path.isfile(rollupFile):
+            os.remove(rollupFile)
+
+
+class RollupBucket(object):
+    """@brief Holds the min, max, mean and last value of each channel over a rollup period. The mean is
+              weighted by the number of readings or (for held values) by the time each value was held."""
+
+    def __init__(self, startTime):
+        """@brief Constructor
+           @param startTime The start of the period (seconds since the epoch)."""
+        self.startTime = startTime
+        self.count = 0
+        self.weight = 0.0
+        self.minList = [None, None, None]
+        self.maxList = [None, None, None]
+        self.sumList = [0.0, 0.0, 0.0]
+        self.lastList = [None, None, None]
+
+    def add(self, valueList, count=1, minList=None, maxList=None, weight=None):
+        """@brief Add values to the bucket.
+           @param valueList The volts, amps and watts values (the mean values if count > 1).
+           @param count The number of readings the values represent.
+           @param minList The minimum volts, amps and watts values if count > 1.
+           @param maxList The maximum volts, amps and watts values if count > 1.
+           @param weight The weight of the values in the mean (E.G the seconds a value was held). If None count is used."""
+        if weight is None:
+            weight = count
+        for index, value in enumerate(valueList):
+            minValue = value if minList is None else minList[index]
+            maxValue = value if maxList is None else maxList[index]
+            if self.minList[index] is None or minValue < self.minList[index]:
+                self.minList[index] = minValue
+            if self.maxList[index] is None or maxValue > self.maxList[index]:
+                self.maxList[index] = maxValue
+            self.sumList[index] += value * weight
+        self.lastList = list(valueList)
+        self.count += count
+        self.weight += weight
+
+    def getMeanList(self):
+        """@return The mean volts, amps and watts values."""
+        if self.weight <= 0:
+            # Only values held for no time (E.G the last reading of a log)
+            return list(self.lastList)
+        return [total / self.weight for total in self.sumList]
+
+    def getReading(self):
+        """@return A Reading instance holding the mean values at the start of the period."""
+        return Reading(datetime.fromtimestamp(self.startTime), *self.getMeanList())
+
+    def getMinReading(self):
+        """@return A Reading instance holding the minimum values at the start of the period."""
+        return Reading(datetime.fromtimestamp(self.startTime), *self.minList)
+
+    def getMaxReading(self):
+        """@return A Reading instance holding the maximum values at the start of the period."""
+        return Reading(datetime.fromtimestamp(self.startTime), *self.maxList)
+
+    def formatLine(self):
+        """@return The line (including the line terminator) to be written to a rollup file."""
+        elems = [datetime.fromtimestamp(self.startTime).strftime(TIME_FORMAT), str(self.count)]
+        for index, mean in enumerate(self.getMeanList()):
+            elems += [str(self.minList[index]), str(self.maxList[index]), f"{mean:.6g}", str(self.lastList[index])]
+        return ",".join(elems) + "\n"
+
+
+def parseRollupLine(line):
+    """@brief Parse a line read from a rollup file.
+       @param line The line of text.
+       @return A RollupBucket instance or None if the line does not hold a bucket (E.G a header line)."""
+    if line.startswith(COMMENT_PREFIX):
+        return None
+    elems = line.strip().split(',')
+    if len(elems) != 14:
+        return None
+    try:
+        startTime = datetime.strptime(elems[0], TIME_FORMAT).timestamp()
+        count = int(elems[1])
+        values = [float(elem) for elem in elems[2:]]
+    except ValueError:
+        return None
+    bucket = RollupBucket(startTime)
+    bucket.count = count
+    # A bucket in which values were only held (no readings) has a count of 0
+    bucket.weight = max(count, 1)
+    bucket.minList = values[0::4]
+    bucket.maxList = values[1::4]
+    bucket.sumList = [mean * bucket.weight for mean in values[2::4]]
+    bucket.lastList = values[3::4]
+    return bucket
+
+
+def readRollup(filename, tierName):
+    """@brief Read a rollup tier of a log.
+       @param filename The log file name.
+       @param tierName The tier name (E.G 1m).
+       @return A list of RollupBucket instances. Buckets with the same start time (E.G written by
+               recordings before and after a restart) are merged."""
+    bucketList = []
+    with open(getRollupFilename(filename, tierName), 'r') as fd:
+        for line in fd:
+            bucket = parseRollupLine(line)
+            if bucket is None:
+                continue
+            if bucketList and bucketList[-1].startTime == bucket.startTime:
+                previous = bucketList[-1]
+                previous.add(bucket.getMeanList(), count=bucket.count, minList=bucket.minList, maxList=bucket.maxList, weight=bucket.weight)
+                previous.lastList = bucket.lastList
+            else:
+                bucketList.append(bucket)
+    return bucketList
+
+
+class RollupTier(object):
+    """@brief Responsible for rolling up readings into fixed periods and writing a line to the
+              tier file as each period completes."""
+
+    def __init__(self, filename, name, seconds, mode='a'):
+        """@brief Constructor
+           @param filename The log file name.
+           @param name The tier name.
+           @param seconds The period of each bucket in seconds.
+           @param mode The mode used to open the tier file ('a' to append or 'w' to replace)."""
+        self._seconds = seconds
+        self._bucket = None
+        rollupFile = getRollupFilename(filename, name)
+        writeHeader = mode == 'w' or not os.path.isfile(rollupFile)
+        self._fd = open(rollupFile, mode)
+        if writeHeader:
+            self._fd.write(ROLLUP_HEADER)
+
+    def add(self, timeStamp, valueList):
+        """@brief Add a reading to the tier.
+           @param timeStamp The time of the reading (seconds since the epoch).
+           @param valueList The volts, amps and watts values."""
+        startTime = timeStamp - timeStamp % self._seconds
+        if self._bucket is None or startTime != self._bucket.startTime:
+            self._writeBucket()
+            self._bucket = RollupBucket(startTime)
+        self._bucket.add(valueList)
+
+    def addHeld(self, timeStamp, stopTime, valueList):
+        """@brief Add a value that is held until a later time. The value is added to each bucket it was held
+                  in, weighted by the time it was held in the bucket.
+           @param timeStamp The time of the reading (seconds since the epoch).
+           @param stopTime The time the value was held until (seconds since the epoch).
+           @param valueList The volts, amps and watts values."""
+        count = 1
+        while True:
+            startTime = timeStamp - timeStamp % self._seconds
+            if self._bucket is None or startTime != self._bucket.startTime:
+                self._writeBucket()
+                self._bucket = RollupBucket(startTime)
+            endTime = min(stopTime, startTime + self._seconds)
+            self._bucket.add(valueList, count=count, weight=max(0.0, endTime - timeStamp))
+            # The reading is only counted in the bucket it was read in
+            count = 0
+            if endTime >= stopTime:
+                break
+            timeStamp = endTime
+
+    def _writeBucket(self):
+        """@brief Write the current bucket (if any) to the tier file."""
+        if self._bucket is not None:
+            self._fd.write(self._bucket.formatLine())
+            self._fd.flush()
+
+    def close(self):
+        """@brief Write the current (part filled) bucket and close the tier file."""
+        self._writeBucket()
+        self._bucket = None
+        self._fd.close()
+
+
+class RollupWriter(object):
+    """@brief Responsible for maintaining the rollup tiers of a log as readings are recorded.
+              Each reading updates the current bucket of each tier and a line is written to a tier
+              file only when a bucket completes so the cost per reading is fixed."""
+
+    def __init__(self, filename, mode='a'):
+        """@brief Constructor
+           @param filename The log file name. The tier files are written alongside this file.
+           @param mode The mode used to open the tier files ('a' to append or 'w' to replace)."""
+        self._tierList = [RollupTier(filename, name, seconds, mode=mode) for name, seconds in TIER_LIST]
+
+    def add(self, reading):
+        """@brief Add a reading to the rollup tiers.
+           @param reading A Reading instance."""
+        timeStamp = reading.time.timestamp()
+        valueList = (reading.volts, reading.amps, reading.watts)
+        for tier in self._tierList:
+            tier.add(timeStamp, valueList)
+
+    def addHeld(self, reading, stopTime):
+        """@brief Add a reading whose values are held until a later time (E.G a reading in a deadband log).
+           @param reading A Reading instance.
+           @param stopTime The time the values were held until (seconds since the epoch)."""
+        timeStamp = reading.time.timestamp()
+        valueList = (reading.volts, reading.amps, reading.watts)
+        for tier in self._tierList:
+            tier.addHeld(timeStamp, stopTime, valueList)
+
+    def close(self):
+        """@brief Write the part filled buckets and close the tier files."""
+        for tier in self._tierList:
+            tier.close()
+
+
+def backfillRollups(filename):
+    """@brief Create the rollup tiers of an existing log (including any rotated segments). Existing tier files are replaced.
+              If the log was recorded with deadbands (only changes recorded) each value is held until the next
+              reading and the means are weighted by the time each value was held.
+       @param filename The log file name.
+       @return The number of readings read from the log."""
+    holdValues = DEADBAND_KEY in readMetadata(filename)
+    readingCount = 0
+    previous = None
+    rollupWriter = RollupWriter(filename, mode='w')
+    try:
+        for reading in readReadings(filename):
+            if holdValues:
+                if previous is not None:
+                    rollupWriter.addHeld(previous, reading.time.timestamp())
+                previous = reading
+            else:
+                rollupWriter.add(reading)
+            readingCount += 1
+        if previous is not None:
+            rollupWriter.addHeld(previous, previous.time.timestamp())
+    finally:
+        rollupWriter.close()
+    return readingCount
+
+
+def _isTierCovering(filename, name, seconds, startTime, stopTime):
+    """@brief Check that a rollup tier holds the readings from the start to the end of a log. This is not the
+              case if readings were added to the log without updating the tier (E.G recorded without --rollup
+              or by the GUI) or the tier was left by a previous log of the same name.
+       @param filename The log file name.
+       @param name The tier name.
+       @param seconds The period of each bucket in seconds.
+       @param startTime The time of the first reading in the log (seconds since the epoch).
+       @param stopTime The time of the last reading in the log (seconds since the epoch).
+       @return True if the tier covers the log."""
+    rollupFile = getRollupFilename(filename, name)
+    if not os.path.isfile(rollupFile):
+        return False
+    firstBucket = None
+    with open(rollupFile, 'r') as fd:
+        for line in fd:
+            firstBucket = parseRollupLine(line)
+            if firstBucket:
+                break
+    lastBucket = None
+    for line in reversed(readTailLines(rollupFile)):
+        lastBucket = parseRollupLine(line)
+        if lastBucket:
+            break
+    if firstBucket is None or lastBucket is None:
+        return False
+    return firstBucket.startTime <= startTime and lastBucket.startTime + seconds > stopTime
+
+
+def selectTier(filename, pointCount):
+    """@brief Select the coarsest rollup tier that has at least pointCount buckets over the period of the log.
+              A tier is only selected if it covers the whole log.
+       @param filename The log file name.
+       @param pointCount The number of points required (E.G the plot width in pixels).
+       @return The tier name or None if there are no rollup tiers covering the log or no tier is coarse
+               enough to have fewer points than the raw log and fine enough to fill the plot."""
+    timeRange = getTimeRange(filename)
+    if timeRange is None:
+        return None
+    startTime = timeRange[0].timestamp()
+    stopTime = timeRange[1].timestamp()
+    spanSeconds = stopTime - startTime
+    for name, seconds in reversed(TIER_LIST):
+        if spanSeconds / seconds >= pointCount and _isTierCovering(filename, name, seconds, startTime, stopTime):
+            return name
+    return None
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta
+
+from rs310p_dc_psu.logfile import Reading, parseValues, readLines, readMetadata
+from rs310p_dc_psu.deadband import DEADBAND_KEY
+
+# Sample times are held as seconds from this (naive, local) time so that they convert back to the
+# same local time as was recorded (a log file holds local times without a time zone).
+EPOCH = datetime(1970, 1, 1)
+
+
+def toSeconds(timeStamp):
+    """@param timeStamp A (naive, local) datetime instance.
+       @return The time as seconds from EPOCH."""
+    return (timeStamp - EPOCH).total_seconds()
+
+
+def toDatetime(seconds):
+    """@param seconds A time as seconds from EPOCH.
+       @return The time as a datetime instance."""
+    return EPOCH + timedelta(seconds=seconds)
+
+
+class SampleStore(object):
+    """@brief Responsible for holding a series of samples in columns. Each column is a typed array
+              (8 bytes per value) rather than a Python object per sample, appending is amortised
+              O(1) and getColumn() returns a slice of a column without copying it.
+              Reading instances are created on demand when a sample is indexed or iterated."""
+
+    TIME = "time"
+    VOLTS = "volts"
+    AMPS = "amps"
+    WATTS = "watts"
+    COLUMNS = (TIME, VOLTS, AMPS, WATTS)
+
+    # Samples removed from the start are only deleted from the columns when more than this many
+    # (and more than half the columns) have been removed so that removing them is amortised O(1).
+    MIN_COMPACT_COUNT = 1024
+
+    def __init__(self):
+        """@brief Constructor"""
+        self._columnDict = {name: array('d') for name in SampleStore.COLUMNS}
+        self._times = self._columnDict[SampleStore.TIME]
+        self._volts = self._columnDict[SampleStore.VOLTS]
+        self._amps = self._columnDict[SampleStore.AMPS]
+        self._watts = self._columnDict[SampleStore.WATTS]
+        # The index of the first sample. Samples before this have been discarded.
+        self._start = 0
+
+    @staticmethod
+    def fromReadings(readings):
+        """@brief Create a SampleStore holding readings.
+           @param readings An iterable of Reading instances.
+           @return A SampleStore instance."""
+        sampleStore = SampleStore()
+        for reading in readings:
+            sampleStore.appendReading(reading)
+        return sampleStore
+
+    def __len__(self):
+        return len(self._times) - self._start
+
+    def _getIndex(self, index):
+        """@param index The index of a sample (negative values index from the end).
+           @return The index of the sample in the columns."""
+        length = len(self)
+        if index < 0:
+            index += length
+        if index < 0 or index >= length:
+            raise IndexError("sample index out of range")
+        return self._start + index
+
+    def __getitem__(self, index):
+        """@param index The index of a sample (negative values index from the end).
+           @return A Reading instance holding the sample."""
+        index = self._getIndex(index)
+        return Reading(toDatetime(self._times[index]), self._volts[index], self._amps[index], self._watts[index])
+
+    def __iter__(self):
+        for index in range(self._start, len(self._times)):
+            yield Reading(toDatetime(self._times[index]), self._volts[index], self._amps[index], self._watts[index])
+
+    def append(self, timeSeconds, volts, amps, watts):
+        """@brief Append a sample.
+           @param timeSeconds The time of the sample in seconds from EPOCH (see toSeconds()).
+           @param volts The voltage.
+           @param amps The current.
+           @param watts The power."""
+        self._times.append(timeSeconds)
+        self._volts.append(volts)
+        self._amps.append(amps)
+        self._watts.append(watts)
+
+    def appendReading(self, reading):
+        """@brief Append a sample.
+           @param reading A Reading instance."""
+        self.append(toSeconds(reading.time), reading.volts, reading.amps, reading.watts)
+
+    def copy(self):
+        """@return A SampleStore instance holding a copy of the samples."""
+        sampleStore = SampleStore()
+        for name, column in self._columnDict.items():
+            sampleStore._columnDict[name].extend(memoryview(column)[self._start:])
+        return sampleStore
+
+    def discard(self, count):
+        """@brief Remove the oldest samples.
+           @param count The number of samples to remove."""
+        self._start = min(self._start + count, len(self._times))
+        if self._start > SampleStore.MIN_COMPACT_COUNT and self._start * 2 > len(self._times):
+            for column in self._columnDict.values():
+                del column[:self._start]
+            self._start = 0
+
+    def clear(self):
+        """@brief Remove all the samples."""
+        for column in self._columnDict.values():
+            del column[:]
+        self._start = 0
+
+    def getTime(self, index):
+        """@param index The index of a sample (negative values index from the end).
+           @return The time of the sample in seconds from EPOCH."""
+        return self._times[self._getIndex(index)]
+
+    def bisectTime(self, timeSeconds):
+        """@param timeSeconds A time in seconds from EPOCH.
+           @return The index of the first sample at or after the time."""
+        return bisect_left(self._times, timeSeconds, self._start) - self._start
+
+    def getColumn(self, name, start=0, stop=None):
+        """@brief Get a slice of a column without copying it.
+                  The samples cannot be appended or discarded while the returned memoryview is held.
+           @param name The column name (SampleStore.TIME, VOLTS, AMPS or WATTS).
+           @param start The index of the first sample.
+           @param stop The index after the last sample or None for the end of the column.
+           @return A memoryview of the column values."""
+        length = len(self)
+        if stop is None or stop > length:
+            stop = length
+        return memoryview(self._columnDict[name])[self._start + start:self._start + stop]
+
+    def getMemoryBytes(self):
+        """@return The number of bytes used by the sample columns."""
+        return sum(column.buffer_info()[1] * column.itemsize for column in self._columnDict.values())
+
+
+def loadSamples(filename, holdValues=None):
+    """@brief Load all the readings in a log (including any rotated and compressed segments) without
+              creating a Reading instance for each reading.
+       @param filename The log file name.
+       @param holdValues If True each value is held until the next reading (E.G a deadband log that only
+                         holds changes). A sample holding the previous values is added at the time of each
+                         reading so the held signal is plotted and replayed as recorded. If None the values
+                         are held if the log was recorded with deadbands.
+       @return A SampleStore instance."""
+    if holdValues is None:
+        holdValues = DEADBAND_KEY in readMetadata(filename)
+    sampleStore = SampleStore()
+    append = sampleStore.append
+    previous = None
+    for line in readLines(filename):
+        values = parseValues(line)
+        if values:
+            seconds = toSeconds(values[0])
+            if holdValues:
+                if previous is not None:
+                    append(seconds, previous[1], previous[2], previous[3])
+                previous = values
+            append(seconds, values[1], values[2], values[3])
+    return sampleStore
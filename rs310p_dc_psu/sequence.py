@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+
+import os
+import csv
+
+from time import monotonic, perf_counter, sleep
+
+from rs310p_dc_psu.controller import ETMXXXXPError
+from rs310p_dc_psu.logfile import Reading
+
+# The package extra that installs pyyaml.
+YAML_EXTRA = "yaml"
+
+
+class SequenceStep(object):
+    """@brief Holds a single step in a voltage/current sequence."""
+
+    def __init__(self, offset, volts=None, amps=None, output=None, ramp=False):
+        """@brief Constructor
+           @param offset The time of the step in seconds from the start of the sequence.
+           @param volts The output voltage or None to leave it unchanged.
+           @param amps The current limit or None to leave it unchanged.
+           @param output True to turn the output on, False to turn it off or None to leave it unchanged.
+           @param ramp If True the voltage and current limit are ramped from the previous step to this step."""
+        self.offset = offset
+        self.volts = volts
+        self.amps = amps
+        self.output = output
+        self.ramp = ramp
+
+    def __str__(self):
+        return f"{self.offset:.3f}s volts={self.volts} amps={self.amps} output={self.output}"
+
+
+class StepResult(object):
+    """@brief Holds the planned and actual timing of a step that has been executed."""
+
+    def __init__(self, index, step, plannedTime, actualTime, writeSeconds):
+        """@brief Constructor
+           @param index The index of the step in the executed sequence.
+           @param step The SequenceStep instance.
+           @param plannedTime The planned time of the step in seconds from the start of the sequence.
+           @param actualTime The time the step was executed in seconds from the start of the sequence.
+           @param writeSeconds The time taken to write the step to the PSU in seconds."""
+        self.index = index
+        self.step = step
+        self.plannedTime = plannedTime
+        self.actualTime = actualTime
+        self.writeSeconds = writeSeconds
+
+    def getErrorMS(self):
+        """@return The difference between the actual and planned step time in milliseconds."""
+        return (self.actualTime - self.plannedTime) * 1000.0
+
+
+def _parseOptionalFloat(value):
+    """@param value A value read from a sequence file.
+       @return The value as a float or None if the value is empty."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.strip()
+        if len(value) == 0:
+            return None
+    return float(value)
+
+
+def _parseOptionalBool(value):
+    """@param value A value read from a sequence file (on/off, 1/0, true/false).
+       @return True, False or None if the value is empty."""
+    if value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return bool(value)
+    value = value.strip().lower()
+    if len(value) == 0:
+        return None
+    if value in ("on", "1", "true", "yes"):
+        return True
+    if value in ("off", "0", "false", "no"):
+        return False
+    raise ValueError(f"{value} is not a valid on/off value")
+
+
+def _createStep(stepDict):
+    """@brief Create a step from a dict read from a sequence file.
+       @param stepDict A dict with a time key and optional volts, amps, output and ramp keys (case insensitive).
+       @return A SequenceStep instance."""
+    stepDict = {str(key).strip().lower(): value for key, value in stepDict.items()}
+    offset = _parseOptionalFloat(stepDict.get("time"))
+    if offset is None:
+        raise ValueError("The step time is missing")
+    return SequenceStep(offset,
+                        volts=_parseOptionalFloat(stepDict.get("volts")),
+                        amps=_parseOptionalFloat(stepDict.get("amps")),
+                        output=_parseOptionalBool(stepDict.get("output")),
+                        ramp=bool(_parseOptionalBool(stepDict.get("ramp"))))
+
+
+def loadSequence(filename):
+    """@brief Load a sequence file.
+              A CSV file must have a header line with TIME,VOLTS,AMPS,OUTPUT and optionally RAMP columns.
+              A YAML file (.yaml or .yml) must hold a list of steps (or a dict with a steps key) each with
+              time and optionally volts, amps, output and ramp keys.
+              Empty values leave the PSU setting unchanged. The time is in seconds from the start of the sequence.
+       @param filename The sequence file.
+       @return A list of SequenceStep instances sorted by time."""
+    extension = os.path.splitext(filename)[1].lower()
+    if extension in (".yaml", ".yml"):
+        try:
+            import yaml
+        except ImportError:
+            raise ETMXXXXPError(f"The pyyaml module must be installed to load YAML sequence files (pip install \"rs310p-dc-psu[{YAML_EXTRA}]\").")
+        with open(filename, 'r') as fd:
+            data = yaml.safe_load(fd)
+        if isinstance(data, dict):
+            data = data.get("steps")
+        if not isinstance(data, list):
+            raise ETMXXXXPError(f"{filename} does not hold a list of steps.")
+        stepDictList = data
+
+    else:
+        with open(filename, 'r', newline='') as fd:
+            stepDictList = list(csv.DictReader(fd))
+
+    stepList = []
+    for index, stepDict in enumerate(stepDictList):
+        try:
+            stepList.append(_createStep(stepDict))
+        except (ValueError, TypeError, AttributeError) as ex:
+            raise ETMXXXXPError(f"{filename}: step {index+1} is invalid ({ex}).")
+
+    if not stepList:
+        raise ETMXXXXPError(f"{filename} does not contain any steps.")
+    stepList.sort(key=lambda step: step.offset)
+    return stepList
+
+
+def expandRamps(stepList, rampPeriod):
+    """@brief Replace ramp steps with a series of steps that move the voltage and current limit
+              linearly from the previous step to the ramp step.
+       @param stepList A list of SequenceStep instances sorted by time.
+       @param rampPeriod The time between ramp steps in seconds.
+       @return A list of SequenceStep instances."""
+    if rampPeriod <= 0:
+        raise ETMXXXXPError("The ramp step period must be greater than 0.")
+    expandedList = []
+    volts = None
+    amps = None
+    previousOffset = 0.0
+    for step in stepList:
+        if step.ramp and expandedList:
+            duration = step.offset - previousOffset
+            stepCount = int(duration / rampPeriod)
+            for index in range(1, stepCount):
+                fraction = index * rampPeriod / duration
+                rampVolts = None
+                rampAmps = None
+                if step.volts is not None and volts is not None:
+                    rampVolts = round(volts + (step.volts - volts) * fraction, 2)
+                if step.amps is not None and amps is not None:
+                    rampAmps = round(amps + (step.amps - amps) * fraction, 3)
+                expandedList.append(SequenceStep(previousOffset + index * rampPeriod, volts=rampVolts, amps=rampAmps))
+        expandedList.append(step)
+        if step.volts is not None:
+            volts = step.volts
+        if step.amps is not None:
+            amps = step.amps
+        previousOffset = step.offset
+    return expandedList
+
+
+class SequencePlayer(object):
+    """@brief Responsible for executing a sequence of steps against the PSU on a monotonic deadline
+              scheduler. Only settings that change are written and the voltage and current limit are
+              written in a single command when both change. The PSU output is read between steps
+              when there is time to do so without delaying the next step."""
+
+    # Sleep until this many seconds before a deadline and then wait without sleeping.
+    SPIN_SECONDS = 0.002
+    # The PSU is not read before a step unless there is at least this much time until the step
+    # and the time a read takes is not known.
+    FIRST_READ_SECONDS = 0.25
+
+    def __init__(self, psuIF, stepList, measure=True, measurementCallback=None, watchdog=None):
+        """@brief Constructor
+           @param psuIF The ETMXXXXP instance connected to the PSU.
+           @param stepList A list of SequenceStep instances sorted by time.
+           @param measure If True read the PSU output between steps.
+           @param measurementCallback If set this is called with (reading, sampleTime) for each measurement.
+           @param watchdog An optional Watchdog instance. The sequence is stopped before the next step if it has tripped."""
+        self._psuIF = psuIF
+        self._stepList = stepList
+        self._measure = measure
+        self._measurementCallback = measurementCallback
+        self._watchdog = watchdog
+        # The time taken to read the PSU output. This is updated with each read.
+        self._readSeconds = None
+        self._clearSettings()
+
+    def _clearSettings(self):
+        """@brief Forget the settings written to the PSU so that every setting in the next step is written."""
+        self._volts = None
+        self._amps = None
+        self._output = None
+
+    def getPeriod(self):
+        """@return The time from the start of the sequence to the last step in seconds."""
+        return self._stepList[-1].offset
+
+    def run(self, repeatCount=1):
+        """@brief Execute the sequence.
+           @param repeatCount The number of times to execute the sequence. Each repeat starts at the time of the last step.
+           @return A list of StepResult instances."""
+        resultList = []
+        period = self.getPeriod()
+        if repeatCount > 1 and period <= 0:
+            raise ETMXXXXPError("A sequence must have a duration greater than 0 to be repeated.")
+        lastStep = self._stepList[-1]
+        # If the sequence starts at time 0 the last step of a repeat is replaced by the first step of the next repeat.
+        skipLastStep = self._stepList[0].offset == 0
+        index = 0
+        startTime = monotonic()
+        try:
+            for repeat in range(repeatCount):
+                for step in self._stepList:
+                    if skipLastStep and step is lastStep and repeat < repeatCount - 1:
+                        continue
+                    plannedTime = repeat * period + step.offset
+                    self._waitUntil(startTime + plannedTime)
+                    # The watchdog turned the output off. Don't let a later step turn it back on.
+                    if self._watchdog and self._watchdog.isTripped():
+                        raise ETMXXXXPError("The sequence was stopped because the watchdog tripped.")
+                    actualTime = monotonic()
+                    self._apply(step)
+                    writeSeconds = monotonic() - actualTime
+                    resultList.append(StepResult(index, step, plannedTime, actualTime - startTime, writeSeconds))
+                    index += 1
+
+        except Exception:
+            # The PSU settings are not known (E.G the output was turned off by the watchdog or a write failed).
+            self._clearSettings()
+            raise
+
+        return resultList
+
+    def _apply(self, step):
+        """@brief Write the settings that have changed to the PSU.
+           @param step The SequenceStep instance."""
+        volts = step.volts if step.volts != self._volts else None
+        amps = step.amps if step.amps != self._amps else None
+        output = step.output if step.output != self._output else None
+
+        # Turn the output off before changing the settings.
+        if output is False:
+            self._psuIF.setOutput(False)
+
+        if volts is not None and amps is not None:
+            self._psuIF.setVoltageAndCurrentLimit(volts, amps)
+        elif volts is not None:
+            self._psuIF.setVoltage(volts)
+        elif amps is not None:
+            self._psuIF.setCurrentLimit(amps)
+
+        # Turn the output on after changing the settings.
+        if output is True:
+            self._psuIF.setOutput(True)
+
+        if volts is not None:
+            self._volts = volts
+        if amps is not None:
+            self._amps = amps
+        if output is not None:
+            self._output = output
+
+    def _waitUntil(self, deadline):
+        """@brief Read the PSU output while there is time to do so before the deadline and then
+                  wait until the deadline.
+           @param deadline The monotonic() time to wait for."""
+        while self._measure:
+            if self._readSeconds is None:
+                # The time a read takes is not known yet
+                requiredSeconds = SequencePlayer.FIRST_READ_SECONDS
+            else:
+                requiredSeconds = self._readSeconds * 1.5 + SequencePlayer.SPIN_SECONDS
+            if deadline - monotonic() <= requiredSeconds:
+                break
+            self._readOutput()
+
+        sleepSeconds = deadline - monotonic() - SequencePlayer.SPIN_SECONDS
+        if sleepSeconds > 0:
+            sleep(sleepSeconds)
+        while monotonic() < deadline:
+            pass
+
+    def _readOutput(self):
+        """@brief Read the PSU output and pass the reading to the measurement callback."""
+        # The watchdog times readings with perf_counter(). This is not the same clock as monotonic() on all platforms.
+        startTime = perf_counter()
+        volts, amps, watts = self._psuIF.getOutputStats()
+        sampleTime = perf_counter()
+        readSeconds = sampleTime - startTime
+        if self._readSeconds is None or readSeconds > self._readSeconds:
+            self._readSeconds = readSeconds
+        else:
+            # Allow the read time to fall slowly
+            self._readSeconds = self._readSeconds * 0.9 + readSeconds * 0.1
+        if self._measurementCallback:
+            self._measurementCallback(Reading(None, volts, amps, watts), sampleTime)
+
+
+def writeReport(filename, resultList):
+    """@brief Write the planned and actual timing of each step to a CSV file.
+       @param filename The report file.
+       @param resultList A list of StepResult instances."""
+    with open(filename, 'w', newline='') as fd:
+        writer = csv.writer(fd)
+        writer.writerow(["STEP", "PLANNED_SECONDS", "ACTUAL_SECONDS", "ERROR_MS", "WRITE_MS", "VOLTS", "AMPS", "OUTPUT"])
+        for result in resultList:
+            step = result.step
+            writer.writerow([result.index,
+                             f"{result.plannedTime:.6f}",
+                             f"{result.actualTime:.6f}",
+                             f"{result.getErrorMS():.3f}",
+                             f"{result.writeSeconds*1000.0:.3f}",
+                             "" if step.volts is None else step.volts,
+                             "" if step.amps is None else step.amps,
+                             "" if step.output is None else int(step.output)])
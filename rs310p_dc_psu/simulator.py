@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+
+import os
+import socket
+import select
+import threading
+import socketserver
+
+from time import sleep
+
+from pymodbus.framer import FramerRTU
+
+from rs310p_dc_psu.controller import ETMXXXXP
+
+
+class PSUSimulator(object):
+    """@brief Responsible for simulating a PSU with a resistive load on its output. Modbus RTU
+              requests (read holding registers, write register and write registers) are processed
+              as the PSU processes them. The time taken to send the request and response over the
+              PSU serial interface is simulated so that the round trip time is close to a real PSU."""
+
+    READ_REGISTERS = 0x03
+    WRITE_REGISTER = 0x06
+    WRITE_REGISTERS = 0x10
+    ILLEGAL_ADDRESS = 0x02
+    MODEL_ID = 3010
+    # The number of bits sent per byte (start bit, 8 data bits, stop bit)
+    BITS_PER_BYTE = 10
+
+    def __init__(self, loadOhms=10.0, slave=1, baudRate=9600, processingSeconds=0.002):
+        """@brief Constructor
+           @param loadOhms The resistance of the load on the PSU output.
+           @param slave The modbus unit number of the PSU.
+           @param baudRate The baud rate of the simulated PSU serial interface or 0 to respond immediately.
+           @param processingSeconds The time the PSU takes to process a request."""
+        self._loadOhms = loadOhms
+        self._slave = slave
+        self._baudRate = baudRate
+        self._processingSeconds = processingSeconds
+        self._lock = threading.Lock()
+        self._registers = {ETMXXXXP.OUTPUT_STATE_REG_ADDR: 0,
+                           ETMXXXXP.PROTECTION_STATE_REG_ADDR: 0,
+                           ETMXXXXP.MODEL_ID_REG_ADDR: PSUSimulator.MODEL_ID,
+                           ETMXXXXP.OVER_VOLTAGE_PROT_REG_ADDR: 3300,
+                           ETMXXXXP.OVER_CURRENT_PROT_REG_ADDR: 10500,
+                           ETMXXXXP.OVER_PWR_PROT_HI_REG_ADDR: 4,
+                           ETMXXXXP.OVER_PWR_PROT_LOW_REG_ADDR: 47792,
+                           ETMXXXXP.VOLTAGE_TARGET_REG_ADDR: 500,
+                           ETMXXXXP.CURRENT_LIMIT_REG_ADDR: 1000,
+                           ETMXXXXP.BUZZER_REG_ADDR: 1}
+        self._updateOutput()
+
+    def _updateOutput(self):
+        """@brief Update the output voltage, current and power registers from the settings. Called with the lock held."""
+        volts = 0.0
+        amps = 0.0
+        if self._registers[ETMXXXXP.OUTPUT_STATE_REG_ADDR]:
+            volts = self._registers[ETMXXXXP.VOLTAGE_TARGET_REG_ADDR] / 100.0
+            amps = volts / self._loadOhms
+            currentLimit = self._registers[ETMXXXXP.CURRENT_LIMIT_REG_ADDR] / 1000.0
+            # Constant current mode
+            if amps > currentLimit:
+                amps = currentLimit
+                volts = amps * self._loadOhms
+        milliWatts = int(volts * amps * 1000.0)
+        self._registers[ETMXXXXP.OUTPUT_VOLTAGE_REG_ADDR] = int(volts * 100.0)
+        self._registers[ETMXXXXP.OUTPUT_CURRENT_REG_ADDR] = int(amps * 1000.0)
+        self._registers[ETMXXXXP.OUTPUT_PWR_HI_REG_ADDR] = milliWatts >> 16
+        self._registers[ETMXXXXP.OUTPUT_PWR_LO_REG_ADDR] = milliWatts & 0xffff
+
+    def _getTransferSeconds(self, byteCount):
+        """@param byteCount The number of bytes.
+           @return The time taken to send the bytes over the PSU serial interface."""
+        if self._baudRate <= 0:
+            return 0.0
+        return byteCount * PSUSimulator.BITS_PER_BYTE / self._baudRate
+
+    @staticmethod
+    def getRequestLength(data):
+        """@param data The bytes received so far.
+           @return The length of the request frame at the start of data or None if more bytes are needed to know it."""
+        if len(data) < 2:
+            return None
+        if data[1] == PSUSimulator.WRITE_REGISTERS:
+            if len(data) < 7:
+                return None
+            return 9 + data[6]
+        return 8
+
+    @staticmethod
+    def _addCRC(frame):
+        """@param frame The frame without a CRC.
+           @return The frame with its CRC."""
+        return frame + FramerRTU.compute_CRC(frame).to_bytes(2, byteorder='big')
+
+    def processRequest(self, request):
+        """@brief Process a request frame. The caller is delayed by the time the PSU takes to receive the
+                  request, process it and send the response.
+           @param request The request frame (including the CRC).
+           @return The response frame or None if the PSU does not respond (E.G a CRC error or another unit number)."""
+        crc = int.from_bytes(request[-2:], byteorder='big')
+        if len(request) < 8 or not FramerRTU.check_CRC(request[:-2], crc) or request[0] != self._slave:
+            return None
+
+        function = request[1]
+        address = int.from_bytes(request[2:4], byteorder='big')
+        with self._lock:
+            if function == PSUSimulator.READ_REGISTERS:
+                count = int.from_bytes(request[4:6], byteorder='big')
+                if any(address + index not in self._registers for index in range(count)):
+                    response = bytes([self._slave, function | 0x80, PSUSimulator.ILLEGAL_ADDRESS])
+                else:
+                    values = b''.join(self._registers[address + index].to_bytes(2, byteorder='big') for index in range(count))
+                    response = bytes([self._slave, function, len(values)]) + values
+
+            elif function == PSUSimulator.WRITE_REGISTER:
+                self._registers[address] = int.from_bytes(request[4:6], byteorder='big')
+                self._updateOutput()
+                response = request[:6]
+
+            elif function == PSUSimulator.WRITE_REGISTERS:
+                count = int.from_bytes(request[4:6], byteorder='big')
+                for index in range(count):
+                    self._registers[address + index] = int.from_bytes(request[7 + index * 2:9 + index * 2], byteorder='big')
+                self._updateOutput()
+                response = request[:6]
+
+            else:
+                response = bytes([self._slave, function | 0x80, 0x01])
+
+        response = PSUSimulator._addCRC(response)
+        sleep(self._getTransferSeconds(len(request)) + self._processingSeconds + self._getTransferSeconds(len(response)))
+        return response
+
+    def processData(self, data):
+        """@brief Process the complete request frames in the data received.
+           @param data The bytes received.
+           @return A tuple containing
+                   0: The response bytes (empty if no responses).
+                   1: The bytes left after the complete requests."""
+        responses = b''
+        while True:
+            length = PSUSimulator.getRequestLength(data)
+            if length is None or len(data) < length:
+                break
+            response = self.processRequest(data[:length])
+            data = data[length:]
+            if response:
+                responses += response
+        return (responses, data)
+
+
+class _SimulatorRequestHandler(socketserver.BaseRequestHandler):
+    """@brief Responsible for processing the requests sent over a TCP connection to a SimulatorTcpServer."""
+
+    def handle(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        data = b''
+        while True:
+            try:
+                received = self.request.recv(256)
+            except OSError:
+                break
+            if not received:
+                break
+            response, data = self.server.simulator.processData(data + received)
+            if response:
+                self.request.sendall(response)
+
+
+class _SimulatorTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class SimulatorTcpServer(object):
+    """@brief Responsible for serving a simulated PSU over TCP in the same way as an Esp-Link WiFi serial
+              bridge (Modbus RTU frames sent over TCP)."""
+
+    def __init__(self, simulator, address='127.0.0.1', port=0):
+        """@brief Constructor
+           @param simulator The PSUSimulator instance.
+           @param address The address to bind to.
+           @param port The TCP port to bind to (0 = any free port)."""
+        self._server = _SimulatorTCPServer((address, port), _SimulatorRequestHandler)
+        self._server.simulator = simulator
+        self._thread = None
+
+    def start(self):
+        """@brief Start serving in a background thread."""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """@brief Stop serving."""
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def getPort(self):
+        """@return The (address, port) tuple used to connect to the simulated PSU."""
+        return self._server.server_address[:2]
+
+
+class SimulatorSerialPort(object):
+    """@brief Responsible for serving a simulated PSU on a pseudo terminal that may be opened as a serial
+              port. This is only available on platforms with pseudo terminals (E.G Linux and macOS)."""
+
+    @staticmethod
+    def isSupported():
+        """@return True if the platform supports pseudo terminals."""
+        return hasattr(os, "openpty")
+
+    def __init__(self, simulator):
+        """@brief Constructor
+           @param simulator The PSUSimulator instance."""
+        self._simulator = simulator
+        self._masterFd = None
+        self._slaveFd = None
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        """@brief Create the pseudo terminal and start serving in a background thread."""
+        import tty
+        self._masterFd, self._slaveFd = os.openpty()
+        tty.setraw(self._slaveFd)
+        self._running = True
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        """@brief Process the requests written to the serial port until stopped."""
+        data = b''
+        while self._running:
+            readable, _, _ = select.select([self._masterFd], [], [], 0.1)
+            if not readable:
+                continue
+            try:
+                received = os.read(self._masterFd, 256)
+            except OSError:
+                break
+            response, data = self._simulator.processData(data + received)
+            if response:
+                os.write(self._masterFd, response)
+
+    def stop(self):
+        """@brief Stop serving and close the pseudo terminal."""
+        self._running = False
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        os.close(self._masterFd)
+        os.close(self._slaveFd)
+
+    def getPort(self):
+        """@return The serial port device name used to connect to the simulated PSU."""
+        return os.ttyname(self._slaveFd)
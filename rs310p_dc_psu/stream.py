@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+import json
+import threading
+
+from time import perf_counter
+from collections import deque
+
+from rs310p_dc_psu.controller import ETMXXXXPError
+from rs310p_dc_psu.logfile import HEADER, COMMENT_PREFIX, formatLine
+
+
+class ReadingStream(object):
+    """@brief Responsible for streaming readings to a file (E.G stdout piped to another tool) in a
+              structured format. Readings are queued and written in batches by a background thread so
+              a slow consumer does not delay reading the PSU. When the queue is full the oldest
+              queued reading is dropped or the caller blocks until there is space."""
+
+    JSONL = "jsonl"
+    CSV = "csv"
+    FORMATS = (JSONL, CSV)
+    DROP = "drop"
+    BLOCK = "block"
+    POLICIES = (DROP, BLOCK)
+
+    def __init__(self, fd, streamFormat=JSONL, policy=DROP, queueSize=1000, batchSize=100, commentList=None):
+        """@brief Constructor
+           @param fd The file to write to.
+           @param streamFormat The format of each reading (jsonl or csv).
+           @param policy What happens when the queue is full. drop = drop the oldest queued reading,
+                         block = wait until the consumer has read enough data.
+           @param queueSize The maximum number of queued readings.
+           @param batchSize The maximum number of readings written at once.
+           @param commentList An optional list of comment lines (E.G KEY=VALUE metadata) written after the csv header."""
+        if streamFormat not in ReadingStream.FORMATS:
+            raise ETMXXXXPError(f"{streamFormat} is an invalid stream format (valid formats {', '.join(ReadingStream.FORMATS)}).")
+        if policy not in ReadingStream.POLICIES:
+            raise ETMXXXXPError(f"{policy} is an invalid stream policy (valid policies {', '.join(ReadingStream.POLICIES)}).")
+        if queueSize < 1:
+            raise ETMXXXXPError("The stream queue size must be greater than 0.")
+        self._fd = fd
+        self._streamFormat = streamFormat
+        self._policy = policy
+        self._queueSize = queueSize
+        self._batchSize = batchSize
+        self._commentList = commentList or []
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._running = True
+        self._broken = False
+        self._writtenCount = 0
+        self._writtenBytes = 0
+        self._droppedCount = 0
+        self._blockedCount = 0
+        self._blockedSeconds = 0.0
+        self._thread = threading.Thread(target=self._write, daemon=True)
+        self._thread.start()
+
+    def _formatReading(self, reading):
+        """@param reading A Reading instance.
+           @return The text written for the reading."""
+        if self._streamFormat == ReadingStream.JSONL:
+            return json.dumps({"time": reading.time.isoformat(),
+                               "volts": reading.volts,
+                               "amps": reading.amps,
+                               "watts": reading.watts}) + "\n"
+        return formatLine(reading)
+
+    def add(self, reading):
+        """@brief Queue a reading to be written.
+           @param reading A Reading instance."""
+        with self._condition:
+            if self._broken:
+                return
+            if len(self._queue) >= self._queueSize:
+                if self._policy == ReadingStream.DROP:
+                    self._queue.popleft()
+                    self._droppedCount += 1
+                else:
+                    self._blockedCount += 1
+                    startTime = perf_counter()
+                    while len(self._queue) >= self._queueSize and not self._broken:
+                        self._condition.wait()
+                    self._blockedSeconds += perf_counter() - startTime
+            self._queue.append(reading)
+            self._condition.notify_all()
+
+    def _write(self):
+        """@brief Write the queued readings. This runs in a background thread until the stream is closed."""
+        try:
+            if self._streamFormat == ReadingStream.CSV:
+                text = HEADER + "".join("{} {}\n".format(COMMENT_PREFIX, comment) for comment in self._commentList)
+                self._fd.write(text)
+                self._fd.flush()
+                self._writtenBytes += len(text)
+            while True:
+                with self._condition:
+                    while self._running and not self._queue:
+                        self._condition.wait()
+                    if not self._queue:
+                        break
+                    batchSize = min(len(self._queue), self._batchSize)
+                    batch = [self._queue.popleft() for _ in range(batchSize)]
+                    # Wake a caller blocked on a full queue
+                    self._condition.notify_all()
+                # Format and write outside the lock so readings can be queued while the consumer is slow
+                text = "".join(self._formatReading(reading) for reading in batch)
+                self._fd.write(text)
+                self._fd.flush()
+                self._writtenCount += len(batch)
+                self._writtenBytes += len(text)
+
+        except (BrokenPipeError, OSError, ValueError):
+            # The consumer has gone away
+            with self._condition:
+                self._broken = True
+                self._queue.clear()
+                self._condition.notify_all()
+
+    def isBroken(self):
+        """@return True if the stream can no longer be written (E.G the consumer has exited)."""
+        return self._broken
+
+    def close(self):
+        """@brief Write any queued readings and stop the background thread."""
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        self._thread.join()
+
+    def getStats(self):
+        """@return A dict of the stream counters."""
+        with self._condition:
+            return {"written": self._writtenCount,
+                    "bytes": self._writtenBytes,
+                    "dropped": self._droppedCount,
+                    "blocked": self._blockedCount,
+                    "blockedSeconds": self._blockedSeconds,
+                    "queued": len(self._queue)}
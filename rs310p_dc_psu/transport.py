@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+import socket
+import struct
+
+
+class TcpOptions(object):
+    """@brief Holds the socket options used when the PSU is connected over TCP (E.G through an Esp-Link
+              WiFi serial bridge). By default Nagle's algorithm is disabled so each request is sent as
+              soon as it is written and TCP keepalive probes detect a dead link (E.G the bridge losing
+              its WiFi connection) while the link is idle. A failed link raises an error on the next
+              request so that the connection manager reconnects."""
+
+    def __init__(self, noDelay=True, keepAlive=True, keepAliveIdle=5, keepAliveInterval=2, keepAliveCount=3):
+        """@brief Constructor
+           @param noDelay If True disable Nagle's algorithm (TCP_NODELAY).
+           @param keepAlive If True send TCP keepalive probes when the link is idle.
+           @param keepAliveIdle The idle time in seconds before the first keepalive probe is sent.
+           @param keepAliveInterval The time in seconds between keepalive probes.
+           @param keepAliveCount The number of unanswered keepalive probes after which the link is closed."""
+        self.noDelay = noDelay
+        self.keepAlive = keepAlive
+        self.keepAliveIdle = keepAliveIdle
+        self.keepAliveInterval = keepAliveInterval
+        self.keepAliveCount = keepAliveCount
+
+    def getDeadLinkSeconds(self):
+        """@return The time in seconds after which an idle dead link is detected or None if keepalive is disabled."""
+        if not self.keepAlive:
+            return None
+        return self.keepAliveIdle + self.keepAliveInterval * self.keepAliveCount
+
+    def apply(self, sock):
+        """@brief Set the options on a connected socket. Options not supported by the platform are not set.
+           @param sock The socket instance."""
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 if self.noDelay else 0)
+        if not self.keepAlive:
+            return
+
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        idle = max(1, int(self.keepAliveIdle))
+        interval = max(1, int(self.keepAliveInterval))
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle)
+        # macOS
+        elif hasattr(socket, "TCP_KEEPALIVE"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPALIVE, idle)
+        if hasattr(socket, "TCP_KEEPINTVL"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, interval)
+        if hasattr(socket, "TCP_KEEPCNT"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, max(1, int(self.keepAliveCount)))
+        # Windows sets the keepalive times in milliseconds in a single call.
+        if hasattr(socket, "SIO_KEEPALIVE_VALS"):
+            sock.ioctl(socket.SIO_KEEPALIVE_VALS, (1, idle * 1000, interval * 1000))
+        # Linux. Also close the link if a request is not acknowledged within the same time.
+        if hasattr(socket, "TCP_USER_TIMEOUT"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_USER_TIMEOUT, int(self.getDeadLinkSeconds() * 1000))
+
+    def __str__(self):
+        if self.keepAlive:
+            return f"nodelay={self.noDelay} keepalive={self.keepAliveIdle}/{self.keepAliveInterval}/{self.keepAliveCount}"
+        return f"nodelay={self.noDelay} keepalive=off"
+
+
+# The start of the Linux struct tcp_info. 8 byte fields followed by 24 32 bit fields.
+_TCP_INFO_FORMAT = "8B24I"
+
+
+def getTcpInfo(sock):
+    """@brief Get the link statistics held by the operating system for a TCP socket.
+       @param sock The socket instance.
+       @return A dict containing the following or None if not supported by the platform.
+               rttMS: The smoothed round trip time in milliseconds measured by TCP.
+               rttVariationMS: The round trip time variation in milliseconds.
+               retransmits: The total number of segments retransmitted.
+               lost: The number of segments currently considered lost.
+               unacked: The number of segments not yet acknowledged."""
+    if not hasattr(socket, "TCP_INFO"):
+        return None
+    try:
+        data = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, struct.calcsize(_TCP_INFO_FORMAT))
+    except OSError:
+        return None
+    if len(data) < struct.calcsize(_TCP_INFO_FORMAT):
+        return None
+    values = struct.unpack(_TCP_INFO_FORMAT, data[:struct.calcsize(_TCP_INFO_FORMAT)])
+    fields = values[8:]
+    return {"rttMS": fields[15] / 1000.0,
+            "rttVariationMS": fields[16] / 1000.0,
+            "retransmits": fields[23],
+            "lost": fields[6],
+            "unacked": fields[4]}
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+
+import os
+import logging
+import threading
+
+from queue import Queue
+
+from rs310p_dc_psu.controller import ETMXXXXPError
+from rs310p_dc_psu.logfile import TIME_FORMAT, writeLog
+from rs310p_dc_psu.samples import SampleStore
+
+
+class TriggerCondition(object):
+    """@brief Responsible for deciding if a reading meets a trigger condition.
+              A condition is defined by a string of the form <channel>:<type>:<level>
+              E.G amps:rising:1.5
+
+              channel  volts, amps or watts.
+              type     above    Trigger on any reading above the level.
+                       below    Trigger on any reading below the level.
+                       rising   Trigger when the reading rises through the level.
+                       falling  Trigger when the reading falls through the level.
+                       slope    Trigger when the rate of change (units/second) reaches the level.
+                                A negative level triggers on a falling slope.
+              level    The trigger level (a float value)."""
+
+    CHANNELS = ("volts", "amps", "watts")
+    ABOVE = "above"
+    BELOW = "below"
+    RISING = "rising"
+    FALLING = "falling"
+    SLOPE = "slope"
+    TYPES = (ABOVE, BELOW, RISING, FALLING, SLOPE)
+
+    @staticmethod
+    def parse(spec):
+        """@brief Create a TriggerCondition from a string.
+           @param spec The <channel>:<type>:<level> condition string.
+           @return A TriggerCondition instance."""
+        elems = spec.split(':')
+        if len(elems) != 3:
+            raise ETMXXXXPError(f"{spec} is an invalid trigger (format <channel>:<type>:<level>).")
+        channel = elems[0].strip().lower()
+        triggerType = elems[1].strip().lower()
+        try:
+            level = float(elems[2])
+        except ValueError:
+            raise ETMXXXXPError(f"{elems[2]} is an invalid trigger level.")
+        return TriggerCondition(channel, triggerType, level)
+
+    def __init__(self, channel, triggerType, level):
+        """@brief Constructor
+           @param channel The channel to check (volts, amps or watts).
+           @param triggerType The type of trigger (above, below, rising, falling or slope).
+           @param level The trigger level."""
+        if channel not in TriggerCondition.CHANNELS:
+            raise ETMXXXXPError(f"{channel} is an invalid trigger channel (valid channels {', '.join(TriggerCondition.CHANNELS)}).")
+        if triggerType not in TriggerCondition.TYPES:
+            raise ETMXXXXPError(f"{triggerType} is an invalid trigger type (valid types {', '.join(TriggerCondition.TYPES)}).")
+        self._channel = channel
+        self._triggerType = triggerType
+        self._level = level
+
+    def isTriggered(self, previous, reading):
+        """@brief Determine if a reading meets the trigger condition.
+           @param previous The previous Reading instance or None if this is the first reading.
+           @param reading The Reading instance to check.
+           @return True if triggered."""
+        value = getattr(reading, self._channel)
+        if self._triggerType == TriggerCondition.ABOVE:
+            return value > self._level
+
+        if self._triggerType == TriggerCondition.BELOW:
+            return value < self._level
+
+        # The remaining trigger types need a previous reading.
+        if previous is None:
+            return False
+
+        previousValue = getattr(previous, self._channel)
+        if self._triggerType == TriggerCondition.RISING:
+            return previousValue < self._level <= value
+
+        if self._triggerType == TriggerCondition.FALLING:
+            return previousValue > self._level >= value
+
+        seconds = (reading.time - previous.time).total_seconds()
+        if seconds <= 0:
+            return False
+        slope = (value - previousValue) / seconds
+        if self._level >= 0:
+            return slope >= self._level
+        return slope <= self._level
+
+    def __str__(self):
+        return f"{self._channel}:{self._triggerType}:{self._level}"
+
+
+class TriggerCapture(object):
+    """@brief Responsible for holding readings in a pre trigger ring buffer and saving the readings
+              around a trigger event to a capture file. Only the pre and post trigger windows are
+              written to disk. The readings are held in SampleStore instances. Capture files are
+              written by a background thread so that writing a file does not delay sampling."""
+
+    def __init__(self, conditionList, preSamples, postSamples, filePrefix):
+        """@brief Constructor
+           @param conditionList A list of TriggerCondition instances. Any one of these triggers a capture.
+           @param preSamples The number of readings to save before the trigger reading.
+           @param postSamples The number of readings to save after the trigger reading.
+           @param filePrefix The start of each capture filename."""
+        if preSamples < 0 or postSamples < 0:
+            raise ETMXXXXPError("The pre and post trigger sample counts must be 0 or greater.")
+        self._conditionList = conditionList
+        self._preSamples = preSamples
+        self._postSamples = postSamples
+        self._filePrefix = filePrefix
+        self._preBuffer = SampleStore()
+        self._previous = None
+        # Holds the readings of a capture while the post trigger readings are collected.
+        self._captureSamples = None
+        self._postRemaining = 0
+        self._triggerCondition = None
+        self._triggerReading = None
+        self._captureCount = 0
+        self._writeQueue = Queue()
+        self._writeThread = threading.Thread(target=self._writeCaptures, daemon=True)
+        self._writeThread.start()
+
+    def _getTriggerCondition(self, reading):
+        """@brief Get the first condition that the reading triggers.
+           @param reading The Reading instance to check.
+           @return The TriggerCondition instance or None if not triggered."""
+        for condition in self._conditionList:
+            if condition.isTriggered(self._previous, reading):
+                return condition
+        return None
+
+    def addReading(self, reading):
+        """@brief Add a reading. This must be called for every reading read from the PSU.
+           @param reading The Reading instance.
+           @return The name of the capture file (written in the background) if the reading completed a capture, else None."""
+        filename = None
+        if self._captureSamples is not None:
+            self._captureSamples.appendReading(reading)
+            self._postRemaining -= 1
+            if self._postRemaining <= 0:
+                filename = self._save()
+
+        else:
+            condition = self._getTriggerCondition(reading)
+            if condition:
+                self._captureSamples = self._preBuffer.copy()
+                self._captureSamples.appendReading(reading)
+                self._triggerCondition = condition
+                self._triggerReading = reading
+                self._postRemaining = self._postSamples
+                if self._postRemaining <= 0:
+                    filename = self._save()
+
+        self._preBuffer.appendReading(reading)
+        if len(self._preBuffer) > self._preSamples:
+            self._preBuffer.discard(len(self._preBuffer) - self._preSamples)
+        self._previous = reading
+        return filename
+
+    def flush(self):
+        """@brief Save a capture that is waiting for post trigger readings.
+           @return The name of the capture file or None if no capture was in progress."""
+        filename = None
+        if self._captureSamples is not None:
+            filename = self._save()
+        return filename
+
+    def close(self):
+        """@brief Wait for the capture files to be written and stop the background thread. Call flush() first
+                  to save a capture that is waiting for post trigger readings."""
+        if self._writeThread:
+            self._writeQueue.put(None)
+            self._writeThread.join()
+            self._writeThread = None
+
+    def _writeCaptures(self):
+        """@brief Write the captures in the queue. This runs in a background thread until None is received."""
+        while True:
+            capture = self._writeQueue.get()
+            if capture is None:
+                break
+            filename, captureSamples, commentList = capture
+            try:
+                writeLog(filename, captureSamples, commentList=commentList)
+            except OSError as ex:
+                logging.getLogger(__name__).warning(f"Failed to write {filename}: {ex}")
+
+    def _save(self):
+        """@brief Queue the current capture to be written to a file and re arm the trigger.
+           @return The name of the capture file."""
+        # Don't overwrite the captures from a previous run.
+        while True:
+            self._captureCount += 1
+            filename = f"{self._filePrefix}_capture_{self._captureCount:04d}.log"
+            if not os.path.exists(filename):
+                break
+        commentList = [f"TRIGGER={self._triggerCondition}",
+                       f"TRIGGER_TIME={self._triggerReading.time.strftime(TIME_FORMAT)}"]
+        self._writeQueue.put((filename, self._captureSamples, commentList))
+        self._captureSamples = None
+        self._triggerCondition = None
+        self._triggerReading = None
+        return filename
@@ -1,15 +1,24 @@
 from nicegui import ui
 import plotly.graph_objects as go
 
+import os
 import datetime
+import tempfile
 import threading
 
-from time import sleep
+from time import sleep, perf_counter
 from queue import Queue
 
-import serial.tools.list_ports
-
-from rs310p_dc_psu.controller import ETMXXXXP
+from rs310p_dc_psu.connection import ManagedETMXXXXP
+from rs310p_dc_psu.logfile import Reading, PORT_KEY, MODEL_ID_KEY, POLL_PERIOD_KEY
+from rs310p_dc_psu.watchdog import Watchdog
+from rs310p_dc_psu.instrumentation import Instrumentation, timed_section
+from rs310p_dc_psu.metrics import DeviceMetrics, MetricsRegistry, MetricsServer
+from rs310p_dc_psu.discovery import getCandidatePorts, discoverPSUs
+from rs310p_dc_psu.replay import LogReplayer
+from rs310p_dc_psu.samples import SampleStore, toSeconds
+from rs310p_dc_psu.profiler import SamplingProfiler
+from rs310p_dc_psu.stream import ReadingStream
 
 
 class Executioner(object):
@@ -64,11 +73,35 @@ class PSUGUI(Executioner):
     OFF_MESSAGE = "PSU Turned Off"
 
     PSU_STATS = "PSU_STATS"
+    REPLAY_STATS = "REPLAY_STATS"
     PSU_SETTINGS = "PSU_SETTINGS"
 
-    def __init__(self, width, address='127.0.0.1', debug=False, reload=False, server_port=9091):
-        """@brief Constructor"""
+    # When replaying a log, replay waits while more than this number of messages are waiting to be processed.
+    MAX_REPLAY_QUEUE_SIZE = 100
+
+    # The maximum number of readings waiting to be written to the log file when recording.
+    # If the disk is slower than this the oldest waiting reading is dropped so reading the PSU is not delayed.
+    MAX_RECORD_QUEUE_SIZE = 1000
+
+    # The time between samples of the thread stacks when profiling the GUI.
+    PROFILE_SAMPLE_SECONDS = 0.005
+    DEFAULT_PROFILE_SECONDS = 10
+
+    # The colours of the volts, amps and watts traces (the plotly defaults) and of the min/max band around them.
+    TRACE_COLOURS = ('#636efa', '#ef553b', '#00cc96')
+    ENVELOPE_COLOURS = ('rgba(99,110,250,0.3)', 'rgba(239,85,59,0.3)', 'rgba(0,204,150,0.3)')
+
+    def __init__(self, width, address='127.0.0.1', debug=False, reload=False, server_port=9091, watchdog_rules=None, metrics_port=0, log_file=None,
+                 connection_args=None, probe_ports=False):
+        """@brief Constructor
+           @param watchdog_rules An optional list of WatchdogRule instances checked on every PSU reading.
+           @param metrics_port If greater than 0 the PSU readings are served in the Prometheus text format on this TCP port.
+           @param log_file The default file to which the PSU readings are recorded.
+           @param connection_args An optional dict of ManagedETMXXXXP constructor arguments (E.G the response timeouts and TcpOptions).
+           @param probe_ports If True the serial ports are probed for PSUs (by sending Modbus requests) so that the ports
+                              connected to a PSU are at the start of the serial port list."""
         super().__init__()
+        self._probe_ports = probe_ports
         self._debug = debug
         self._reload = reload
 
@@ -77,27 +110,68 @@ class PSUGUI(Executioner):
         self._plot_width = width - PSUGUI.COL0_WIDTH_PX
         self._address = address
 
-        self._time_data = []
-        self._voltage_data = []
-        self._current_data = []
-        self._power_data = []
+        # The plotted samples
+        self._samples = SampleStore()
 
         self._psuIF = None
         self._psu_access_lock = threading.Lock()
         self._connected = False
         self._selected_serial_port_select = None
+        self._watchdog_rules = watchdog_rules
+        self._watchdog = None
+        # Holds PSU bus and GUI timing statistics when enabled in the diagnostics panel.
+        self._instrumentation = None
+        # Samples the stacks of all threads when profiling is enabled in the diagnostics panel.
+        self._profiler = None
+        self._profile_lines = []
+        self._metrics_port = metrics_port
+        self._metrics_registry = None
+        self._device_metrics = None
+        # Optional (min SampleStore, max SampleStore) shown as a band around each plotted trace (E.G rollup buckets).
+        self._envelope = None
+        self._replayer = None
+        self._replay_speed = 1.0
+        self._log_file = log_file
+        self._connection_args = connection_args or {}
+        # Writes the PSU readings to the log file in a background thread when recording.
+        self._reading_stream = None
+        self._record_fd = None
+        self._record_filename = None
+        self._record_rate_written = 0
+        self._record_rate_time = None
+        # The port and model ID of the connected PSU saved in the log file metadata.
+        self._psu_port = None
+        self._psu_model_id = None
+        # The ComparedLog instances when comparing logs.
+        self._compared_log_list = None
+        self._compare_absolute_time = False
+        self._compare_column = SampleStore.WATTS
 
     def _get_serial_port_list(self):
-        """@return A list of available serial ports."""
-        connect_serial_port_list = []
-        serial_port_list = serial.tools.list_ports.comports(include_links=False)
-        for p in serial_port_list:
-            if not p.hwid == 'n/a':
-                connect_serial_port_list.append(p.device)
-        return connect_serial_port_list
+        """@return A list of available serial ports. If probing is enabled the ports connected to a PSU are at the start of the list."""
+        connect_serial_port_list = [port_info.device for port_info in getCandidatePorts()]
+        if not self._probe_ports:
+            return connect_serial_port_list
+        psu_port_list = [psu.port for psu in discoverPSUs()]
+        return psu_port_list + [port for port in connect_serial_port_list if port not in psu_port_list]
+
+    @staticmethod
+    def _get_time_ms(column):
+        """@param column A column of times in seconds (E.G from SampleStore.getColumn()).
+           @return A list of the times in milliseconds. The sample times are local times in seconds and plotly
+                   shows milliseconds values on a date axis without a time zone conversion."""
+        return [seconds * 1000.0 for seconds in column]
 
     def _create_plot(self):
-        """@brief Create the plot instance."""
+        """@brief Create the plot. The figure is returned as a dict (see https://plotly.com/javascript/) rather
+                  than a plotly Figure as a Figure validates (and copies) every value of every trace each time
+                  the plot is updated. The dict is passed to the browser as it is.
+           @return A dict holding the plot data and layout."""
+        x_axis_title = 'Time'
+        x_axis_type = 'date'
+        if self._compared_log_list and not self._compare_absolute_time:
+            x_axis_title = 'Seconds'
+            x_axis_type = 'linear'
         layout = go.Layout(title=None,
                            showlegend=True,
                            width=self._plot_width,
@@ -105,7 +179,8 @@ class PSUGUI(Executioner):
                            plot_bgcolor="darkslategrey",       # Background for the plot area
                            paper_bgcolor="darkslategrey",      # Background for the entire figure
                            font=dict(color="yellow"),   # Font color for labels and title
-                           xaxis=dict(title='Time',
+                           xaxis=dict(title=x_axis_title,
+                                      type=x_axis_type,
                                       color="yellow",
                                       gridcolor="gray",
                                       zerolinecolor="gray"),
@@ -113,18 +188,56 @@ class PSUGUI(Executioner):
                                       color="yellow",
                                       gridcolor="gray",
                                       zerolinecolor="gray"))
-        fig = go.Figure(layout=layout)
+        fig = dict(data=[], layout=layout.to_plotly_json())
+
+        if self._compared_log_list:
+            self._add_compare_traces(fig)
+            return fig
+
+        # The columns are copied to lists once as the JSON serialiser does not accept typed arrays.
+        time_data = PSUGUI._get_time_ms(self._samples.getColumn(SampleStore.TIME))
+        voltage_trace = dict(type='scatter', x=time_data, y=self._samples.getColumn(SampleStore.VOLTS).tolist(), mode='lines+markers', name='Volts')
+        current_trace = dict(type='scatter', x=time_data, y=self._samples.getColumn(SampleStore.AMPS).tolist(), mode='lines+markers', name='Amps')
+        power_trace = dict(type='scatter', x=time_data, y=self._samples.getColumn(SampleStore.WATTS).tolist(), mode='lines+markers', name='Watts')
 
-        voltage_trace = go.Scatter(x=self._time_data, y=self._voltage_data, mode='lines+markers', name='Volts')
-        current_trace = go.Scatter(x=self._time_data, y=self._current_data, mode='lines+markers', name='Amps')
-        power_trace = go.Scatter(x=self._time_data, y=self._power_data, mode='lines+markers', name='Watts')
+        fig['data'] += [voltage_trace, current_trace, power_trace]
 
-        fig.add_trace(voltage_trace)
-        fig.add_trace(current_trace)
-        fig.add_trace(power_trace)
+        if self._envelope:
+            self._add_envelope_traces(fig)
 
         return fig
 
+    def _add_envelope_traces(self, fig):
+        """@brief Add a band between the min and max values around the volts, amps and watts traces.
+           @param fig The plot dict."""
+        min_samples, max_samples = self._envelope
+        time_data = PSUGUI._get_time_ms(min_samples.getColumn(SampleStore.TIME))
+        for trace_index, (column, name) in enumerate(((SampleStore.VOLTS, 'Volts'), (SampleStore.AMPS, 'Amps'), (SampleStore.WATTS, 'Watts'))):
+            colour = PSUGUI.TRACE_COLOURS[trace_index]
+            fig['data'][trace_index].update(line=dict(color=colour), legendgroup=name)
+            fig['data'].append(dict(type='scatter', x=time_data, y=min_samples.getColumn(column).tolist(), mode='lines', line=dict(width=0),
+                                    legendgroup=name, showlegend=False, hoverinfo='skip'))
+            fig['data'].append(dict(type='scatter', x=time_data, y=max_samples.getColumn(column).tolist(), mode='lines', line=dict(width=0),
+                                    fill='tonexty', fillcolor=PSUGUI.ENVELOPE_COLOURS[trace_index], name=f'{name} min/max',
+                                    legendgroup=name, hoverinfo='skip'))
+
+    def _add_compare_traces(self, fig):
+        """@brief Add a trace of the selected channel of each compared log to the plot.
+           @param fig The plot dict."""
+        for compared_log in self._compared_log_list:
+            # Two points (min and max) per bucket, about one bucket per pixel
+            times, values = compared_log.getTrace(self._compare_column, self._plot_width * 2)
+            if self._compare_absolute_time:
+                times = PSUGUI._get_time_ms(times)
+            line = dict(shape='hv' if compared_log.stepHeld else 'linear')
+            fig['data'].append(dict(type='scatter', x=times, y=values, mode='lines', name=compared_log.getName(), line=line))
+
+    def _set_compare_column(self, column):
+        """@brief Set the channel plotted when comparing logs.
+           @param column The column name (SampleStore.VOLTS, AMPS or WATTS)."""
+        self._compare_column = column
+        self._update_plot()
+
     def _is_host_and_tcpip_port(self, port_list):
         """@brief Determine if the port list holds an address and TCPIP port.
            @param port_list Normally a serial port list but maybe a host address and TCPIP port.
@@ -202,18 +315,217 @@ class PSUGUI(Executioner):
                     self._plot_history_number = ui.number(label="Plot History (Points)",
                                                           min=10, max=10000, value=1000).style(PSUGUI.COL0_WIDTH)
 
+                    self._record_file_input = ui.input(label="Log File", value=self._log_file).style(PSUGUI.COL0_WIDTH)
+                    self._record_switch = ui.switch("Record", on_change=lambda e: self._enable_recording(e.value))
+                    self._record_status_label = ui.label("").style(f'{PSUGUI.COL0_WIDTH} white-space: pre; font-size: small;')
+
+            elif self._replayer:
+                with ui.column():
+                    self._replay_button = ui.button("Pause",
+                                                    on_click=lambda: self._toggle_replay()).style(PSUGUI.COL0_WIDTH)
+                    self._replay_speed_number = ui.number(label="Replay Speed (0 = Max)",
+                                                          min=0,
+                                                          value=self._replay_speed,
+                                                          on_change=lambda e: self._set_replay_speed(e.value)).style(PSUGUI.COL0_WIDTH)
+                    ui.label("Position")
+                    self._replay_slider = ui.slider(min=0, max=100, step=0.1, value=0).style(PSUGUI.COL0_WIDTH)
+                    self._replay_slider.on('change', lambda e: self._seek_replay(self._replay_slider.value))
+                    self._replay_position_label = ui.label("")
+
+                    self._clear_plot_button = ui.button("Clear Plot",
+                                                        on_click=lambda: self._clear_plot()).style(PSUGUI.COL0_WIDTH)
+
+                    self._plot_history_number = ui.number(label="Plot History (Points)",
+                                                          min=10, max=10000, value=1000).style(PSUGUI.COL0_WIDTH)
+
+            elif self._compared_log_list:
+                with ui.column():
+                    self._compare_column_select = ui.select({SampleStore.VOLTS: "Volts",
+                                                             SampleStore.AMPS: "Amps",
+                                                             SampleStore.WATTS: "Watts"},
+                                                            label="Channel",
+                                                            value=self._compare_column,
+                                                            on_change=lambda e: self._set_compare_column(e.value)).style(PSUGUI.COL0_WIDTH)
+
             with ui.column():
                 self._plot = ui.plotly(self._create_plot())
                 self._plot.update()
 
+                if self._compared_log_list:
+                    self._add_compare_table()
+
+                with ui.expansion("Diagnostics").style(f'width: {self._plot_width}px;'):
+                    ui.switch("Instrumentation", on_change=lambda e: self._enable_instrumentation(e.value))
+                    with ui.row():
+                        self._profile_switch = ui.switch("Profile", on_change=lambda e: self._enable_profiling(e.value))
+                        self._profile_seconds_number = ui.number(label="Profile Window (Seconds)",
+                                                                 min=1,
+                                                                 max=600,
+                                                                 value=PSUGUI.DEFAULT_PROFILE_SECONDS).style(PSUGUI.COL0_WIDTH)
+                    self._diagnostics_label = ui.label("").style('white-space: pre; font-family: monospace; font-size: small;')
+
         ui.timer(interval=0.1, callback=self._read_response)
+        ui.timer(interval=1.0, callback=self._update_diagnostics)
+        if available_serial_port_list is not None:
+            ui.timer(interval=1.0, callback=self._update_record_status)
+        if self._replayer:
+            ui.timer(interval=0.5, callback=self._update_replay_position)
+
+    def _enable_instrumentation(self, enabled):
+        """@brief Enable/disable the recording of PSU bus and GUI timing statistics.
+           @param enabled If True record statistics."""
+        if enabled:
+            self._instrumentation = Instrumentation()
+        else:
+            self._instrumentation = None
+        psuIF = self._psuIF
+        if psuIF:
+            if self._instrumentation:
+                psuIF.enableInstrumentation(self._instrumentation)
+            else:
+                psuIF.disableInstrumentation()
+        self._update_diagnostics()
+
+    def _update_diagnostics(self):
+        """@brief Update the text in the diagnostics panel."""
+        lines = []
+        psuIF = self._psuIF
+        if psuIF:
+            stats = psuIF.getConnectionStats()
+            lines.append("requests {} timeouts {} crc errors {} connection errors {} retries {} reconnects {} failures {}".format(
+                stats['requests'], stats['timeouts'], stats['crcErrors'], stats['connectionErrors'], stats['retries'], stats['reconnects'], stats['failures']))
+            link_stats = psuIF.getLinkStats()
+            if link_stats:
+                lines.append("tcp round trip {:.1f} ms (variation {:.1f} ms) retransmits {} unacked {}".format(
+                    link_stats['rttMS'], link_stats['rttVariationMS'], link_stats['retransmits'], link_stats['unacked']))
+        instrumentation = self._instrumentation
+        if instrumentation:
+            lines = lines + instrumentation.getLines()
+        elif lines:
+            lines.append("Enable instrumentation to show PSU bus and GUI timing statistics.")
+
+        profiler = self._profiler
+        if profiler and not profiler.isRunning():
+            self._finish_profiling()
+        elif profiler:
+            lines.append(f"Profiling ({profiler.getSampleCount()} samples)...")
+        lines = lines + self._profile_lines
+        self._diagnostics_label.set_text("\n".join(lines))
+
+    def _enable_profiling(self, enabled):
+        """@brief Start/stop profiling the GUI. The stacks of all threads (including the PSU read thread)
+                  are sampled until the profile window has elapsed or profiling is stopped.
+           @param enabled If True start profiling."""
+        if enabled:
+            if self._profiler is None:
+                profile_seconds = self._profile_seconds_number.value or PSUGUI.DEFAULT_PROFILE_SECONDS
+                self._profile_lines = []
+                self._profiler = SamplingProfiler(interval=PSUGUI.PROFILE_SAMPLE_SECONDS, duration=profile_seconds)
+                self._profiler.start()
+        elif self._profiler:
+            self._finish_profiling()
+        self._update_diagnostics()
+
+    def _finish_profiling(self):
+        """@brief Stop profiling, save the profile and show the functions found in the most samples."""
+        profiler = self._profiler
+        self._profiler = None
+        profiler.stop()
+        filename = os.path.join(tempfile.gettempdir(), datetime.datetime.now().strftime("psu_gui_profile_%Y%m%d_%H%M%S.txt"))
+        profiler.save(filename)
+        self._profile_lines = [f"Saved the profile of {profiler.getSampleCount()} samples to {filename}"] + profiler.getLines()
+        # Calls _enable_profiling(False) which has nothing left to do
+        self._profile_switch.set_value(False)
+
+    def _enable_recording(self, enabled):
+        """@brief Start/stop recording the PSU readings to the log file in the same format as the --poll command line option.
+           @param enabled If True start recording."""
+        if enabled:
+            if self._reading_stream is None:
+                filename = self._record_file_input.value
+                if not filename:
+                    ui.notify("No log file set.", type='negative')
+                    self._record_switch.set_value(False)
+                    return
+                try:
+                    self._record_fd = open(filename, 'a')
+                except OSError as ex:
+                    ui.notify(f"Failed to open {filename}: {ex}", type='negative')
+                    self._record_switch.set_value(False)
+                    return
+                self._record_filename = filename
+                self._record_rate_written = 0
+                self._record_rate_time = perf_counter()
+                self._reading_stream = ReadingStream(self._record_fd,
+                                                     streamFormat=ReadingStream.CSV,
+                                                     policy=ReadingStream.DROP,
+                                                     queueSize=PSUGUI.MAX_RECORD_QUEUE_SIZE,
+                                                     commentList=self._get_record_metadata())
+                self._record_file_input.set_enabled(False)
+                ui.notify(f"Recording to {filename}")
+
+        elif self._reading_stream:
+            reading_stream = self._reading_stream
+            self._reading_stream = None
+            # Writing the readings still queued may take a while (E.G a slow disk) so it is not done on the GUI event loop.
+            self._call_method(self._close_recording, (reading_stream, self._record_fd, self._record_filename))
+            self._record_fd = None
+            self._record_file_input.set_enabled(True)
+        self._update_record_status()
+
+    def _get_record_metadata(self):
+        """@return A list of the KEY=VALUE comment lines saved after the log file header in the same way as the --poll command line option."""
+        comment_list = []
+        if self._psu_port is not None:
+            port = self._psu_port
+            if isinstance(port, tuple):
+                port = f"{port[0]}:{port[1]}"
+            comment_list.append(f"{PORT_KEY}={port}")
+        if self._psu_model_id is not None:
+            comment_list.append(f"{MODEL_ID_KEY}={self._psu_model_id}")
+        comment_list.append(f"{POLL_PERIOD_KEY}={self._get_read_interval_ms() / 1000}")
+        return comment_list
+
+    def _close_recording(self, reading_stream, record_fd, filename):
+        """@brief Write the readings still queued and close the log file. Called in a separate thread.
+           @param reading_stream The ReadingStream instance.
+           @param record_fd The log file.
+           @param filename The log file name."""
+        try:
+            try:
+                reading_stream.close()
+            finally:
+                record_fd.close()
+            stats = reading_stream.getStats()
+            self._send(PSUGUI.INFO_MESSAGE, f"Saved {stats['written']} readings to {filename}")
+
+        except Exception as ex:
+            self._send(PSUGUI.ERROR_MESSAGE, f"Failed to close {filename}: {ex}")
+
+    def _update_record_status(self):
+        """@brief Show the recording rate, bytes written and the number of readings dropped."""
+        reading_stream = self._reading_stream
+        if reading_stream is None:
+            self._record_status_label.set_text("")
+            return
+
+        stats = reading_stream.getStats()
+        now = perf_counter()
+        rate = 0.0
+        if now > self._record_rate_time:
+            rate = (stats['written'] - self._record_rate_written) / (now - self._record_rate_time)
+        self._record_rate_written = stats['written']
+        self._record_rate_time = now
+        lines = [f"{stats['written']} readings {rate:.1f}/s",
+                 f"{stats['bytes']} bytes written",
+                 f"{stats['dropped']} dropped"]
+        if reading_stream.isBroken():
+            lines.append("Failed to write the log file")
+        self._record_status_label.set_text("\n".join(lines))
 
     def _clear_plot(self):
         """@brief Clear the plot."""
-        self._time_data.clear()
-        self._voltage_data.clear()
-        self._current_data.clear()
-        self._power_data.clear()
+        self._samples.clear()
 
         # If not connected then the plot is not being updated so we have to update it here
         if not self._connected:
@@ -221,22 +533,18 @@ class PSUGUI(Executioner):
             self._plot.figure = self._create_plot()
             self._plot.update()  # Ensure the display is refreshed
 
+    @timed_section("_plot_stats")
     def _plot_stats(self, stats):
         """@brief Plot the stats from the PSU
-           @param stats A tuple (volts, amps, watts)"""
+           @param stats A tuple (volts, amps, watts, time)"""
 
-        self._time_data.append(datetime.datetime.now())
-        self._voltage_data.append(stats[0])
-        self._current_data.append(stats[1])
-        self._power_data.append(stats[2])
+        self._samples.append(toSeconds(stats[3]), stats[0], stats[1], stats[2])
         max_plot_points = self._plot_history_number.value
-        if self._time_data and max_plot_points:
+        if max_plot_points:
             # Ensure the number of points is limited
-            while len(self._time_data) > max_plot_points:
-                del self._time_data[0]
-                del self._voltage_data[0]
-                del self._current_data[0]
-                del self._power_data[0]
+            excess_points = len(self._samples) - int(max_plot_points)
+            if excess_points > 0:
+                self._samples.discard(excess_points)
 
         # Update the plot and refresh it
         self._plot.figure = self._create_plot()
@@ -263,6 +571,7 @@ class PSUGUI(Executioner):
 
         self._connected = connected
 
+    @timed_section("_read_response")
     def _read_response(self):
         """@brief Read responses from methods executed in separate threads."""
         while True:
@@ -288,6 +597,12 @@ class PSUGUI(Executioner):
                     elif msg_type == PSUGUI.PSU_STATS:
                         self._plot_stats(msg)
 
+                    elif msg_type == PSUGUI.REPLAY_STATS:
+                        seek_count, stats = msg
+                        # Drop the readings replayed before the replay position was moved
+                        if seek_count == self._replayer.getSeekCount():
+                            self._plot_stats(stats)
+
                     elif msg_type == PSUGUI.PSU_SETTINGS:
                         voltage = msg[0]
                         current_limit = msg[1]
@@ -323,17 +638,29 @@ class PSUGUI(Executioner):
 
         if connect_to is None:
             raise Exception("No serial port selected.")
+        self._psu_port = connect_to
 
-        self._psuIF = ETMXXXXP(connect_to)
+        self._psuIF = ManagedETMXXXXP(connect_to, **self._connection_args)
         connected = self._psuIF.connect()
 
         if not connected:
             raise Exception(f"Failed to connect to {connect_to}")
 
+        if self._watchdog_rules:
+            self._watchdog = Watchdog(self._psuIF, self._watchdog_rules)
+
+        if self._instrumentation:
+            self._psuIF.enableInstrumentation(self._instrumentation)
+
+        if self._metrics_registry:
+            self._device_metrics = DeviceMetrics(str(connect_to), self._psuIF.getConnectionStats)
+            self._metrics_registry.add(self._device_metrics)
+
         self._send(PSUGUI.INFO_MESSAGE, f"Opened {self._selected_serial_port_select.value}")
         self._send(PSUGUI.INFO_MESSAGE, "Checking for PSU response...")
         target_volts = self._psuIF.getTargetVolts()
         current_limit = self._psuIF.getCurrentLimit()
+        self._psu_model_id = self._psuIF.getModel()
         self._send(PSUGUI.PSU_SETTINGS, (target_volts, current_limit))
         self._start_read_stats_thread()
         self._send(PSUGUI.INFO_MESSAGE, PSUGUI.CONNECTED_MESSAGE)
@@ -343,20 +670,59 @@ class PSUGUI(Executioner):
         threading.Thread(target=self._read_stats).start()
 
     def _read_stats(self):
-        """@brief Read stats from PSU at intervals"""
+        """@brief Read stats from PSU at intervals. The connection manager retries failed reads and
+                  reconnects to the PSU so a failed read does not stop reading."""
         self._send(PSUGUI.INFO_MESSAGE, "Started reading PSU stats")
-        try:
-            while self._psuIF:
-                volts, amps, watts = self._psuIF.getOutputStats()
-                self._send(PSUGUI.PSU_STATS, (volts, amps, watts))
+        reconnects = 0
+        while self._psuIF:
+            psuIF = self._psuIF
+            device_metrics = self._device_metrics
+            try:
+                volts, amps, watts = psuIF.getOutputStats()
+                if self._watchdog:
+                    trip = self._watchdog.check(Reading(None, volts, amps, watts), perf_counter())
+                    if trip:
+                        self._send(PSUGUI.WARNING_MESSAGE, str(trip))
+                now = datetime.datetime.now()
+                self._send(PSUGUI.PSU_STATS, (volts, amps, watts, now))
+                reading_stream = self._reading_stream
+                if reading_stream:
+                    # Queued for the writer thread so that a slow disk does not delay reading the PSU
+                    reading_stream.add(Reading(now, volts, amps, watts))
+                if device_metrics:
+                    output = None
+                    protection = None
+                    if device_metrics.isStateReadDue():
+                        try:
+                            output, protection = psuIF.getOutputAndProtectionState()
+                        except Exception as ex:
+                            device_metrics.recordError()
+                            self._send(PSUGUI.WARNING_MESSAGE, f"Failed to read the PSU output state: {ex}")
+                    device_metrics.update(volts, amps, watts, output=output, protection=protection)
+
+            except Exception as ex:
+                if device_metrics:
+                    device_metrics.recordError()
+                # Don't report errors caused by disconnecting
                 if self._psuIF:
-                    ms_sleep = self._read_interval_number.value
-                    if ms_sleep is None or ms_sleep < 10:
-                        ms_sleep = 10
-                    sleep(ms_sleep/1000)
+                    self._send(PSUGUI.WARNING_MESSAGE, f"Failed to read PSU stats: {ex}")
+
+            stats = psuIF.getConnectionStats()
+            if stats['reconnects'] != reconnects:
+                reconnects = stats['reconnects']
+                self._send(PSUGUI.INFO_MESSAGE, f"Reconnected to PSU ({reconnects} reconnects)")
+
+            if self._psuIF:
+                sleep(self._get_read_interval_ms()/1000)
+
+        self._send(PSUGUI.INFO_MESSAGE, "Stopped reading PSU stats")
 
-        except Exception:
-            self._send(PSUGUI.INFO_MESSAGE, "Stopped reading PSU stats")
+    def _get_read_interval_ms(self):
+        """@return The time in milliseconds between PSU reads."""
+        ms_sleep = self._read_interval_number.value
+        if ms_sleep is None or ms_sleep < 10:
+            ms_sleep = 10
+        return ms_sleep
 
     @exception_handler_decorator
     def _disconnect(self):
@@ -365,12 +731,18 @@ class PSUGUI(Executioner):
             self._psuIF.disconnect()
         finally:
             self._psuIF = None
+            if self._device_metrics:
+                self._metrics_registry.remove(self._device_metrics)
+                self._device_metrics = None
         self._send(PSUGUI.INFO_MESSAGE, PSUGUI.DISCONNECTED_MESSAGE)
 
     @exception_handler_decorator
     def _on(self):
         """@brief Turn the PSU on."""
         self._psuIF.setOutput(True)
+        # Re arm the watchdog now the output is back on
+        if self._watchdog:
+            self._watchdog.reset()
         self._send(PSUGUI.INFO_MESSAGE, PSUGUI.ON_MESSAGE)
 
     @exception_handler_decorator
@@ -417,6 +789,12 @@ class PSUGUI(Executioner):
 
         self._update_gui_log_level()
 
+        if self._metrics_port > 0:
+            self._metrics_registry = MetricsRegistry()
+            metrics_server = MetricsServer(self._metrics_registry, self._address, self._metrics_port)
+            metrics_server.start()
+            print(f"Serving PSU metrics at {metrics_server.getURL()}")
+
         self._init_gui(available_serial_port_list)
         print("Close this to shutdown GUI server.")
 
@@ -427,11 +805,15 @@ class PSUGUI(Executioner):
                uvicorn_logging_level=self._guiLogLevel,
                reload=self._reload)
 
-    def plot_data(self, reading_list):
-        """@brief Create a GUI plot of the data from a log file.."""
+    def plot_data(self, samples, envelope=None):
+        """@brief Create a GUI plot of the data from a log file..
+           @param samples A SampleStore instance.
+           @param envelope An optional tuple of SampleStore instances holding the minimum and maximum values at
+                           each sample time (E.G rollup buckets). These are shown as a band around each trace."""
         self._update_gui_log_level()
 
-        self._reading_list = reading_list
+        self._samples = samples
+        self._envelope = envelope
 
         self._init_gui(None)
 
@@ -446,19 +828,113 @@ class PSUGUI(Executioner):
                uvicorn_logging_level=self._guiLogLevel,
                reload=self._reload)
 
-    def _update_plot(self):
-        """@brief Update plot from the reading list."""
-        self._time_data = []
-        self._voltage_data = []
-        self._current_data = []
-        self._power_data = []
-
-        for reading in self._reading_list:
-            self._time_data.append(reading.time)
-            self._voltage_data.append(reading.volts)
-            self._current_data.append(reading.amps)
-            self._power_data.append(reading.watts)
+    def replay(self, samples, speed=1.0):
+        """@brief Replay the readings from a log file through the same path as readings from the PSU.
+           @param samples A SampleStore instance.
+           @param speed The replay speed (E.G 1 = as recorded, 10 = ten times faster, 0 = as fast as possible)."""
+        self._update_gui_log_level()
+
+        self._replay_speed = speed
+        self._replayer = LogReplayer(samples, self._replay_reading, speed=speed)
+
+        self._init_gui(None)
+
+        self._replayer.start()
+
+        print("Close this to shutdown GUI server.")
 
+        ui.run(host=self._address,
+               port=self._port,
+               title="PSU GUI",
+               dark=True,
+               uvicorn_logging_level=self._guiLogLevel,
+               reload=self._reload)
+
+    def compare(self, compared_log_list, absolute_time=False):
+        """@brief Plot the readings from several log files over each other.
+           @param compared_log_list A list of ComparedLog instances.
+           @param absolute_time If True the readings are plotted at the time they were recorded rather than
+                                from the time each log is aligned to."""
+        self._update_gui_log_level()
+
+        self._compared_log_list = compared_log_list
+        self._compare_absolute_time = absolute_time
+
+        self._init_gui(None)
+
+        print("Close this to shutdown GUI server.")
+
+        ui.run(host=self._address,
+               port=self._port,
+               title="PSU GUI",
+               dark=True,
+               uvicorn_logging_level=self._guiLogLevel,
+               reload=self._reload)
+
+    def _add_compare_table(self):
+        """@brief Add a table of the summary values of each compared log."""
+        columns = [{'name': 'log', 'label': 'Log', 'field': 'log', 'align': 'left'},
+                   {'name': 'readings', 'label': 'Readings', 'field': 'readings'},
+                   {'name': 'duration', 'label': 'Duration (s)', 'field': 'duration'},
+                   {'name': 'energy', 'label': 'Energy (Wh)', 'field': 'energy'},
+                   {'name': 'mean_watts', 'label': 'Mean (W)', 'field': 'mean_watts'},
+                   {'name': 'peak_amps', 'label': 'Peak (A)', 'field': 'peak_amps'},
+                   {'name': 'peak_watts', 'label': 'Peak (W)', 'field': 'peak_watts'},
+                   {'name': 'aligned', 'label': 'Aligned', 'field': 'aligned'}]
+        rows = []
+        for index, compared_log in enumerate(self._compared_log_list):
+            rows.append({'id': index,
+                         'log': compared_log.getName(),
+                         'readings': len(compared_log.samples),
+                         'duration': f"{compared_log.getDuration():.1f}",
+                         'energy': f"{compared_log.getEnergyWh():.4f}",
+                         'mean_watts': f"{compared_log.getMeanWatts():.3f}",
+                         'peak_amps': f"{compared_log.getPeakAmps() or 0.0:.3f}",
+                         'peak_watts': f"{compared_log.getPeakWatts() or 0.0:.3f}",
+                         'aligned': "Yes" if compared_log.aligned else "Trigger not found"})
+        ui.table(columns=columns, rows=rows, row_key='id').style(f'width: {self._plot_width}px;')
+
+    def _replay_reading(self, reading, seek_count):
+        """@brief Called from the replay thread with each reading replayed.
+           @param reading A Reading instance.
+           @param seek_count The number of times the replay position had been moved when the reading was replayed."""
+        # Don't let the replay get ahead of the GUI when replaying as fast as possible
+        while self._from_thread_queue.qsize() > PSUGUI.MAX_REPLAY_QUEUE_SIZE:
+            sleep(0.01)
+        self._send(PSUGUI.REPLAY_STATS, (seek_count, (reading.volts, reading.amps, reading.watts, reading.time)))
+
+    def _toggle_replay(self):
+        """@brief Pause or resume the replay."""
+        if self._replayer.isPaused():
+            self._replayer.play()
+        else:
+            self._replayer.pause()
+        self._update_replay_position()
+
+    def _set_replay_speed(self, speed):
+        """@brief Set the replay speed.
+           @param speed The replay speed (0 = as fast as possible)."""
+        if speed is not None and speed >= 0:
+            self._replayer.setSpeed(speed)
+
+    def _seek_replay(self, percentage):
+        """@brief Move the replay position. The plot is cleared and the readings replayed before the move that
+                  are still waiting to be plotted are dropped.
+           @param percentage The position as a percentage of the log duration."""
+        self._replayer.seek(percentage / 100.0)
+        self._clear_plot()
+
+    def _update_replay_position(self):
+        """@brief Show the replay position."""
+        index, offset = self._replayer.getPosition()
+        duration = self._replayer.getDuration()
+        self._replay_button.set_text("Play" if self._replayer.isPaused() else "Pause")
+        self._replay_position_label.set_text(f"{offset:.1f}/{duration:.1f} s ({index}/{self._replayer.getReadingCount()})")
+        if duration > 0:
+            self._replay_slider.set_value(offset * 100.0 / duration)
+
+    def _update_plot(self):
+        """@brief Update plot from the samples."""
         # Update the plot and refresh it
         self._plot.figure = self._create_plot()
         self._plot.update()  # Ensure the display is refreshed
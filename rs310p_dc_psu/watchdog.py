@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+
+from abc import ABC, abstractmethod
+from time import perf_counter
+
+from rs310p_dc_psu.controller import ETMXXXXPError
+
+
+class WatchdogRule(ABC):
+    """@brief The base class for rules checked by the Watchdog on every reading read from the PSU.
+              A rule is defined by a string of the form <channel>:<type>:<values>
+
+              channel  volts, amps or watts.
+              type     above:<level>[:<ms>]        Trip if the reading is above the level for more than ms milliseconds (default=0).
+                       below:<level>[:<ms>]        Trip if the reading is below the level for more than ms milliseconds (default=0).
+                       rate:<level>                Trip if the rate of change (units/second) is greater than the level.
+                       band:<low>:<high>[:<ms>]    Trip if the reading is outside the low - high band for more than ms milliseconds (default=0)."""
+
+    CHANNELS = ("volts", "amps", "watts")
+    ABOVE = "above"
+    BELOW = "below"
+    RATE = "rate"
+    BAND = "band"
+    TYPES = (ABOVE, BELOW, RATE, BAND)
+
+    @staticmethod
+    def parse(spec):
+        """@brief Create a WatchdogRule from a string.
+           @param spec The <channel>:<type>:<values> rule string.
+           @return A WatchdogRule instance."""
+        elems = [elem.strip().lower() for elem in spec.split(':')]
+        if len(elems) < 3:
+            raise ETMXXXXPError(f"{spec} is an invalid watchdog rule (format <channel>:<type>:<values>).")
+        channel = elems[0]
+        ruleType = elems[1]
+        try:
+            values = [float(elem) for elem in elems[2:]]
+        except ValueError:
+            raise ETMXXXXPError(f"{spec} is an invalid watchdog rule (the values must be numbers).")
+
+        if ruleType in (WatchdogRule.ABOVE, WatchdogRule.BELOW) and len(values) in (1, 2):
+            return LimitRule(channel, ruleType, *values)
+
+        if ruleType == WatchdogRule.RATE and len(values) == 1:
+            return RateRule(channel, *values)
+
+        if ruleType == WatchdogRule.BAND and len(values) in (2, 3):
+            return BandRule(channel, *values)
+
+        raise ETMXXXXPError(f"{spec} is an invalid watchdog rule.")
+
+    def __init__(self, channel):
+        """@brief Constructor
+           @param channel The channel to check (volts, amps or watts)."""
+        if channel not in WatchdogRule.CHANNELS:
+            raise ETMXXXXPError(f"{channel} is an invalid watchdog channel (valid channels {', '.join(WatchdogRule.CHANNELS)}).")
+        self._channel = channel
+
+    def reset(self):
+        """@brief Reset any state held by the rule."""
+        pass
+
+    @abstractmethod
+    def check(self, reading, sampleTime):
+        """@brief Check a reading against the rule.
+           @param reading The Reading instance.
+           @param sampleTime The time the reading was received (perf_counter() seconds).
+           @return A message describing the violation or None if the reading does not break the rule."""
+
+
+class _DurationRule(WatchdogRule):
+    """@brief A rule that trips when a condition is held for more than a period of time."""
+
+    def __init__(self, channel, ms):
+        """@brief Constructor
+           @param channel The channel to check (volts, amps or watts).
+           @param ms The number of milliseconds the condition must be held for before the rule trips."""
+        super().__init__(channel)
+        if ms < 0:
+            raise ETMXXXXPError("The watchdog rule time must be 0 or greater.")
+        self._seconds = ms / 1000.0
+        self._startTime = None
+
+    def reset(self):
+        """@brief Reset any state held by the rule."""
+        self._startTime = None
+
+    @abstractmethod
+    def _isViolated(self, value):
+        """@param value The channel value.
+           @return True if the value violates the rule."""
+
+    @abstractmethod
+    def _describe(self, value):
+        """@param value The channel value.
+           @return A description of the violation."""
+
+    def check(self, reading, sampleTime):
+        """@brief Check a reading against the rule.
+           @param reading The Reading instance.
+           @param sampleTime The time the reading was received (perf_counter() seconds).
+           @return A message describing the violation or None if the reading does not break the rule."""
+        value = getattr(reading, self._channel)
+        if not self._isViolated(value):
+            self._startTime = None
+            return None
+
+        if self._startTime is None:
+            self._startTime = sampleTime
+        if sampleTime - self._startTime >= self._seconds:
+            return self._describe(value)
+        return None
+
+
+class LimitRule(_DurationRule):
+    """@brief Trips if a channel is above (or below) a level for more than a period of time."""
+
+    def __init__(self, channel, ruleType, level, ms=0):
+        """@brief Constructor
+           @param channel The channel to check (volts, amps or watts).
+           @param ruleType Either WatchdogRule.ABOVE or WatchdogRule.BELOW.
+           @param level The limit.
+           @param ms The number of milliseconds the limit must be exceeded for before the rule trips."""
+        super().__init__(channel, ms)
+        self._ruleType = ruleType
+        self._level = level
+
+    def _isViolated(self, value):
+        if self._ruleType == WatchdogRule.ABOVE:
+            return value > self._level
+        return value < self._level
+
+    def _describe(self, value):
+        return f"{self._channel} {self._ruleType} {self._level} for {self._seconds*1000:.0f} ms ({self._channel}={value})"
+
+    def __str__(self):
+        return f"{self._channel}:{self._ruleType}:{self._level}:{self._seconds*1000:.0f}"
+
+
+class BandRule(_DurationRule):
+    """@brief Trips if a channel is outside a band for more than a period of time."""
+
+    def __init__(self, channel, low, high, ms=0):
+        """@brief Constructor
+           @param channel The channel to check (volts, amps or watts).
+           @param low The bottom of the band.
+           @param high The top of the band.
+           @param ms The number of milliseconds the channel must be out of the band for before the rule trips."""
+        super().__init__(channel, ms)
+        if low > high:
+            raise ETMXXXXPError(f"The watchdog band low value ({low}) is greater than the high value ({high}).")
+        self._low = low
+        self._high = high
+
+    def _isViolated(self, value):
+        return value < self._low or value > self._high
+
+    def _describe(self, value):
+        return f"{self._channel} outside {self._low} - {self._high} for {self._seconds*1000:.0f} ms ({self._channel}={value})"
+
+    def __str__(self):
+        return f"{self._channel}:{WatchdogRule.BAND}:{self._low}:{self._high}:{self._seconds*1000:.0f}"
+
+
+class RateRule(WatchdogRule):
+    """@brief Trips if the rate of change of a channel is greater than a level."""
+
+    def __init__(self, channel, level):
+        """@brief Constructor
+           @param channel The channel to check (volts, amps or watts).
+           @param level The maximum rate of change in units/second (E.G dV/dt). Rising and falling rates are checked."""
+        super().__init__(channel)
+        self._level = abs(level)
+        self._previousValue = None
+        self._previousTime = None
+
+    def reset(self):
+        """@brief Reset any state held by the rule."""
+        self._previousValue = None
+        self._previousTime = None
+
+    def check(self, reading, sampleTime):
+        """@brief Check a reading against the rule.
+           @param reading The Reading instance.
+           @param sampleTime The time the reading was received (perf_counter() seconds).
+           @return A message describing the violation or None if the reading does not break the rule."""
+        value = getattr(reading, self._channel)
+        message = None
+        if self._previousTime is not None and sampleTime > self._previousTime:
+            rate = (value - self._previousValue) / (sampleTime - self._previousTime)
+            if abs(rate) > self._level:
+                message = f"{self._channel} rate {rate:.3f}/s exceeds {self._level}/s"
+        self._previousValue = value
+        self._previousTime = sampleTime
+        return message
+
+    def __str__(self):
+        return f"{self._channel}:{WatchdogRule.RATE}:{self._level}"
+
+
+class WatchdogTrip(object):
+    """@brief Holds the details of a watchdog trip."""
+
+    def __init__(self, rule, message, reading, latencyMS):
+        """@brief Constructor
+           @param rule The WatchdogRule that tripped.
+           @param message A description of the violation.
+           @param reading The Reading that broke the rule.
+           @param latencyMS The time from receiving the reading to the PSU output being turned off in milliseconds."""
+        self.rule = rule
+        self.message = message
+        self.reading = reading
+        self.latencyMS = latencyMS
+
+    def __str__(self):
+        return f"Watchdog tripped: {self.message}. Output turned off in {self.latencyMS:.1f} ms."
+
+
+class Watchdog(object):
+    """@brief Responsible for checking every reading read from the PSU against a list of rules and
+              turning the PSU output off as soon as any rule is broken. The output off command is
+              sent ahead of any other PSU access that is waiting.
+
+              Once tripped the watchdog does not check readings until it is reset (E.G when the
+              output is turned back on). If the output off command fails the watchdog is not tripped
+              and the command is sent again when the next reading is checked until it succeeds."""
+
+    def __init__(self, psuIF, ruleList):
+        """@brief Constructor
+           @param psuIF The ETMXXXXP instance connected to the PSU.
+           @param ruleList A list of WatchdogRule instances."""
+        self._psuIF = psuIF
+        self._ruleList = ruleList
+        self._tripped = False
+        # The (rule, message, reading, sampleTime) of a trip whose output off command failed.
+        self._pendingTrip = None
+        self._tripList = []
+
+    def getRules(self):
+        """@return The list of WatchdogRule instances."""
+        return self._ruleList
+
+    def getTrips(self):
+        """@return A list of WatchdogTrip instances, one for each time the watchdog has tripped."""
+        return self._tripList
+
+    def isTripped(self):
+        """@return True if the watchdog has tripped and has not been reset."""
+        return self._tripped
+
+    def reset(self):
+        """@brief Re arm the watchdog."""
+        for rule in self._ruleList:
+            rule.reset()
+        self._tripped = False
+        self._pendingTrip = None
+
+    def check(self, reading, sampleTime=None):
+        """@brief Check a reading against the rules. This should be called as soon as each reading is received.
+           @param reading The Reading instance.
+           @param sampleTime The time the reading was received (perf_counter() seconds). If None the current time is used.
+           @return A WatchdogTrip instance if the watchdog tripped, else None. An exception is raised if the
+                   output off command fails (it is sent again on the next call)."""
+        if self._tripped:
+            return None
+
+        if sampleTime is None:
+            sampleTime = perf_counter()
+
+        if self._pendingTrip:
+            # The output off command failed. Keep sending it whatever the latest reading is.
+            return self._trip(*self._pendingTrip)
+
+        for rule in self._ruleList:
+            message = rule.check(reading, sampleTime)
+            if message:
+                self._pendingTrip = (rule, message, reading, sampleTime)
+                return self._trip(rule, message, reading, sampleTime)
+        return None
+
+    def _trip(self, rule, message, reading, sampleTime):
+        """@brief Turn the PSU output off and record the trip.
+           @param rule The WatchdogRule that tripped.
+           @param message A description of the violation.
+           @param reading The Reading that broke the rule.
+           @param sampleTime The time the reading was received (perf_counter() seconds).
+           @return A WatchdogTrip instance. An exception is raised if the output off command fails."""
+        self._psuIF.setOutput(False, urgent=True)
+        # Only tripped once the output is off so that a failed command is sent again.
+        self._tripped = True
+        self._pendingTrip = None
+        latencyMS = (perf_counter() - sampleTime) * 1000.0
+        trip = WatchdogTrip(rule, message, reading, latencyMS)
+        self._tripList.append(trip)
+        return trip
@@ -0,0 +1,108 @@
+import pytest
+
+from rs310p_dc_psu import connection
+from rs310p_dc_psu.connection import ManagedETMXXXXP
+from rs310p_dc_psu.controller import ETMXXXXPError
+from rs310p_dc_psu.simulator import PSUSimulator, SimulatorTcpServer
+
+
+class FlakyPSUSimulator(PSUSimulator):
+    """@brief A simulated PSU that can be told to ignore requests or drop the connection."""
+
+    def __init__(self):
+        super().__init__(baudRate=0, processingSeconds=0)
+        self.ignoreCount = 0
+        self.disconnectCount = 0
+
+    def processRequest(self, request):
+        if self.disconnectCount > 0:
+            self.disconnectCount -= 1
+            # Ends the request handler which closes the connection
+            raise ConnectionResetError("Simulated link failure")
+        if self.ignoreCount > 0:
+            self.ignoreCount -= 1
+            return None
+        return super().processRequest(request)
+
+
+@pytest.fixture
+def simulator():
+    return FlakyPSUSimulator()
+
+
+@pytest.fixture
+def server(simulator):
+    server = SimulatorTcpServer(simulator)
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def psu(server):
+    psu = ManagedETMXXXXP(server.getPort(), readRetries=2, minTimeout=0.05, maxTimeout=0.2, reconnectSeconds=5.0)
+    assert psu.connect()
+    yield psu
+    psu.disconnect()
+
+
+def test_requests_update_rtt_and_timeout(psu):
+    assert psu.getModel() == PSUSimulator.MODEL_ID
+    psu.setVoltage(5.0)
+    stats = psu.getConnectionStats()
+    assert stats["requests"] == 2
+    assert stats["retries"] == 0
+    assert stats["smoothedRTT"] is not None
+    assert 0.05 <= stats["responseTimeout"] <= 0.2
+
+
+def test_failed_read_is_retried(psu, simulator):
+    simulator.ignoreCount = 2
+    assert psu.getModel() == PSUSimulator.MODEL_ID
+    stats = psu.getConnectionStats()
+    assert stats["timeouts"] == 2
+    assert stats["retries"] == 2
+    assert stats["failures"] == 0
+
+
+def test_read_fails_when_retries_used(psu, simulator):
+    simulator.ignoreCount = 3
+    with pytest.raises(ETMXXXXPError):
+        psu.getModel()
+    stats = psu.getConnectionStats()
+    assert stats["retries"] == 2
+    assert stats["failures"] == 1
+    # The link is reconnected before the next request
+    assert psu.getModel() == PSUSimulator.MODEL_ID
+    assert psu.getConnectionStats()["reconnects"] == 1
+
+
+def test_write_is_not_retried(psu, simulator):
+    simulator.ignoreCount = 1
+    with pytest.raises(ETMXXXXPError):
+        psu.setVoltage(5.0)
+    stats = psu.getConnectionStats()
+    assert stats["retries"] == 0
+    assert stats["failures"] == 1
+
+
+def test_reconnect_after_connection_dropped(psu, simulator):
+    assert psu.getModel() == PSUSimulator.MODEL_ID
+    simulator.disconnectCount = 1
+    assert psu.getModel() == PSUSimulator.MODEL_ID
+    stats = psu.getConnectionStats()
+    assert stats["connectionErrors"] == 1
+    assert stats["reconnects"] == 1
+
+
+def test_reconnect_backs_off_until_time_limit(psu, simulator, server, monkeypatch):
+    sleepList = []
+    monkeypatch.setattr(connection, "sleep", sleepList.append)
+    assert psu.getModel() == PSUSimulator.MODEL_ID
+    # No connections are accepted after the current connection is dropped
+    server.stop()
+    simulator.disconnectCount = 1
+    with pytest.raises(ETMXXXXPError):
+        psu.getModel()
+    assert sleepList == [0.5, 1.0, 2.0, 4.0]
+    assert psu.getConnectionStats()["reconnects"] == 0
@@ -0,0 +1,99 @@
+import pytest
+
+from datetime import datetime, timedelta
+
+from rs310p_dc_psu import deadband
+from rs310p_dc_psu.controller import ETMXXXXPError
+from rs310p_dc_psu.deadband import Deadband, DeadbandFilter
+from rs310p_dc_psu.logfile import Reading, writeLog
+from rs310p_dc_psu.samples import SampleStore, loadSamples
+
+START_TIME = datetime(2026, 1, 1, 12, 0, 0)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """@brief Replace the monotonic clock used by the filter with one the test sets."""
+    now = [0.0]
+    monkeypatch.setattr(deadband, "monotonic", lambda: now[0])
+    return now
+
+
+def _reading(seconds, volts=5.0, amps=1.0):
+    return Reading(START_TIME + timedelta(seconds=seconds), volts, amps, volts * amps)
+
+
+def test_parse_deadband():
+    band = Deadband.parse("amps:1%")
+    assert (band.channel, band.band, band.relative) == ("amps", 1.0, True)
+    assert str(Deadband.parse("volts:0.02")) == "volts:0.02"
+    for spec in ("volts", "ohms:1", "volts:x", "volts:-1"):
+        with pytest.raises(ETMXXXXPError):
+            Deadband.parse(spec)
+
+
+def test_readings_inside_band_are_skipped(clock):
+    deadbandFilter = DeadbandFilter([Deadband.parse("volts:0.1"), Deadband.parse("amps:10%"), Deadband.parse("watts:20%")], heartbeatSeconds=0)
+    first = _reading(0)
+    assert deadbandFilter.filter(first) == [first]
+    assert deadbandFilter.filter(_reading(1, volts=5.05)) == []
+    assert deadbandFilter.filter(_reading(2, amps=1.05)) == []
+    # The last skipped reading is recorded before the change so the held value ends at the right time
+    skipped = _reading(3, volts=5.08, amps=1.08)
+    assert deadbandFilter.filter(skipped) == []
+    change = _reading(4, amps=1.2)
+    assert deadbandFilter.filter(change) == [skipped, change]
+    # The band is relative to the last recorded reading
+    last = _reading(5, amps=1.3)
+    assert deadbandFilter.filter(last) == []
+    assert deadbandFilter.flush() == [last]
+
+
+def test_channel_without_deadband_is_recorded_on_any_change(clock):
+    deadbandFilter = DeadbandFilter([Deadband.parse("volts:1"), Deadband.parse("watts:100%")], heartbeatSeconds=0)
+    deadbandFilter.filter(_reading(0))
+    assert deadbandFilter.filter(_reading(1, volts=5.5)) == []
+    change = _reading(2, volts=5.5, amps=1.001)
+    assert len(deadbandFilter.filter(change)) == 2
+
+
+def test_heartbeat_records_unchanged_reading(clock):
+    deadbandFilter = DeadbandFilter([Deadband.parse("volts:1")], heartbeatSeconds=60.0)
+    deadbandFilter.filter(_reading(0))
+    clock[0] = 59.0
+    assert deadbandFilter.filter(_reading(59)) == []
+    clock[0] = 60.0
+    heartbeat = _reading(60)
+    assert deadbandFilter.filter(heartbeat)[-1] is heartbeat
+    # The heartbeat period restarts from the last recorded reading
+    clock[0] = 119.0
+    assert deadbandFilter.filter(_reading(119)) == []
+    clock[0] = 120.0
+    assert len(deadbandFilter.filter(_reading(120))) == 2
+
+
+def test_flush_returns_last_skipped_reading(clock):
+    deadbandFilter = DeadbandFilter([Deadband.parse("volts:1")], heartbeatSeconds=0)
+    deadbandFilter.filter(_reading(0))
+    last = _reading(10)
+    deadbandFilter.filter(last)
+    assert deadbandFilter.flush() == [last]
+    assert deadbandFilter.flush() == []
+
+
+def test_metadata_lists_every_channel():
+    deadbandFilter = DeadbandFilter([Deadband.parse("amps:2%")], heartbeatSeconds=30.0)
+    assert deadbandFilter.getMetadata() == ["DEADBAND=amps:2.0%,volts:0.0,watts:0.0", "HEARTBEAT=30.0"]
+
+
+def test_deadband_log_values_are_held(tmp_path):
+    filename = str(tmp_path / "psu.log")
+    deadbandFilter = DeadbandFilter([Deadband.parse("volts:0.5")], heartbeatSeconds=0)
+    writeLog(filename, [_reading(0, volts=5.0), _reading(10, volts=8.0)], commentList=deadbandFilter.getMetadata())
+    sampleStore = loadSamples(filename)
+    # A step is added so the first value is held until the second reading
+    assert list(sampleStore.getColumn(SampleStore.VOLTS)) == [5.0, 5.0, 8.0]
+    times = list(sampleStore.getColumn(SampleStore.TIME))
+    assert times[1] == times[2]
+    # Only the recorded readings are loaded when the values are not held
+    assert len(loadSamples(filename, holdValues=False)) == 2
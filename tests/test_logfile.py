@@ -0,0 +1,105 @@
+import gzip
+
+from datetime import datetime, timedelta
+
+from rs310p_dc_psu import logfile
+from rs310p_dc_psu.logfile import Reading, RotatingLogWriter, getSegmentList, readMetadata, readReadings, getTimeRange
+
+START_TIME = datetime(2026, 1, 1, 12, 0, 0)
+
+
+def _reading(index):
+    return Reading(START_TIME + timedelta(seconds=index), 5.0, index / 10.0, index / 2.0)
+
+
+def _writeReadings(writer, count):
+    for index in range(count):
+        writer.write(_reading(index))
+
+
+def test_rotate_by_size_into_compressed_segments(tmp_path):
+    filename = str(tmp_path / "psu.log")
+    writer = RotatingLogWriter(filename, maxBytes=200, commentList=["PSU=test"])
+    _writeReadings(writer, 20)
+    writer.close()
+    segmentList = getSegmentList(filename)
+    assert len(segmentList) > 2
+    assert segmentList[-1] == filename
+    for segment in segmentList[:-1]:
+        assert segment.endswith(logfile.COMPRESSED_EXTENSION)
+        with gzip.open(segment, 'rt') as fd:
+            assert fd.readline() == logfile.HEADER
+    # The readings are read back in order across the segments
+    readingList = list(readReadings(filename))
+    assert [reading.time for reading in readingList] == [_reading(index).time for index in range(20)]
+    assert readMetadata(filename) == {"PSU": "test"}
+    assert getTimeRange(filename) == (START_TIME, _reading(19).time)
+
+
+def test_rotate_by_time(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(logfile, "time", lambda: now[0])
+    filename = str(tmp_path / "psu.log")
+    writer = RotatingLogWriter(filename, maxSeconds=60, compress=False)
+    writer.write(_reading(0))
+    now[0] += 30
+    writer.write(_reading(1))
+    now[0] += 30
+    writer.write(_reading(2))
+    writer.close()
+    assert getSegmentList(filename) == [filename + ".0001", filename]
+    assert len(list(readReadings(filename))) == 3
+
+
+def test_retain_removes_oldest_segments(tmp_path):
+    filename = str(tmp_path / "psu.log")
+    writer = RotatingLogWriter(filename, maxBytes=100, retainCount=2)
+    _writeReadings(writer, 20)
+    writer.close()
+    segmentList = getSegmentList(filename)
+    assert len(segmentList) == 3
+    # Only the latest readings are kept
+    readingList = list(readReadings(filename))
+    assert readingList[-1].time == _reading(19).time
+    assert len(readingList) < 20
+
+
+def test_segments_continue_numbering_and_are_compressed_after_restart(tmp_path):
+    filename = str(tmp_path / "psu.log")
+    writer = RotatingLogWriter(filename, maxBytes=100, compress=False)
+    _writeReadings(writer, 5)
+    writer.close()
+    segmentCount = len(getSegmentList(filename)) - 1
+    assert segmentCount > 0
+    writer = RotatingLogWriter(filename, maxBytes=100)
+    writer.close()
+    segmentList = getSegmentList(filename)
+    assert len(segmentList) == segmentCount + 1
+    for segment in segmentList[:-1]:
+        assert segment.endswith(logfile.COMPRESSED_EXTENSION)
+    assert len(list(readReadings(filename))) == 5
+
+
+def test_failed_compression_keeps_segment(tmp_path, monkeypatch):
+    gzipOpen = gzip.open
+    failList = [True]
+
+    def failingOpen(filename, mode):
+        if failList:
+            failList.pop()
+            # Leaves a partial temporary file, as a full disk does
+            gzipOpen(filename, mode).close()
+            raise OSError("No space left on device")
+        return gzipOpen(filename, mode)
+
+    monkeypatch.setattr(logfile.gzip, "open", failingOpen)
+    filename = str(tmp_path / "psu.log")
+    writer = RotatingLogWriter(filename, maxBytes=100)
+    _writeReadings(writer, 10)
+    writer.close()
+    segmentList = getSegmentList(filename)
+    # The first segment is left uncompressed and later segments are still compressed
+    assert segmentList[0] == filename + ".0001"
+    assert segmentList[1].endswith(logfile.COMPRESSED_EXTENSION)
+    assert not any(path.name.endswith(".tmp") for path in tmp_path.iterdir())
+    assert len(list(readReadings(filename))) == 10
@@ -0,0 +1,126 @@
+import io
+import pytest
+
+from datetime import datetime, timedelta
+
+from rs310p_dc_psu.controller import ETMXXXXPError
+from rs310p_dc_psu.deadband import Deadband, DeadbandFilter
+from rs310p_dc_psu.logfile import TIME_FORMAT, Reading, writeLog
+from rs310p_dc_psu.merge import NEAREST, LINEAR, HOLD, mergeLogs, getDeviceNames
+
+START_TIME = datetime(2026, 1, 1, 12, 0, 0)
+
+
+def _createLog(filename, pointList, commentList=None):
+    """@brief Create a log.
+       @param filename The log file name.
+       @param pointList A list of (seconds from START_TIME, amps) tuples. The volts are always 5."""
+    readingList = [Reading(START_TIME + timedelta(seconds=seconds), 5.0, amps, 5.0 * amps) for seconds, amps in pointList]
+    writeLog(str(filename), readingList, commentList=commentList)
+    return str(filename)
+
+
+def _merge(filenameList, **kwargs):
+    """@return A tuple containing
+               0: The stats returned by mergeLogs().
+               1: A list of the rows written, each a list of the column values."""
+    fd = io.StringIO()
+    stats = mergeLogs(filenameList, fd, **kwargs)
+    lineList = fd.getvalue().splitlines()
+    return (stats, [line.split(',') for line in lineList[1:]])
+
+
+def _getColumn(rowList, index):
+    """@return The values in a column of the rows (None if empty)."""
+    return [float(row[index]) if row[index] else None for row in rowList]
+
+
+def _getSeconds(rowList):
+    """@return The time of each row in seconds from START_TIME."""
+    return [(datetime.strptime(row[0], TIME_FORMAT) - START_TIME).total_seconds() for row in rowList]
+
+
+def test_header_and_total_power(tmp_path):
+    coreLog = _createLog(tmp_path / "core.log", [(0, 1.0), (2, 1.0)])
+    ioLog = _createLog(tmp_path / "io.log", [(0, 0.5), (2, 0.5)])
+    fd = io.StringIO()
+    stats = mergeLogs([coreLog, ioLog], fd)
+    lineList = fd.getvalue().splitlines()
+    assert lineList[0] == "TIME,core_VOLTS,core_AMPS,core_WATTS,io_VOLTS,io_AMPS,io_WATTS,TOTAL_WATTS"
+    assert stats == {"rows": 3, "readings": [2, 2]}
+    rowList = [line.split(',') for line in lineList[1:]]
+    assert _getColumn(rowList, 7) == [7.5, 7.5, 7.5]
+
+
+def test_resample_modes(tmp_path):
+    filename = _createLog(tmp_path / "psu.log", [(0, 0.0), (4, 4.0)])
+    _, rowList = _merge([filename], mode=LINEAR)
+    assert _getColumn(rowList, 2) == [0.0, 1.0, 2.0, 3.0, 4.0]
+    _, rowList = _merge([filename], mode=NEAREST)
+    assert _getColumn(rowList, 2) == [0.0, 0.0, 0.0, 4.0, 4.0]
+    _, rowList = _merge([filename], mode=HOLD)
+    assert _getColumn(rowList, 2) == [0.0, 0.0, 0.0, 0.0, 4.0]
+
+
+def test_readings_between_grid_points(tmp_path):
+    filename = _createLog(tmp_path / "psu.log", [(0.4, 1.0), (1.4, 2.0), (2.4, 3.0)])
+    _, rowList = _merge([filename], mode=LINEAR)
+    assert _getSeconds(rowList) == [1.0, 2.0]
+    assert _getColumn(rowList, 2) == pytest.approx([1.6, 2.6])
+
+
+def test_max_gap_leaves_values_empty(tmp_path):
+    gapLog = _createLog(tmp_path / "gap.log", [(0, 1.0), (1, 1.0), (5, 1.0), (6, 1.0)])
+    otherLog = _createLog(tmp_path / "other.log", [(seconds, 2.0) for seconds in range(7)])
+    _, rowList = _merge([gapLog, otherLog], maxGap=2.0)
+    assert _getColumn(rowList, 2) == [1.0, 1.0, None, None, None, 1.0, 1.0]
+    # The total power is only written when every log has a value
+    assert _getColumn(rowList, 7) == [15.0, 15.0, None, None, None, 15.0, 15.0]
+    _, rowList = _merge([gapLog, otherLog])
+    assert _getColumn(rowList, 2) == [1.0] * 7
+
+
+def test_deadband_log_values_are_held(tmp_path):
+    deadbandFilter = DeadbandFilter([Deadband.parse("amps:0.1")])
+    heldLog = _createLog(tmp_path / "held.log", [(0, 1.0), (10, 3.0)], commentList=deadbandFilter.getMetadata())
+    _, rowList = _merge([heldLog], mode=LINEAR, maxGap=2.0)
+    assert _getColumn(rowList, 2) == [1.0] * 10 + [3.0]
+
+
+def test_rows_without_values_are_skipped(tmp_path):
+    firstLog = _createLog(tmp_path / "first.log", [(0, 1.0), (1, 1.0)])
+    secondLog = _createLog(tmp_path / "second.log", [(100000, 2.0), (100001, 2.0)])
+    stats, rowList = _merge([firstLog, secondLog])
+    assert stats["rows"] == 4
+    assert _getSeconds(rowList) == [0.0, 1.0, 100000.0, 100001.0]
+    # Long gaps in a single log are skipped
+    gapLog = _createLog(tmp_path / "gap.log", [(0, 1.0), (1, 1.0), (100000, 1.0), (100001, 1.0)])
+    _, rowList = _merge([gapLog], maxGap=10.0)
+    assert _getSeconds(rowList) == [0.0, 1.0, 100000.0, 100001.0]
+
+
+def test_overlap_only(tmp_path):
+    firstLog = _createLog(tmp_path / "first.log", [(seconds, 1.0) for seconds in range(0, 6)])
+    secondLog = _createLog(tmp_path / "second.log", [(seconds, 2.0) for seconds in range(3, 10)])
+    _, rowList = _merge([firstLog, secondLog], overlapOnly=True)
+    assert _getSeconds(rowList) == [3.0, 4.0, 5.0]
+    assert _getColumn(rowList, 7) == [15.0, 15.0, 15.0]
+    # Logs that do not overlap
+    thirdLog = _createLog(tmp_path / "third.log", [(20, 1.0), (21, 1.0)])
+    stats, rowList = _merge([firstLog, thirdLog], overlapOnly=True)
+    assert stats["rows"] == 0
+    assert rowList == []
+
+
+def test_invalid_arguments(tmp_path):
+    filename = _createLog(tmp_path / "psu.log", [(0, 1.0)])
+    with pytest.raises(ETMXXXXPError):
+        _merge([filename], mode="cubic")
+    with pytest.raises(ETMXXXXPError):
+        _merge([filename], step=0)
+    with pytest.raises(ETMXXXXPError):
+        _merge([str(tmp_path / "missing.log")])
+
+
+def test_device_names_are_unique():
+    assert getDeviceNames(["a/psu.log", "b/psu.log", "b/io.log"]) == ["psu", "psu_2", "io"]
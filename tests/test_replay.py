@@ -0,0 +1,117 @@
+import threading
+
+from time import monotonic, sleep
+from datetime import datetime, timedelta
+
+from rs310p_dc_psu.logfile import Reading
+from rs310p_dc_psu.replay import LogReplayer
+from rs310p_dc_psu.samples import SampleStore
+
+START_TIME = datetime(2026, 1, 1, 12, 0, 0)
+# The maximum time to wait for the replay thread.
+WAIT_SECONDS = 5.0
+
+
+def _createSamples(count, periodSeconds=1.0):
+    """@return A SampleStore holding count readings periodSeconds apart. The amps value is the index of the reading."""
+    return SampleStore.fromReadings(Reading(START_TIME + timedelta(seconds=index * periodSeconds), 5.0, float(index), 5.0 * index) for index in range(count))
+
+
+def _waitUntil(condition):
+    """@brief Wait for a condition to become True."""
+    stopTime = monotonic() + WAIT_SECONDS
+    while not condition():
+        assert monotonic() < stopTime
+        sleep(0.01)
+
+
+class ReadingRecorder(object):
+    """@brief Records the readings passed to the reading callback."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.readingList = []
+
+    def __call__(self, reading, seekCount):
+        with self.lock:
+            self.readingList.append((reading.amps, seekCount))
+
+    def getAmpsList(self):
+        with self.lock:
+            return [amps for amps, _ in self.readingList]
+
+
+def test_replay_as_fast_as_possible():
+    recorder = ReadingRecorder()
+    replayer = LogReplayer(_createSamples(100), recorder, speed=0)
+    assert replayer.getDuration() == 99.0
+    replayer.start()
+    _waitUntil(lambda: len(recorder.getAmpsList()) == 100)
+    _waitUntil(replayer.isPaused)
+    replayer.stop()
+    assert recorder.getAmpsList() == [float(index) for index in range(100)]
+    assert replayer.getPosition() == (100, 99.0)
+
+
+def test_replay_at_recorded_speed_multiple():
+    recorder = ReadingRecorder()
+    replayer = LogReplayer(_createSamples(5), recorder, speed=10)
+    startTime = monotonic()
+    replayer.start()
+    _waitUntil(lambda: len(recorder.getAmpsList()) == 5)
+    elapsed = monotonic() - startTime
+    replayer.stop()
+    # 4 seconds of readings at ten times the recorded speed
+    assert 0.35 <= elapsed < 2.0
+
+
+def test_pause_and_resume():
+    recorder = ReadingRecorder()
+
+    def pauseAfterThree(reading, seekCount):
+        recorder(reading, seekCount)
+        if reading.amps == 2.0:
+            replayer.pause()
+
+    replayer = LogReplayer(_createSamples(10), pauseAfterThree, speed=0)
+    replayer.start()
+    _waitUntil(lambda: len(recorder.getAmpsList()) == 3)
+    sleep(0.1)
+    assert replayer.isPaused()
+    assert recorder.getAmpsList() == [0.0, 1.0, 2.0]
+    assert replayer.getPosition() == (3, 3.0)
+    replayer.play()
+    _waitUntil(lambda: len(recorder.getAmpsList()) == 10)
+    replayer.stop()
+    assert recorder.getAmpsList() == [float(index) for index in range(10)]
+
+
+def test_seek_moves_position_and_tags_readings():
+    recorder = ReadingRecorder()
+    replayer = LogReplayer(_createSamples(11), recorder, speed=0)
+    replayer.seek(0.5)
+    assert replayer.getPosition() == (5, 5.0)
+    assert replayer.getSeekCount() == 1
+    replayer.start()
+    _waitUntil(lambda: len(recorder.getAmpsList()) == 6)
+    _waitUntil(replayer.isPaused)
+    replayer.stop()
+    assert recorder.readingList == [(float(index), 1) for index in range(5, 11)]
+
+
+def test_seek_limits_fraction_and_play_restarts_at_end():
+    recorder = ReadingRecorder()
+    replayer = LogReplayer(_createSamples(11), recorder, speed=0)
+    replayer.seek(2.0)
+    assert replayer.getPosition() == (10, 10.0)
+    replayer.seek(-1.0)
+    assert replayer.getPosition() == (0, 0.0)
+    replayer.seek(1.0)
+    replayer.start()
+    _waitUntil(lambda: len(recorder.getAmpsList()) == 1)
+    _waitUntil(replayer.isPaused)
+    # The end of the log was reached so play restarts at the start
+    replayer.play()
+    _waitUntil(lambda: len(recorder.getAmpsList()) == 12)
+    replayer.stop()
+    assert recorder.getAmpsList() == [10.0] + [float(index) for index in range(11)]
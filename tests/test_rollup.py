@@ -0,0 +1,98 @@
+import pytest
+
+from datetime import datetime, timedelta
+
+from rs310p_dc_psu.logfile import Reading, writeLog, formatLine
+from rs310p_dc_psu.rollup import RollupBucket, RollupWriter, parseRollupLine, readRollup, backfillRollups, selectTier
+
+START_TIME = datetime(2026, 1, 1, 12, 0, 0)
+
+
+def _reading(seconds, volts=5.0, amps=1.0):
+    return Reading(START_TIME + timedelta(seconds=seconds), volts, amps, volts * amps)
+
+
+def test_bucket_holds_min_max_mean_and_last():
+    bucket = RollupBucket(START_TIME.timestamp())
+    bucket.add([5.0, 1.0, 5.0])
+    bucket.add([4.0, 3.0, 12.0])
+    bucket.add([6.0, 2.0, 12.0])
+    assert bucket.count == 3
+    assert bucket.minList == [4.0, 1.0, 5.0]
+    assert bucket.maxList == [6.0, 3.0, 12.0]
+    assert bucket.getMeanList() == pytest.approx([5.0, 2.0, 29.0 / 3])
+    assert bucket.lastList == [6.0, 2.0, 12.0]
+
+
+def test_bucket_line_round_trip():
+    bucket = RollupBucket(START_TIME.timestamp())
+    bucket.add([5.0, 1.0, 5.0])
+    bucket.add([3.0, 2.0, 6.0])
+    parsedBucket = parseRollupLine(bucket.formatLine())
+    assert parsedBucket.startTime == bucket.startTime
+    assert parsedBucket.count == 2
+    assert parsedBucket.minList == bucket.minList
+    assert parsedBucket.maxList == bucket.maxList
+    assert parsedBucket.getMeanList() == pytest.approx(bucket.getMeanList())
+    assert parseRollupLine("TIME,COUNT\n") is None
+
+
+def test_writer_completes_buckets_per_tier(tmp_path):
+    filename = str(tmp_path / "psu.log")
+    rollupWriter = RollupWriter(filename, mode='w')
+    for seconds in range(180):
+        rollupWriter.add(_reading(seconds, amps=seconds // 60 + 1.0))
+    rollupWriter.close()
+    bucketList = readRollup(filename, "1m")
+    assert [bucket.count for bucket in bucketList] == [60, 60, 60]
+    assert [bucket.getMeanList()[1] for bucket in bucketList] == pytest.approx([1.0, 2.0, 3.0])
+    assert len(readRollup(filename, "1s")) == 180
+    assert [bucket.count for bucket in readRollup(filename, "1h")] == [180]
+
+
+def test_held_values_are_time_weighted(tmp_path):
+    filename = str(tmp_path / "psu.log")
+    rollupWriter = RollupWriter(filename, mode='w')
+    # 10V for 10 seconds then 4V for 50 seconds
+    rollupWriter.addHeld(_reading(0, volts=10.0), _reading(10).time.timestamp())
+    rollupWriter.addHeld(_reading(10, volts=4.0), _reading(60).time.timestamp())
+    rollupWriter.close()
+    bucketList = readRollup(filename, "1m")
+    assert len(bucketList) == 1
+    assert bucketList[0].count == 2
+    assert bucketList[0].getMeanList()[0] == pytest.approx(5.0)
+    # Each 1s bucket holds the value held during that second
+    secondBucketList = readRollup(filename, "1s")
+    assert len(secondBucketList) == 60
+    assert secondBucketList[9].getMeanList()[0] == pytest.approx(10.0)
+    assert secondBucketList[10].getMeanList()[0] == pytest.approx(4.0)
+
+
+def test_buckets_written_by_restarted_recordings_are_merged(tmp_path):
+    filename = str(tmp_path / "psu.log")
+    for seconds, amps in ((0, 1.0), (30, 3.0)):
+        rollupWriter = RollupWriter(filename)
+        rollupWriter.add(_reading(seconds, amps=amps))
+        rollupWriter.close()
+    bucketList = readRollup(filename, "1m")
+    assert len(bucketList) == 1
+    assert bucketList[0].count == 2
+    assert bucketList[0].getMeanList()[1] == pytest.approx(2.0)
+
+
+def test_select_tier(tmp_path):
+    filename = str(tmp_path / "psu.log")
+    readingList = [_reading(seconds) for seconds in range(0, 7200, 2)]
+    writeLog(filename, readingList)
+    # No tier files
+    assert selectTier(filename, 100) is None
+    assert backfillRollups(filename) == len(readingList)
+    assert selectTier(filename, 100) == "1m"
+    assert selectTier(filename, 1) == "1h"
+    assert selectTier(filename, 1000) == "1s"
+    # No tier has fewer points than the log
+    assert selectTier(filename, 10000) is None
+    # Readings added to the log without updating the tiers
+    with open(filename, 'a') as fd:
+        fd.write(formatLine(_reading(7300)))
+    assert selectTier(filename, 100) is None
@@ -0,0 +1,111 @@
+import pytest
+
+from datetime import datetime, timedelta
+
+from rs310p_dc_psu.logfile import Reading, writeLog
+from rs310p_dc_psu.samples import SampleStore, loadSamples, toSeconds, toDatetime
+
+START_TIME = datetime(2026, 1, 1, 12, 0, 0)
+
+
+def _createSamples(count):
+    """@return A SampleStore holding count readings a second apart. The amps value is the index of the reading."""
+    sampleStore = SampleStore()
+    startSeconds = toSeconds(START_TIME)
+    for index in range(count):
+        sampleStore.append(startSeconds + index, 5.0, float(index), 5.0 * index)
+    return sampleStore
+
+
+def test_time_conversion_round_trip():
+    timeStamp = START_TIME + timedelta(microseconds=123456)
+    assert toDatetime(toSeconds(timeStamp)) == timeStamp
+
+
+def test_index_and_iterate():
+    sampleStore = _createSamples(5)
+    assert len(sampleStore) == 5
+    assert sampleStore[0].time == START_TIME
+    assert sampleStore[-1].amps == 4.0
+    assert [reading.amps for reading in sampleStore] == [0.0, 1.0, 2.0, 3.0, 4.0]
+    with pytest.raises(IndexError):
+        sampleStore[5]
+    with pytest.raises(IndexError):
+        sampleStore[-6]
+
+
+def test_get_column_slice():
+    sampleStore = _createSamples(10)
+    column = sampleStore.getColumn(SampleStore.AMPS, 2, 5)
+    assert isinstance(column, memoryview)
+    assert list(column) == [2.0, 3.0, 4.0]
+    assert len(sampleStore.getColumn(SampleStore.VOLTS, 8, 100)) == 2
+    column.release()
+
+
+def test_discard_before_compaction():
+    sampleStore = _createSamples(10)
+    memoryBytes = sampleStore.getMemoryBytes()
+    sampleStore.discard(4)
+    assert len(sampleStore) == 6
+    assert sampleStore[0].amps == 4.0
+    assert list(sampleStore.getColumn(SampleStore.AMPS)) == [4.0, 5.0, 6.0, 7.0, 8.0, 9.0]
+    # The discarded samples are only removed from the columns when enough have been discarded
+    assert sampleStore.getMemoryBytes() == memoryBytes
+    sampleStore.discard(100)
+    assert len(sampleStore) == 0
+
+
+def test_discard_compacts_columns():
+    count = SampleStore.MIN_COMPACT_COUNT * 4
+    sampleStore = _createSamples(count)
+    memoryBytes = sampleStore.getMemoryBytes()
+    discardCount = 0
+    # Discarding a sample at a time as a ring buffer does
+    for _ in range(count - 10):
+        sampleStore.discard(1)
+        discardCount += 1
+        assert sampleStore[0].amps == float(discardCount)
+    assert len(sampleStore) == 10
+    assert sampleStore.getMemoryBytes() < memoryBytes
+    assert list(sampleStore.getColumn(SampleStore.AMPS)) == [float(index) for index in range(count - 10, count)]
+    assert sampleStore.bisectTime(toSeconds(START_TIME) + count - 5) == 5
+
+
+def test_bisect_time():
+    sampleStore = _createSamples(10)
+    startSeconds = toSeconds(START_TIME)
+    assert sampleStore.bisectTime(startSeconds - 1) == 0
+    assert sampleStore.bisectTime(startSeconds + 3) == 3
+    assert sampleStore.bisectTime(startSeconds + 3.5) == 4
+    assert sampleStore.bisectTime(startSeconds + 100) == 10
+    # The index is relative to the first sample held
+    sampleStore.discard(2)
+    assert sampleStore.bisectTime(startSeconds + 3) == 1
+    assert sampleStore.bisectTime(startSeconds) == 0
+
+
+def test_copy_is_independent():
+    sampleStore = _createSamples(5)
+    sampleStore.discard(2)
+    sampleStoreCopy = sampleStore.copy()
+    sampleStore.append(toSeconds(START_TIME) + 5, 5.0, 5.0, 25.0)
+    assert len(sampleStoreCopy) == 3
+    assert sampleStoreCopy[0].amps == 2.0
+
+
+def test_clear():
+    sampleStore = _createSamples(5)
+    sampleStore.discard(1)
+    sampleStore.clear()
+    assert len(sampleStore) == 0
+    assert sampleStore.bisectTime(toSeconds(START_TIME)) == 0
+
+
+def test_load_samples(tmp_path):
+    filename = str(tmp_path / "psu.log")
+    readingList = [Reading(START_TIME + timedelta(seconds=index), 5.0, float(index), 5.0 * index) for index in range(5)]
+    writeLog(filename, readingList)
+    sampleStore = loadSamples(filename)
+    assert [reading.time for reading in sampleStore] == [reading.time for reading in readingList]
+    assert list(sampleStore.getColumn(SampleStore.AMPS)) == [0.0, 1.0, 2.0, 3.0, 4.0]
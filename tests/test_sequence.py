@@ -0,0 +1,133 @@
+import pytest
+
+from rs310p_dc_psu.controller import ETMXXXXPError
+from rs310p_dc_psu.sequence import SequenceStep, SequencePlayer, expandRamps, loadSequence
+
+# The maximum allowed difference between the planned and actual step times.
+MAX_ERROR_MS = 50.0
+
+
+class FakePSU(object):
+    """@brief Records the commands sent by the sequence player."""
+
+    def __init__(self):
+        self.commandList = []
+
+    def setOutput(self, on, urgent=False):
+        self.commandList.append(("output", on))
+
+    def setVoltage(self, volts):
+        self.commandList.append(("volts", volts))
+
+    def setCurrentLimit(self, amps):
+        self.commandList.append(("amps", amps))
+
+    def setVoltageAndCurrentLimit(self, volts, amps):
+        self.commandList.append(("volts_amps", volts, amps))
+
+    def getOutputStats(self):
+        return (5.0, 0.1, 0.5)
+
+
+class TrippedWatchdog(object):
+    """@brief A watchdog that has already tripped."""
+
+    def isTripped(self):
+        return True
+
+
+def test_expand_ramps_interpolates_between_steps():
+    stepList = [SequenceStep(0.0, volts=0.0, amps=1.0, output=True),
+                SequenceStep(1.0, volts=10.0, amps=2.0, ramp=True)]
+    expandedList = expandRamps(stepList, 0.25)
+    assert [step.offset for step in expandedList] == [0.0, 0.25, 0.5, 0.75, 1.0]
+    assert [step.volts for step in expandedList] == [0.0, 2.5, 5.0, 7.5, 10.0]
+    assert [step.amps for step in expandedList] == [1.0, 1.25, 1.5, 1.75, 2.0]
+    # The ramp steps only change the voltage and current limit
+    assert [step.output for step in expandedList[1:-1]] == [None, None, None]
+
+
+def test_expand_ramps_leaves_unset_values_unchanged():
+    stepList = [SequenceStep(0.0, volts=5.0),
+                SequenceStep(1.0, volts=6.0, amps=1.0, ramp=True)]
+    expandedList = expandRamps(stepList, 0.5)
+    assert len(expandedList) == 3
+    assert expandedList[1].volts == 5.5
+    assert expandedList[1].amps is None
+
+
+def test_expand_ramps_first_step_is_not_ramped():
+    stepList = [SequenceStep(1.0, volts=5.0, ramp=True)]
+    assert expandRamps(stepList, 0.1) == stepList
+
+
+def test_expand_ramps_rejects_invalid_period():
+    with pytest.raises(ETMXXXXPError):
+        expandRamps([SequenceStep(0.0, volts=5.0)], 0)
+
+
+def test_player_meets_deadlines_and_only_writes_changes():
+    psu = FakePSU()
+    stepList = [SequenceStep(0.0, volts=5.0, amps=1.0, output=True),
+                SequenceStep(0.1, volts=6.0, amps=1.0),
+                SequenceStep(0.2, volts=6.0, amps=2.0),
+                SequenceStep(0.3, volts=3.0, amps=0.5, output=False)]
+    resultList = SequencePlayer(psu, stepList, measure=False).run()
+    assert [result.plannedTime for result in resultList] == [0.0, 0.1, 0.2, 0.3]
+    for result in resultList:
+        assert 0 <= result.getErrorMS() < MAX_ERROR_MS
+    assert psu.commandList == [("volts_amps", 5.0, 1.0),
+                               ("output", True),
+                               ("volts", 6.0),
+                               ("amps", 2.0),
+                               ("output", False),
+                               ("volts_amps", 3.0, 0.5)]
+
+
+def test_player_measures_between_steps():
+    psu = FakePSU()
+    measurementList = []
+    stepList = [SequenceStep(0.0, volts=5.0), SequenceStep(0.5, volts=6.0)]
+    player = SequencePlayer(psu, stepList, measurementCallback=lambda reading, sampleTime: measurementList.append(reading))
+    resultList = player.run()
+    assert len(measurementList) > 0
+    assert measurementList[0].volts == 5.0
+    assert 0 <= resultList[-1].getErrorMS() < MAX_ERROR_MS
+
+
+def test_player_repeats_sequence():
+    psu = FakePSU()
+    stepList = [SequenceStep(0.0, volts=5.0), SequenceStep(0.1, volts=6.0)]
+    resultList = SequencePlayer(psu, stepList, measure=False).run(repeatCount=3)
+    # The last step of each repeat is replaced by the first step of the next repeat
+    assert [result.plannedTime for result in resultList] == pytest.approx([0.0, 0.1, 0.2, 0.3])
+    assert [result.step.volts for result in resultList] == [5.0, 5.0, 5.0, 6.0]
+    for result in resultList:
+        assert 0 <= result.getErrorMS() < MAX_ERROR_MS
+
+
+def test_player_stops_when_watchdog_tripped():
+    psu = FakePSU()
+    player = SequencePlayer(psu, [SequenceStep(0.0, volts=5.0, output=True)], measure=False, watchdog=TrippedWatchdog())
+    with pytest.raises(ETMXXXXPError):
+        player.run()
+    assert psu.commandList == []
+
+
+def test_load_csv_sequence(tmp_path):
+    filename = tmp_path / "seq.csv"
+    filename.write_text("TIME,VOLTS,AMPS,OUTPUT,RAMP\n"
+                        "1.0,6.0,,,yes\n"
+                        "0,5.0,1.0,on,\n")
+    stepList = loadSequence(str(filename))
+    assert [step.offset for step in stepList] == [0.0, 1.0]
+    assert stepList[0].output is True
+    assert stepList[1].amps is None
+    assert stepList[1].ramp
+
+
+def test_load_invalid_sequence(tmp_path):
+    filename = tmp_path / "seq.csv"
+    filename.write_text("TIME,VOLTS\nabc,5.0\n")
+    with pytest.raises(ETMXXXXPError):
+        loadSequence(str(filename))
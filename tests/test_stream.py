@@ -0,0 +1,111 @@
+import json
+import threading
+
+from datetime import datetime, timedelta
+
+from rs310p_dc_psu.logfile import HEADER, Reading
+from rs310p_dc_psu.stream import ReadingStream
+
+START_TIME = datetime(2026, 1, 1, 12, 0, 0)
+# The maximum time to wait for the background thread.
+WAIT_SECONDS = 5.0
+
+
+class GatedFile(object):
+    """@brief A file that blocks each write until it is opened, as a slow consumer does."""
+
+    def __init__(self):
+        self.text = ""
+        self.writing = threading.Event()
+        self.gate = threading.Event()
+
+    def write(self, text):
+        self.writing.set()
+        assert self.gate.wait(WAIT_SECONDS)
+        self.text += text
+
+    def flush(self):
+        pass
+
+
+class ClosedFile(object):
+    """@brief A file whose consumer has exited."""
+
+    def write(self, text):
+        raise BrokenPipeError()
+
+    def flush(self):
+        pass
+
+
+def _reading(index):
+    return Reading(START_TIME + timedelta(seconds=index), 5.0, index / 10.0, index / 2.0)
+
+
+def _getAmpsList(text):
+    return [json.loads(line)["amps"] for line in text.splitlines()]
+
+
+def test_drop_policy_drops_oldest_queued_readings():
+    fd = GatedFile()
+    stream = ReadingStream(fd, policy=ReadingStream.DROP, queueSize=2, batchSize=1)
+    stream.add(_reading(1))
+    # The writer holds reading 1 until the gate is opened
+    assert fd.writing.wait(WAIT_SECONDS)
+    for index in range(2, 6):
+        stream.add(_reading(index))
+    stats = stream.getStats()
+    assert stats["dropped"] == 2
+    assert stats["queued"] == 2
+    fd.gate.set()
+    stream.close()
+    assert _getAmpsList(fd.text) == [0.1, 0.4, 0.5]
+    stats = stream.getStats()
+    assert stats["written"] == 3
+    assert stats["blocked"] == 0
+
+
+def test_block_policy_waits_for_consumer():
+    fd = GatedFile()
+    stream = ReadingStream(fd, policy=ReadingStream.BLOCK, queueSize=1, batchSize=1)
+    stream.add(_reading(1))
+    assert fd.writing.wait(WAIT_SECONDS)
+    stream.add(_reading(2))
+    thread = threading.Thread(target=stream.add, args=(_reading(3),))
+    thread.start()
+    thread.join(0.2)
+    # The queue is full so the caller is blocked
+    assert thread.is_alive()
+    assert stream.getStats()["blocked"] == 1
+    fd.gate.set()
+    thread.join(WAIT_SECONDS)
+    assert not thread.is_alive()
+    stream.close()
+    assert _getAmpsList(fd.text) == [0.1, 0.2, 0.3]
+    stats = stream.getStats()
+    assert stats["dropped"] == 0
+    assert stats["blockedSeconds"] > 0
+
+
+def test_broken_stream_does_not_block():
+    stream = ReadingStream(ClosedFile(), policy=ReadingStream.BLOCK, queueSize=1)
+    stream.add(_reading(0))
+    stream.close()
+    assert stream.isBroken()
+    # Readings are discarded once the consumer has gone
+    for index in range(1, 4):
+        stream.add(_reading(index))
+    assert stream.getStats()["queued"] == 0
+
+
+def test_csv_stream_writes_header_and_comments():
+    fd = GatedFile()
+    fd.gate.set()
+    stream = ReadingStream(fd, streamFormat=ReadingStream.CSV, commentList=["PSU=test"])
+    stream.add(_reading(1))
+    stream.close()
+    lines = fd.text.splitlines(keepends=True)
+    assert lines[0] == HEADER
+    assert lines[1] == "# PSU=test\n"
+    assert len(lines) == 3
+    assert stream.getStats()["bytes"] == len(fd.text)
@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta
+
+from rs310p_dc_psu.logfile import Reading, readMetadata, readReadings
+from rs310p_dc_psu.trigger import TriggerCondition, TriggerCapture
+
+START_TIME = datetime(2026, 1, 1, 12, 0, 0)
+
+
+def _reading(index, amps):
+    return Reading(START_TIME + timedelta(seconds=index), 5.0, amps, 5.0 * amps)
+
+
+def _addReadings(triggerCapture, ampsList):
+    """@return A list of the capture filenames returned by addReading()."""
+    filenameList = []
+    for index, amps in enumerate(ampsList):
+        filename = triggerCapture.addReading(_reading(index, amps))
+        if filename:
+            filenameList.append(filename)
+    return filenameList
+
+
+def test_capture_holds_pre_and_post_trigger_windows(tmp_path):
+    triggerCapture = TriggerCapture([TriggerCondition.parse("amps:rising:1")], 3, 2, str(tmp_path / "psu"))
+    ampsList = [0.1, 0.2, 0.3, 0.4, 0.5, 1.5, 0.6, 0.7, 0.8, 0.9]
+    filenameList = _addReadings(triggerCapture, ampsList)
+    triggerCapture.close()
+    assert filenameList == [str(tmp_path / "psu_capture_0001.log")]
+    readingList = list(readReadings(filenameList[0]))
+    # 3 readings before the trigger reading and 2 after it
+    assert [reading.amps for reading in readingList] == ampsList[2:8]
+    assert readingList[0].time == START_TIME + timedelta(seconds=2)
+    metadataDict = readMetadata(filenameList[0])
+    assert metadataDict["TRIGGER"] == "amps:rising:1.0"
+
+
+def test_capture_near_start_holds_available_pre_trigger_readings(tmp_path):
+    triggerCapture = TriggerCapture([TriggerCondition.parse("amps:above:1")], 5, 1, str(tmp_path / "psu"))
+    filenameList = _addReadings(triggerCapture, [0.1, 1.5, 0.2, 0.3])
+    triggerCapture.close()
+    assert len(filenameList) == 1
+    assert [reading.amps for reading in readReadings(filenameList[0])] == [0.1, 1.5, 0.2]
+
+
+def test_trigger_rearms_after_capture(tmp_path):
+    triggerCapture = TriggerCapture([TriggerCondition.parse("amps:rising:1")], 1, 1, str(tmp_path / "psu"))
+    filenameList = _addReadings(triggerCapture, [0.1, 1.5, 0.2, 0.3, 1.2, 0.4])
+    triggerCapture.close()
+    assert len(filenameList) == 2
+    assert [reading.amps for reading in readReadings(filenameList[1])] == [0.3, 1.2, 0.4]
+
+
+def test_flush_saves_incomplete_post_trigger_window(tmp_path):
+    triggerCapture = TriggerCapture([TriggerCondition.parse("amps:above:1")], 1, 10, str(tmp_path / "psu"))
+    assert _addReadings(triggerCapture, [0.1, 1.5, 0.2]) == []
+    filename = triggerCapture.flush()
+    triggerCapture.close()
+    assert [reading.amps for reading in readReadings(filename)] == [0.1, 1.5, 0.2]
+
+
+def test_existing_capture_is_not_overwritten(tmp_path):
+    (tmp_path / "psu_capture_0001.log").write_text("")
+    triggerCapture = TriggerCapture([TriggerCondition.parse("amps:above:1")], 0, 0, str(tmp_path / "psu"))
+    filenameList = _addReadings(triggerCapture, [1.5])
+    triggerCapture.close()
+    assert filenameList == [str(tmp_path / "psu_capture_0002.log")]
+    assert (tmp_path / "psu_capture_0001.log").read_text() == ""
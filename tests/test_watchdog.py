@@ -0,0 +1,85 @@
+import pytest
+
+from rs310p_dc_psu.controller import ETMXXXXPError
+from rs310p_dc_psu.logfile import Reading
+from rs310p_dc_psu.watchdog import WatchdogRule, Watchdog
+
+
+class FakePSU(object):
+    """@brief Records the output commands sent by the watchdog. The first failCount commands fail."""
+
+    def __init__(self, failCount=0):
+        self.failCount = failCount
+        self.commandList = []
+
+    def setOutput(self, on, urgent=False):
+        self.commandList.append((on, urgent))
+        if self.failCount > 0:
+            self.failCount -= 1
+            raise ETMXXXXPError("No response from the PSU.")
+
+
+def _reading(volts=5.0, amps=0.5):
+    return Reading(None, volts, amps, volts * amps)
+
+
+def test_trip_turns_output_off():
+    psu = FakePSU()
+    watchdog = Watchdog(psu, [WatchdogRule.parse("amps:above:1")])
+    assert watchdog.check(_reading(amps=0.9), 0.0) is None
+    trip = watchdog.check(_reading(amps=1.1), 0.1)
+    assert trip is not None
+    assert watchdog.isTripped()
+    assert psu.commandList == [(False, True)]
+    # No more commands once tripped
+    assert watchdog.check(_reading(amps=2.0), 0.2) is None
+    assert psu.commandList == [(False, True)]
+
+
+def test_duration_rule_trips_after_period():
+    psu = FakePSU()
+    watchdog = Watchdog(psu, [WatchdogRule.parse("volts:above:10:50")])
+    assert watchdog.check(_reading(volts=11.0), 1.0) is None
+    assert watchdog.check(_reading(volts=11.0), 1.04) is None
+    assert watchdog.check(_reading(volts=11.0), 1.05) is not None
+
+
+def test_failed_output_off_is_retried():
+    psu = FakePSU(failCount=2)
+    watchdog = Watchdog(psu, [WatchdogRule.parse("volts:rate:10")])
+    assert watchdog.check(_reading(volts=5.0), 0.0) is None
+    with pytest.raises(ETMXXXXPError):
+        watchdog.check(_reading(volts=10.0), 0.1)
+    assert not watchdog.isTripped()
+    # The rate is now within the limit but the output has not been turned off yet.
+    with pytest.raises(ETMXXXXPError):
+        watchdog.check(_reading(volts=10.0), 0.2)
+    assert not watchdog.isTripped()
+    trip = watchdog.check(_reading(volts=10.0), 0.3)
+    assert trip is not None
+    assert "rate" in trip.message
+    assert watchdog.isTripped()
+    assert psu.commandList == [(False, True)] * 3
+    assert len(watchdog.getTrips()) == 1
+
+
+def test_reset_rearms():
+    psu = FakePSU()
+    watchdog = Watchdog(psu, [WatchdogRule.parse("amps:band:0.1:1")])
+    assert watchdog.check(_reading(amps=1.5), 0.0) is not None
+    watchdog.reset()
+    assert not watchdog.isTripped()
+    assert watchdog.check(_reading(amps=0.5), 0.1) is None
+    assert watchdog.check(_reading(amps=0.05), 0.2) is not None
+    assert len(watchdog.getTrips()) == 2
+
+
+def test_incomplete_rule_fails_when_created():
+    from rs310p_dc_psu.watchdog import _DurationRule
+
+    class IncompleteRule(_DurationRule):
+        def _isViolated(self, value):
+            return value > 1.0
+
+    with pytest.raises(TypeError):
+        IncompleteRule("volts", 0)